@@ -0,0 +1,235 @@
+"""`crawler analyze`: summarise, compare and gate crawler runs.
+
+Reads crawler run logs (`crawler_logs/*_crawler.log`) line by line, or the
+`*_results.json` files written by stats.py, groups the events by action and
+outcome and reports throughput and latency percentiles per action. With more
+than one run, every later run is compared against the first one: percentile
+deltas plus a Mann-Whitney U test on the latency samples to tell a real
+shift from noise. Budgets such as `--budget p95=0.5` or
+`--budget post:p99=1.2` (seconds) are checked against the last run given,
+and the exit status is non-zero when one is exceeded, so the command can
+gate a deployment.
+"""
+from collections import defaultdict
+from datetime import datetime
+from string import Formatter
+import argparse
+import json
+import math
+import re
+
+from http_engine import MESSAGES
+from stats import Histogram, PERCENTILES
+
+LINE_RE = re.compile(r'^(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - (?P<level>\w+) - (?P<message>.*)$')
+DURATION_RE = r'(?:: \(Duration (?P<duration>[\d.]+) s\))?$'
+OUTCOMES = ('ok', 'failed', 'error')
+
+def template_regex(template):
+    """Turn a MESSAGES template into a regex with one group per field."""
+    pattern = ''
+    for literal, field, _, _ in Formatter().parse(template):
+        pattern += re.escape(literal)
+        if field:
+            pattern += f'(?P<{field}>.+?)'
+    return pattern
+
+# (action, outcome, regex) for every line an action can log
+PATTERNS = []
+for action, (success, failure, error) in MESSAGES.items():
+    PATTERNS.append((action, 'ok', re.compile('^' + template_regex(success) + DURATION_RE)))
+    PATTERNS.append((action, 'failed', re.compile('^' + template_regex(failure) + DURATION_RE)))
+    PATTERNS.append((action, 'error', re.compile('^' + template_regex(error) + ': ')))
+
+class ActionSummary:
+    def __init__(self):
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.latency = Histogram()
+        self.samples = []
+
+    @property
+    def count(self):
+        return sum(self.outcomes.values())
+
+    def add(self, outcome, duration=None, count=1):
+        self.outcomes[outcome] += count
+        if duration is not None:
+            self.latency.record(duration, count)
+            self.samples.extend([duration] * count)
+
+class RunSummary:
+    def __init__(self, name):
+        self.name = name
+        self.actions = defaultdict(ActionSummary)
+        self.duration = 0.0
+
+    def throughput(self, action):
+        summary = self.actions.get(action)
+        if summary is None or not self.duration:
+            return 0.0
+        return summary.count / self.duration
+
+def read_log(path):
+    run = RunSummary(path)
+    first = last = None
+    with open(path, errors='replace') as f:
+        for line in f:
+            match = LINE_RE.match(line.rstrip('\n'))
+            if not match:
+                continue
+            message = match['message']
+            for action, outcome, pattern in PATTERNS:
+                event = pattern.match(message)
+                if event:
+                    break
+            else:
+                continue
+            when = datetime.strptime(match['time'], '%Y-%m-%d %H:%M:%S,%f')
+            duration = event.groupdict().get('duration')
+            duration = float(duration) if duration else None
+            started = when.timestamp() - (duration or 0.0)
+            first = started if first is None else min(first, started)
+            last = when.timestamp() if last is None else max(last, when.timestamp())
+            run.actions[action].add(outcome, duration)
+    if first is not None:
+        run.duration = last - first
+    return run
+
+def read_results(path):
+    with open(path) as f:
+        results = json.load(f)
+    run = RunSummary(path)
+    run.duration = results.get('duration', 0.0)
+    for action, data in results['actions'].items():
+        summary = run.actions[action]
+        summary.latency = Histogram({int(i): n for i, n in data['histogram'].items()})
+        summary.samples = list(summary.latency.samples())
+        summary.outcomes['ok'] = data['count'] - data['errors']
+        summary.outcomes['failed'] = data['errors']
+    return run
+
+def read_run(path):
+    return read_results(path) if path.endswith('.json') else read_log(path)
+
+def mann_whitney(a, b):
+    """Two-sided p-value that samples `a` and `b` come from one distribution.
+
+    Normal approximation with tie correction, which is fine for the sample
+    sizes a load test produces; returns 1.0 when either side is empty.
+    """
+    n1, n2 = len(a), len(b)
+    if not n1 or not n2:
+        return 1.0
+    combined = sorted([(value, 0) for value in a] + [(value, 1) for value in b])
+    n = n1 + n2
+    rank_sum = 0.0
+    ties = 0.0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        rank = (i + j) / 2 + 1
+        rank_sum += rank * sum(1 for k in range(i, j + 1) if combined[k][1] == 0)
+        t = j - i + 1
+        ties += t ** 3 - t
+        i = j + 1
+    u = rank_sum - n1 * (n1 + 1) / 2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))) if n > 1 else 0.0
+    if variance <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2) / math.sqrt(variance)
+    return math.erfc(abs(z) / math.sqrt(2))
+
+def print_summary(run):
+    print(f"Run {run.name} ({run.duration:.1f} s)")
+    header = (f"{'action':<22}{'ok':>7}{'failed':>8}{'error':>7}{'req/s':>9}"
+              + ''.join(f"{'p' + format(p, 'g'):>10}" for p in PERCENTILES))
+    print(header)
+    print('-' * len(header))
+    for action, summary in sorted(run.actions.items()):
+        outcomes = summary.outcomes
+        # old logs have no durations, only counts
+        latencies = [f"{summary.latency.percentile(p) * 1e3:>10.1f}" if summary.latency.total
+                     else f"{'-':>10}" for p in PERCENTILES]
+        print(f"{action:<22}{outcomes['ok']:>7}{outcomes['failed']:>8}{outcomes['error']:>7}"
+              f"{run.throughput(action):>9.2f}" + ''.join(latencies))
+    print()
+
+def print_comparison(baseline, candidate, alpha):
+    """Compare `candidate` against `baseline`; return the actions that got slower."""
+    print(f"Comparing {candidate.name} against {baseline.name}")
+    header = (f"{'action':<22}{'req/s':>16}" + ''.join(f"{'p' + format(p, 'g'):>24}" for p in (50, 95, 99))
+              + f"{'p-value':>10}  verdict")
+    print(header)
+    print('-' * len(header))
+    regressions = []
+    for action in sorted(set(baseline.actions) | set(candidate.actions)):
+        before = baseline.actions.get(action, ActionSummary())
+        after = candidate.actions.get(action, ActionSummary())
+        p_value = mann_whitney(before.samples, after.samples)
+        verdict = 'no significant change'
+        if p_value < alpha:
+            slower = after.latency.percentile(50) > before.latency.percentile(50)
+            verdict = 'slower' if slower else 'faster'
+            if slower:
+                regressions.append(action)
+        cells = [f"{baseline.throughput(action):.1f} -> {candidate.throughput(action):.1f}"]
+        for p in (50, 95, 99):
+            old, new = before.latency.percentile(p), after.latency.percentile(p)
+            change = f" ({(new - old) / old:+.0%})" if old else ''
+            cells.append(f"{old * 1e3:.0f}->{new * 1e3:.0f}ms{change}")
+        print(f"{action:<22}{cells[0]:>16}" + ''.join(f"{cell:>24}" for cell in cells[1:])
+              + f"{p_value:>10.3g}  {verdict}")
+    print()
+    return regressions
+
+def parse_budget(budget):
+    """`p95=0.5` (every action) or `post:p95=0.5` -> (action, percentile, seconds)."""
+    match = re.fullmatch(r'(?:(?P<action>\w+):)?p(?P<percentile>[\d.]+)=(?P<limit>[\d.]+)', budget)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid budget '{budget}', expected [action:]pNN=SECONDS")
+    return match['action'], float(match['percentile']), float(match['limit'])
+
+def check_budgets(run, budgets):
+    """Return a message for every budget `run` exceeds."""
+    breaches = []
+    for action_name, percentile, limit in budgets:
+        actions = [action_name] if action_name else sorted(run.actions)
+        for action in actions:
+            summary = run.actions.get(action)
+            if summary is None or not summary.latency.total:
+                continue
+            value = summary.latency.percentile(percentile)
+            if value > limit:
+                breaches.append(f"{action} p{percentile:g} {value * 1e3:.1f} ms exceeds budget of {limit * 1e3:.1f} ms")
+    return breaches
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='crawler analyze', description=__doc__.splitlines()[0])
+    parser.add_argument('runs', nargs='+', help='run logs or *_results.json files; the first is the baseline')
+    parser.add_argument('--budget', action='append', type=parse_budget, default=[],
+                        help='latency budget for the last run, e.g. p95=0.5 or post:p99=1.2 (seconds)')
+    parser.add_argument('--alpha', type=float, default=0.05,
+                        help='significance level for run comparisons (default: 0.05)')
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='also exit non-zero when an action got significantly slower')
+    options = parser.parse_args(args)
+
+    runs = [read_run(path) for path in options.runs]
+    for run in runs:
+        print_summary(run)
+
+    regressions = []
+    for candidate in runs[1:]:
+        regressions.extend(print_comparison(runs[0], candidate, options.alpha))
+
+    breaches = check_budgets(runs[-1], options.budget)
+    for breach in breaches:
+        print(f"BUDGET EXCEEDED: {breach}")
+    if breaches:
+        return 1
+    if options.fail_on_regression and regressions:
+        print(f"REGRESSION: {', '.join(dict.fromkeys(regressions))} significantly slower than {runs[0].name}")
+        return 1
+    return 0
@@ -0,0 +1,150 @@
+"""Capacity search: step the offered load up until the server breaks its SLO.
+
+Each step holds one open-loop arrival rate (see loadgen.py) for a fixed
+time with the same population of virtual users, then looks at that step
+alone: the p95 of the coordinated-omission corrected latency, the error
+rate (failed and dropped arrivals) and the throughput actually achieved.
+The search stops at the first step that breaks the SLO. The last step
+that held it is the maximum sustainable throughput; the knee is the first
+step whose p95 is more than KNEE_FACTOR times the p95 at the lightest load,
+where queueing starts to show even if the SLO still holds. The run's
+final stats report has all the steps together.
+"""
+import asyncio
+import json
+import logging
+import aiohttp
+
+import loadgen
+import stats
+
+KNEE_FACTOR = 2.0
+
+class Step:
+    def __init__(self, rate, counts, recorder, action):
+        self.rate = rate
+        self.counts = counts
+        action_stats = recorder.actions.get(action, stats.ActionStats())
+        latency = action_stats.corrected if action_stats.corrected.total else action_stats.latency
+        self.p50 = latency.percentile(50)
+        self.p95 = latency.percentile(95)
+        self.p99 = latency.percentile(99)
+        self.breaches = []
+
+    @property
+    def achieved(self):
+        return self.counts['ok'] / self.counts['elapsed'] if self.counts['elapsed'] else 0.0
+
+    @property
+    def error_rate(self):
+        scheduled = self.counts['scheduled']
+        return (self.counts['error'] + self.counts['dropped']) / scheduled if scheduled else 0.0
+
+    def check(self, slo_p95, slo_errors):
+        if self.p95 > slo_p95:
+            self.breaches.append(f"p95 {self.p95 * 1e3:.1f} ms > {slo_p95 * 1e3:.1f} ms")
+        if self.error_rate > slo_errors:
+            self.breaches.append(f"errors {self.error_rate:.1%} > {slo_errors:.1%}")
+        return not self.breaches
+
+    def to_dict(self):
+        return {
+            'rate': self.rate,
+            'achieved': self.achieved,
+            'ok': self.counts['ok'],
+            'errors': self.counts['error'],
+            'dropped': self.counts['dropped'],
+            'error_rate': self.error_rate,
+            'p50': self.p50,
+            'p95': self.p95,
+            'p99': self.p99,
+            'breaches': self.breaches,
+        }
+
+def step_rates(start, step, max_rate):
+    rate = start
+    while rate <= max_rate:
+        yield rate
+        rate += step
+
+async def step_search(base_url, action='post', start=5.0, step=5.0, max_rate=1000.0,
+                      hold=30.0, slo_p95=0.5, slo_errors=0.01, users=100,
+                      arrival='constant'):
+    """Run steps of increasing rate until one breaks the SLO; returns the `Step`s."""
+    connector = aiohttp.TCPConnector(limit=0)
+    population = await loadgen.ready_population(base_url, connector, users)
+    logging.info(f"{len(population)} virtual users ready for the capacity search")
+
+    steps = []
+    # registering the population is setup, not part of the measured run
+    stats.reset()
+    # every step, for the run's final report
+    total = stats.Recorder()
+    try:
+        for rate in step_rates(start, step, max_rate):
+            counts = await loadgen.offer_load(population, base_url, connector, rate, hold,
+                                              action, arrival)
+            window = stats.collect()
+            total.merge(window)
+            current = Step(rate, counts, window, action)
+            steps.append(current)
+            held = current.check(slo_p95, slo_errors)
+            logging.info(f"Capacity step {rate:.1f} req/s: achieved {current.achieved:.1f} req/s, "
+                         f"p95 {current.p95 * 1e3:.1f} ms, errors {current.error_rate:.1%}"
+                         + ('' if held else f", SLO broken: {'; '.join(current.breaches)}"))
+            if not held:
+                break
+    finally:
+        stats.merge(total)
+        for vu in population:
+            await vu.driver.close()
+        await connector.close()
+    return steps
+
+def knee(steps):
+    """The first step whose p95 is KNEE_FACTOR times the lightest step's."""
+    if not steps:
+        return None
+    baseline = steps[0].p95
+    return next((s for s in steps if baseline and s.p95 > KNEE_FACTOR * baseline), None)
+
+def sustainable(steps):
+    """The last step that held the SLO."""
+    held = [s for s in steps if not s.breaches]
+    return held[-1] if held else None
+
+def report(steps, path):
+    """Print the latency curve and verdict, and write them to `path` as JSON."""
+    header = (f"{'offered':>9}{'achieved':>10}{'ok':>8}{'errors':>8}{'dropped':>9}"
+              f"{'p50':>10}{'p95':>10}{'p99':>10}  SLO")
+    lines = ['Capacity search (req/s, corrected latency in ms):', header, '-' * len(header)]
+    for s in steps:
+        lines.append(f"{s.rate:>9.1f}{s.achieved:>10.1f}{s.counts['ok']:>8}{s.counts['error']:>8}"
+                     f"{s.counts['dropped']:>9}{s.p50 * 1e3:>10.1f}{s.p95 * 1e3:>10.1f}"
+                     f"{s.p99 * 1e3:>10.1f}  {'; '.join(s.breaches) or 'ok'}")
+    best, bend = sustainable(steps), knee(steps)
+    verdict = [
+        f"Maximum sustainable throughput: {best.achieved:.1f} req/s (offered {best.rate:.1f})"
+        if best else "Maximum sustainable throughput: none, the first step broke the SLO",
+        f"Knee: {bend.rate:.1f} req/s offered, p95 {bend.p95 * 1e3:.1f} ms"
+        if bend else "Knee: not reached",
+    ]
+    if steps and not steps[-1].breaches:
+        verdict.append("The SLO held up to the highest rate tried; raise --max-rate to find the limit")
+    for line in lines + [''] + verdict:
+        print(line)
+    for line in verdict:
+        logging.info(line)
+
+    with open(path, 'w') as f:
+        json.dump({
+            'steps': [s.to_dict() for s in steps],
+            'sustainable': best.to_dict() if best else None,
+            'knee': bend.to_dict() if bend else None,
+        }, f, indent=2)
+    logging.info(f"Capacity results written to {path}")
+
+def capacity_worker(base_url, action, start, step, max_rate, hold, slo_p95, slo_errors,
+                    users, arrival):
+    return asyncio.run(step_search(base_url, action, start, step, max_rate, hold,
+                                   slo_p95, slo_errors, users, arrival))
@@ -1,374 +1,376 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from queue import Queue
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from collections import Counter
 from datetime import datetime
 import logging
 import os
 import random
 import string
+import subprocess
+import sys
+import threading
 import time
+import requests
 from sys import argv
 from enum import StrEnum
 import multiprocessing as mp
 
+# Engine modules live next to this file, whether we are run as a script or
+# with `python -m crawler.crawler` from the repository root
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import analyze
+import capacity
+from driver_pool import WebDriverPool
+import http_engine
+import loadgen
+import matrix
+import scenario
+import selenium_contexts
+import selenium_engine
+import sessions
+import soak
+import stats
+import traffic
+
 # Set up logging
 log_dir = 'crawler_logs'
 timestamp = datetime.now().strftime('%Y%m%d_%H%M')
 os.makedirs(log_dir, exist_ok=True)
-logging.basicConfig(filename=os.path.join(log_dir, f'{timestamp}_crawler.log'), level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+# delay=True so commands that never log (like analyze) leave no empty log behind
+logging.basicConfig(handlers=[logging.FileHandler(os.path.join(log_dir, f'{timestamp}_crawler.log'), delay=True)],
+                    level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BASE_URL = "http://127.0.0.1:5000"
+# Where `flask snapshot restore` runs for --reset-db
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'microblog')
 
 class Args(StrEnum):
     HEADLESS = "--headless"
     REGISTER = "--register"
     POST = "--post"
     MESSAGE = "--message"
+    ENGINE = "--engine"
+    OPEN_LOOP = "--open-loop"
+    RATE = "--rate"
+    DURATION = "--duration"
+    ARRIVAL = "--arrival"
+    ACTION = "--action"
+    USERS = "--users"
+    PROCESSES = "--processes"
+    PACE = "--pace"
+    SCENARIO = "--scenario"
+    IDLE_TABS = "--idle-tabs"
+    POLL_INTERVAL = "--poll-interval"
+    POOL_SIZE = "--pool-size"
+    BROWSERS = "--browsers"
+    LIGHTWEIGHT = "--lightweight"
+    BLOCK = "--block"
+    RESET_DB = "--reset-db"
+    CAPACITY = "--capacity"
+    MATRIX = "--matrix"
+    START_RATE = "--start-rate"
+    STEP = "--step"
+    MAX_RATE = "--max-rate"
+    HOLD = "--hold"
+    SLO_P95 = "--slo-p95"
+    SLO_ERRORS = "--slo-errors"
+    APP_DIR = "--app-dir"
+    RECORD = "--record"
+    REPLAY = "--replay"
+    SPEED = "--speed"
+    IMPORT_ACCESS_LOG = "--import-access-log"
+    SOAK = "--soak"
+    SAMPLE_INTERVAL = "--sample-interval"
+    SERVER_PID = "--server-pid"
+
+class Engine(StrEnum):
+    SELENIUM = "selenium"
+    HTTP = "http"
+    SELENIUM_CONTEXTS = "selenium-contexts"
+
+ENGINES = {
+    Engine.SELENIUM: selenium_engine,
+    Engine.HTTP: http_engine,
+    Engine.SELENIUM_CONTEXTS: selenium_contexts,
+}
+
+def arg_value(arg, default=None):
+    """Return the value given for `arg` as `--arg value` or `--arg=value`."""
+    for i, value in enumerate(argv):
+        if value == arg and i + 1 < len(argv):
+            return argv[i + 1]
+        if value.startswith(arg + '='):
+            return value[len(arg) + 1:]
+    return default
+
+def get_engine():
+    """The action module picked with --engine (selenium unless told otherwise)."""
+    name = arg_value(Args.ENGINE, Engine.SELENIUM)
+    if name not in ENGINES:
+        raise SystemExit(f"Unknown engine '{name}', expected one of: {', '.join(ENGINES)}")
+    # virtual users per Chrome are only limited by memory, Chromes by CPU
+    selenium_contexts.BROWSERS = int(arg_value(Args.BROWSERS, selenium_contexts.BROWSERS))
+    # measure the Flask server, not image and font downloads (or gravatar timeouts)
+    selenium_engine.LIGHTWEIGHT = Args.LIGHTWEIGHT in argv
+    if arg_value(Args.BLOCK):
+        selenium_engine.BLOCKED_URLS += arg_value(Args.BLOCK).split(',')
+    return ENGINES[Engine(name)]
 
 def generate_random_string():
     letters_and_digits = string.ascii_letters + string.digits
     return ''.join(random.choices(letters_and_digits, k=10))
 
-def edit_bio(username, bio, driver):
-    start_time = time.time()
-    try:
-        profile_link = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.XPATH, "//a[@class='nav-link' and text()='Profile']"))
-        )
-        profile_link.click()
-    except Exception as e:
-        logging.info(e)
-        logging.error(f"Failed to find or click the Profile link: {e}")
-        return
-    try:
-        driver.find_element(By.LINK_TEXT, 'Edit your profile').click()
-        driver.find_element(By.ID, 'about_me').clear()
-        driver.find_element(By.ID, 'about_me').send_keys(bio)
-        driver.find_element(By.ID, 'submit').click()
-        success = driver.find_element(By.CLASS_NAME, 'alert-info').text
-        duration = time.time() - start_time
-        if success == 'Your changes have been saved.':
-            logging.info(f"Bio updated for user '{username}': (Duration {duration:.5f} s)")
-            return True
-        else:
-            logging.error(f"Bio update failed for user '{username}': (Duration {duration:.5f} s)")
-            return False
-    except Exception as e:
-        logging.error(f"An error occurred while editing the bio: {e}")
-        return False
+def pool_size(default=None):
+    return int(arg_value(Args.POOL_SIZE, default or mp.cpu_count()))
 
-def register(username, password, driver):
-    start_time = time.time()
-    driver.find_element(By.LINK_TEXT, 'Click to Register!').click()
-    driver.find_element(By.ID, 'username').send_keys(username)
-    driver.find_element(By.ID, 'email').send_keys(username + '@gmail.com')
-    driver.find_element(By.ID, 'password').send_keys(password)
-    driver.find_element(By.ID, 'password2').send_keys(password)
-    driver.find_element(By.ID, 'submit').click()
-    try:
-        success = WebDriverWait(driver, 10).until(
-            EC.visibility_of_element_located((By.CLASS_NAME, 'alert-info'))
-        ).text
-        duration = time.time() - start_time
-        if success == 'Congratulations, you are now a registered user!':
-            logging.info(f"Registration successful for user '{username}': (Duration {duration:.5f} s)")
-            return True
-        else:
-            logging.error(f"Registration failed for user '{username}': (Duration {duration:.5f} s)")
-            return False
-    except Exception as e:
-        logging.error(f"Failed to get registration success message: {e}")
-        return True
+def init_worker(recording):
+    """mp.Pool initializer: empty stats and trace, recording if the parent is."""
+    stats.reset()
+    traffic.reset(recording)
 
 def register_bench():
-    with mp.Pool() as workers:
+    engine = get_engine()
+    size = pool_size()
+    n_registered = size * 5
+    # each driver used to register 5 users, one every --pace seconds
+    pace = float(arg_value(Args.PACE, 0))
+    with WebDriverPool(engine, size, BASE_URL) as pool:
         start_time = time.time()
-        workers.map(register_worker, range(mp.cpu_count()))
-        workers.close()
-
-    end_time = time.time()
-    total_duration = end_time - start_time
-
-    # each process should be registering 5 users
-    n_registered = mp.cpu_count() * 5
+        tasks = ((generate_random_string(), generate_random_string())
+                 for _ in stats.paced(n_registered, pace / size))
+        pool.map(lambda driver, username, password: engine.register(username, password, driver), tasks)
+        total_duration = time.time() - start_time
 
     logging.info(f"{n_registered} registrations complete in {total_duration}")
 
-def register_worker(_):
-    # each process gets a driver
-    driver_opts = Options()
-    driver_opts.add_argument("--window-size=1920,1080")
-    driver_opts.add_argument('--no-sandbox')
-    driver_opts.add_argument('--disable-dev-shm-usage')
-    driver_opts.add_argument("--headless=new")
-
-    driver = webdriver.Chrome(options=driver_opts)
-    driver.get("http://127.0.0.1:5000")
-
-    # register 5 users
-    for _ in range(5):
+def post_bench():
+    engine = get_engine()
+    size = pool_size()
+    with WebDriverPool(engine, size, BASE_URL) as pool:
+        # register a new user for benchmarking
         username = generate_random_string()
         password = generate_random_string()
-        register(username, password, driver)
-
-    logging.info(f"Process {mp.current_process().name} has finished registering users")
-    driver.quit()
-
-def post_bench():
-    # temp driver to register a new user for benchmarking
-    driver_opts = Options()
-    driver_opts.add_argument("--window-size=1920,1080")
-    driver_opts.add_argument('--no-sandbox')
-    driver_opts.add_argument('--disable-dev-shm-usage')
-    driver_opts.add_argument("--headless=new")
-
-    driver = webdriver.Chrome(options=driver_opts)
-    driver.get("http://127.0.0.1:5000")
-
-    username = generate_random_string()
-    password = generate_random_string()
-    register(username, password, driver)
-
-    driver.quit()
-
-    with mp.Pool() as workers:
-        args = (username, password)
-        all_args = mp.cpu_count() * [args]
-
+        with pool.session() as driver:
+            engine.register(username, password, driver)
+        # the registration is setup, not part of the measured run
+        stats.reset()
+
+        # log in once, before the clock starts
+        session_cache = sessions.SessionCache(BASE_URL)
+        session_cache.get(username, password)
         start_time = time.time()
+        pool.map(post_worker, size * [(username, password, session_cache)])
+        total_duration = time.time() - start_time
 
-        workers.starmap(func=post_worker, iterable=all_args)
-        workers.close()
-
-        end_time = time.time()
-
-    total_duration = end_time - start_time
-
-    n_posts = mp.cpu_count() * 5
+    n_posts = size * 2
     logging.info(f"{n_posts} posts complete in {total_duration}")
 
-def post_worker(username, password):
-    # each process gets a driver
-    driver_opts = Options()
-    driver_opts.add_argument("--window-size=1920,1080")
-    driver_opts.add_argument('--no-sandbox')
-    driver_opts.add_argument('--disable-dev-shm-usage')
-    driver_opts.add_argument("--headless=new")
-
-    driver = webdriver.Chrome(options=driver_opts)
-    driver.get("http://127.0.0.1:5000")
+def post_worker(driver, username, password, session_cache):
+    engine = get_engine()
 
-    # login and get to post screen
-    login(username, password, driver)
+    # reuse the user's one login and get to post screen
+    cookies = session_cache.get(username, password)
+    if cookies is None:
+        return
+    engine.inject_session(driver, cookies)
 
-    for _ in range(2):
+    pace = float(arg_value(Args.PACE, 0))
+    for _ in stats.paced(2, pace):
         # posting their password haha
-        post(username, password, driver)
+        engine.post(username, password, driver)
 
-    logging.info(f"Process {mp.current_process().name} has finished posting")
-    driver.quit()
+    logging.info(f"{threading.current_thread().name} has finished posting")
 
-def forgot_password(email, driver):
-    start_time = time.time()
-    driver.find_element(By.LINK_TEXT, 'Click to Reset It').click()
-    driver.find_element(By.ID, 'email').send_keys(email)
-    driver.find_element(By.ID, 'submit').click()
-    try:
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.CLASS_NAME, 'alert-info'))
-        )
-        success = driver.find_element(By.CLASS_NAME, 'alert-info').text
-        duration = time.time() - start_time
-        if success == 'Check your email for the instructions to reset your password':
-            logging.info(f"Forgot password request sent for email '{email}': (Duration {duration:.5f} s)")
-            return True
-        else:
-            logging.error(f"Forgot password request failed for email '{email}': (Duration {duration:.5f} s)")
-            return False
-    except Exception as e:
-        logging.error(f"An error occurred while waiting for the forgot password confirmation: {e}")
+def process_message_task(driver, username, password, target_username, message, session_cache):
+    """Send a private message as an already logged-in user; the pool resets the driver afterwards."""
+    engine = get_engine()
+    cookies = session_cache.get(username, password)
+    if cookies is None:
         return False
+    engine.inject_session(driver, cookies)
+    return engine.send_private_message(username, target_username, message, driver)
 
-def login(username, password, driver):
-    start_time = time.time()
-    driver.find_element(By.ID, 'username').send_keys(username)
-    driver.find_element(By.ID, 'password').send_keys(password)
-    driver.find_element(By.ID, 'submit').click()
-    try:
-        success = WebDriverWait(driver, 10).until(
-                EC.visibility_of_element_located((By.TAG_NAME, 'h1'))
-        ).text
-        duration = time.time() - start_time
-        if success == 'Hi, ' + username + '!':
-            logging.info(f"Login successful for user '{username}': (Duration {duration:.5f} s)")
-            return True
-        else:
-            logging.error(f"Login failed for user '{username}': (Duration {duration:.5f} s)")
-            return False
-    except Exception as e:
-        logging.info(f"An error occurred during login for '{username}': {e}")
-        return False
+def message_bench():
+    """Every one of --users fresh users sends a private message to another of them."""
+    engine = get_engine()
+    users = [(generate_random_string(), generate_random_string())
+             for _ in range(max(2, int(arg_value(Args.USERS, 10))))]
+    with WebDriverPool(engine, pool_size(min(4, len(users))), BASE_URL) as pool:
+        # register the senders and recipients, so any database will do
+        with pool.session() as driver:
+            for username, password in users:
+                engine.register(username, password, driver)
+        # the registrations are setup, not part of the measured run
+        stats.reset()
+
+        tasks = []
+        for username, password in users:
+            target_username = random.choice([other for other, _ in users if other != username])
+            tasks.append((username, password, target_username, "Hello, this is a test message!"))
+        # log every sender in once, before the clock starts
+        session_cache = sessions.SessionCache(BASE_URL)
+        for username, password, _, _ in tasks:
+            session_cache.get(username, password)
+        start_time = time.time()
+        pool.map(process_message_task, [task + (session_cache,) for task in tasks])
+        total_duration = time.time() - start_time
+    logging.info(f"Total time taken for all messages: {total_duration:.5f} s")
 
-def logout(username, driver):
-    start_time = time.time()
+def open_loop_bench():
+    """Offer a fixed arrival rate, split across --processes asyncio loops."""
+    rate = float(arg_value(Args.RATE, 10))
+    duration = float(arg_value(Args.DURATION, 60))
+    arrival = arg_value(Args.ARRIVAL, 'constant')
+    action = arg_value(Args.ACTION, 'post')
+    users = int(arg_value(Args.USERS, 100))
+    processes = int(arg_value(Args.PROCESSES, 1))
+    if arrival not in loadgen.ARRIVALS:
+        raise SystemExit(f"Unknown arrival process '{arrival}', expected one of: {', '.join(loadgen.ARRIVALS)}")
+    if action not in loadgen.ACTIONS:
+        raise SystemExit(f"Unknown action '{action}', expected one of: {', '.join(loadgen.ACTIONS)}")
+
+    logging.info(f"Open-loop run: {action} at {rate} req/s ({arrival}) for {duration} s, "
+                 f"{users} virtual users in {processes} process(es)")
+    worker_args = (BASE_URL, rate / processes, duration, action, arrival, users // processes or 1)
+    if processes == 1:
+        results = [loadgen.open_loop_worker(*worker_args)]
+    else:
+        with mp.Pool(processes, initializer=init_worker, initargs=(traffic.recording,)) as workers:
+            results = workers.starmap(loadgen.open_loop_worker, processes * [worker_args])
+
+    counts = Counter()
+    for worker_counts, worker_stats, worker_trace in results:
+        counts.update(worker_counts)
+        stats.merge(worker_stats)
+        traffic.merge(worker_trace)
+    counts['duration'] = duration
+    counts['elapsed'] = max(worker_counts['elapsed'] for worker_counts, _, _ in results)
+    loadgen.report(counts, rate)
+
+def capacity_bench():
+    """Step the open-loop rate up until p95 or the error rate breaks the SLO."""
+    action = arg_value(Args.ACTION, 'post')
+    arrival = arg_value(Args.ARRIVAL, 'constant')
+    if action not in loadgen.ACTIONS:
+        raise SystemExit(f"Unknown action '{action}', expected one of: {', '.join(loadgen.ACTIONS)}")
+    if arrival not in loadgen.ARRIVALS:
+        raise SystemExit(f"Unknown arrival process '{arrival}', expected one of: {', '.join(loadgen.ARRIVALS)}")
+    start = float(arg_value(Args.START_RATE, 5))
+    step = float(arg_value(Args.STEP, start))
+    max_rate = float(arg_value(Args.MAX_RATE, 1000))
+    hold = float(arg_value(Args.HOLD, 30))
+    slo_p95 = float(arg_value(Args.SLO_P95, 0.5))
+    slo_errors = float(arg_value(Args.SLO_ERRORS, 0.01))
+    users = int(arg_value(Args.USERS, 100))
+    if start <= 0 or step <= 0:
+        raise SystemExit(f"{Args.START_RATE} and {Args.STEP} must be above 0 req/s")
+
+    logging.info(f"Capacity search: {action} from {start} req/s in steps of {step} held {hold} s, "
+                 f"SLO p95 <= {slo_p95} s and errors <= {slo_errors:.1%}")
+    steps = capacity.capacity_worker(BASE_URL, action, start, step, max_rate, hold,
+                                     slo_p95, slo_errors, users, arrival)
+    capacity.report(steps, os.path.join(log_dir, f'{timestamp}_capacity.json'))
+
+def idle_tabs_bench():
+    """Hold --idle-tabs logged-in tabs polling notifications, split across --processes."""
+    tabs = int(arg_value(Args.IDLE_TABS))
+    interval = float(arg_value(Args.POLL_INTERVAL, 10))
+    duration = float(arg_value(Args.DURATION, 60))
+    users = int(arg_value(Args.USERS, 100))
+    processes = int(arg_value(Args.PROCESSES, 1))
+
+    logging.info(f"Idle tabs run: {tabs} tabs polling every {interval} s for {duration} s, "
+                 f"{users} virtual users in {processes} process(es)")
+    worker_args = (BASE_URL, tabs // processes or 1, duration, users // processes or 1, interval)
+    if processes == 1:
+        results = [loadgen.idle_tabs_worker(*worker_args)]
+    else:
+        with mp.Pool(processes, initializer=init_worker, initargs=(traffic.recording,)) as workers:
+            results = workers.starmap(loadgen.idle_tabs_worker, processes * [worker_args])
+
+    counts = Counter()
+    for worker_counts, worker_stats, worker_trace in results:
+        counts.update(worker_counts)
+        stats.merge(worker_stats)
+        traffic.merge(worker_trace)
+    counts['duration'] = duration
+    counts['elapsed'] = max(worker_counts['elapsed'] for worker_counts, _, _ in results)
+    loadgen.report(counts, tabs / interval)
+
+def scenario_bench():
+    """Run the weighted workload described by the --scenario file."""
     try:
-        profile_link = WebDriverWait(driver, 5).until(
-            EC.presence_of_element_located((By.XPATH, "//a[@class='nav-link' and text()='Logout']"))
-        )
-        profile_link.click()
-    except Exception as e:
-        logging.info(e)
-        logging.error(f"Failed to find or click the Profile link: {e}")
-        return
-    try:
-        success = WebDriverWait(driver, 10).until(
-            EC.visibility_of_element_located((By.CLASS_NAME, 'alert-info'))
-        ).text
-        duration = time.time() - start_time
-        if success == 'Please log in to access this page.':
-            logging.info(f"Logout successful for '{username}': (Duration {duration:.5f} s)")
-            return True
-        else:
-            logging.error(f"Logout failed for '{username}': (Duration {duration:.5f} s)")
-            return False
-    except Exception as e:
-        logging.error(f"Failed to get logout confirmation message: {e}")
-        return False
+        workload = scenario.load_scenario(arg_value(Args.SCENARIO))
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Cannot load scenario: {e}")
+    workload.users = int(arg_value(Args.USERS, workload.users))
+    workload.duration = float(arg_value(Args.DURATION, workload.duration))
+
+    with WebDriverPool(get_engine(), workload.users, BASE_URL) as pool:
+        start_time = time.time()
+        completed = scenario.run_scenario(workload, pool)
+        total_duration = time.time() - start_time
+    logging.info(f"Scenario '{workload.name}': {completed} behaviours complete in {total_duration:.5f} s")
 
-def post(username, message, driver):
+def reset_db(name, warmup_requests=10):
+    """Restore the server's database from snapshot `name`, then warm the server up.
+
+    Runs `flask snapshot restore` in the app directory with this process'
+    environment, so DATABASE_URL must point where the server's does.
+    """
     start_time = time.time()
-    driver.find_element(By.ID, 'post').send_keys(message)
-    driver.find_element(By.ID, 'submit').click()
+    env = dict(os.environ, FLASK_APP=os.environ.get('FLASK_APP', 'microblog.py'))
+    result = subprocess.run(['flask', 'snapshot', 'restore', name], cwd=arg_value(Args.APP_DIR, APP_DIR),
+                            env=env, capture_output=True, text=True)
+    if result.returncode:
+        error = result.stderr.strip().splitlines()[-1:] or ['unknown error']
+        raise SystemExit(f"Cannot restore snapshot '{name}': {error[0]}")
+    # first requests after a restore pay for cold caches; keep them out of the run
+    with requests.Session() as session:
+        for _ in range(warmup_requests):
+            session.get(BASE_URL + '/auth/login', timeout=10)
+    logging.info(f"Database restored from snapshot '{name}' in {time.time() - start_time:.5f} s")
+
+def replay_bench():
+    """Replay the --replay trace at --speed times the recorded pace."""
+    speed = float(arg_value(Args.SPEED, 1))
     try:
-        post = WebDriverWait(driver, 10).until(
-            EC.visibility_of_element_located((By.CLASS_NAME, "alert"))
-        ).text
-        duration = time.time() - start_time
-        if "Your post is now live!" in post:
-            logging.info(f"'{username}' submitted a post successfully: (Duration {duration:.5f} s)")
-            return True
-        else:
-            logging.error(f"'{username}' post failed: (Duration {duration:.5f} s)")
-            return False
-    except Exception as e:
-        logging.error(f"Failed to confirm post submission: {e}")
-        return False
-
-def send_private_message(username, target_username, message, driver):
+        events = traffic.load(arg_value(Args.REPLAY))
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Cannot load trace: {e}")
+    if not events:
+        raise SystemExit("The trace has no requests to replay")
+    counts = loadgen.replay_worker(events, BASE_URL, speed)
+    loadgen.report(counts, len(events) / counts['duration'])
+
+def import_access_log(path):
+    """Convert a gunicorn access log to a trace at --record (or next to the logs)."""
+    output = arg_value(Args.RECORD, os.path.join(log_dir, f'{timestamp}_trace.jsonl.gz'))
     try:
-        explore_link = WebDriverWait(driver, 5).until(
-            EC.presence_of_element_located((By.LINK_TEXT, "Explore"))
-        )
-        explore_link.click()
-        user_links = driver.find_elements(By.CLASS_NAME, "user_popup")
-        for link in user_links:
-            if link.text.strip() == target_username:
-                link.click()
-                break
-        else:
-            logging.info(f"Could not find a link matching the target username: '{target_username}'")
-            return
-
-        WebDriverWait(driver, 5).until(
-            EC.presence_of_element_located((By.LINK_TEXT, "Send private message"))
-        ).click()
-
-        message_textarea = WebDriverWait(driver, 5).until(
-            EC.presence_of_element_located((By.TAG_NAME, 'textarea'))
-        )
-        message_textarea.send_keys(message)
-        submit_button = driver.find_element(By.ID, 'submit')
-        submit_button.click()
-
-        success_message = WebDriverWait(driver, 5).until(
-            EC.presence_of_element_located((By.CLASS_NAME, 'alert-info'))
-        ).text
-        if success_message == 'Your message has been sent.':
-            logging.info(f"Private message sent from '{username}' to '{target_username}'")
-        else:
-            logging.error(f"Private message failed for '{username}' to '{target_username}'")
-    except Exception as e:
-        logging.error(f"An error occurred while sending private message to '{target_username}': {e}")
-
-class WebDriverPool:
-    """A pool of WebDriver instances to optimize reuse and reduce setup time."""
-    def __init__(self, size):
-        self.pool = Queue(maxsize=size)
-        for _ in range(size):
-            self.pool.put(self.create_webdriver())
-
-    def create_webdriver(self):
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--window-size=1200,900")
-        driver = webdriver.Chrome(options=chrome_options)
-        driver.get("http://localhost:5000")
-        return driver
-
-    def acquire(self):
-        """Acquire a WebDriver instance from the pool."""
-        return self.pool.get()
-
-    def release(self, driver):
-        """Release a WebDriver instance back to the pool."""
-        self.pool.put(driver)
-
-    def close_all(self):
-        """Close all WebDriver instances in the pool."""
-        while not self.pool.empty():
-            driver = self.pool.get()
-            driver.quit()
-
-def send_messages_multithreaded(tasks, webdriver_pool, max_workers=4):
-    """Send messages concurrently with WebDriver instance reuse."""
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
-        for username, password, target_username, message in tasks:
-            driver = webdriver_pool.acquire()
-            futures.append(
-                executor.submit(process_message_task, username, password, target_username, message, driver, webdriver_pool)
-            )
-
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as exc:
-                logging.error(f"Generated an exception: {exc}")
-
-def process_message_task(username, password, target_username, message, driver, webdriver_pool):
-    """Log in, send a private message, and release the WebDriver back to the pool."""
+        n_requests = traffic.save(output, traffic.import_access_log(path))
+    except OSError as e:
+        raise SystemExit(f"Cannot import access log: {e}")
+    print(f"{n_requests} requests from {path} written to {output}")
+
+def start_soak():
+    """Start sampling the server's workers for a --soak run."""
+    server_pid = arg_value(Args.SERVER_PID)
+    server_pid = int(server_pid) if server_pid else soak.find_gunicorn()
+    if server_pid is None:
+        raise SystemExit("No gunicorn running here, give the server's pid with --server-pid")
+    sampler = soak.Sampler(server_pid, float(arg_value(Args.SAMPLE_INTERVAL, 10)))
+    logging.info(f"Soak run: sampling the workers of {server_pid} every {sampler.interval} s")
+    sampler.start()
+    return sampler
+
+def matrix_bench():
+    """Run the --matrix file: one scenario against every server configuration in it."""
     try:
-        if login(username, password, driver):
-            send_private_message(username, target_username, message, driver)
-    finally:
-        webdriver_pool.release(driver)
-
-def message_bench():
-    # Specify task list
-    tasks = [
-        ('a', 'a', 'f', "Hello, this is a test message!"),
-        ("m", 'm', 'f', "Another message for you!"),
-        ("c", 'c', 'f', "Another message for you!"),
-        ("e", 'e', 'f', "Another message for you!"),
-        ("f", 'f', 'z', "Another message for you!"),
-        ("z", 'z', 'f', "Another message for you!"),
-        ("x", 'x', 'f', "Another message for you!"),
-        ("v", 'v', 'f', "Another message for you!"),
-        (">", '>', 'f', "Another message for you!"),
-        ("?", '?', 'f', "Another message for you!"),
-    ]
-    webdriver_pool = WebDriverPool(size=len(tasks))
-    start_time = time.time()
-    send_messages_multithreaded(tasks, webdriver_pool, max_workers=len(tasks))
-    total_duration = time.time() - start_time
-    logging.info(f"Total time taken for all messages: {total_duration:.5f} s")
-
-    webdriver_pool.close_all()
+        results = matrix.run_matrix(arg_value(Args.MATRIX), get_engine(), log_dir, timestamp)
+    except (OSError, ValueError, RuntimeError) as e:
+        raise SystemExit(f"Cannot run matrix: {e}")
+    matrix.report(results, os.path.join(log_dir, f'{timestamp}_matrix.json'))
 
-def main():
+def run():
     # display = Display(visible=0, size=(800,600))
     # display.start()
 
@@ -384,15 +386,33 @@ def main():
         message_bench()
         return
 
-    driver_opts = Options()
-    if Args.HEADLESS in argv:
-        driver_opts.add_argument("--window-size=1920,1080")
-        driver_opts.add_argument('--no-sandbox')
-        driver_opts.add_argument('--disable-dev-shm-usage')
-        driver_opts.add_argument("--headless=new")
+    if Args.OPEN_LOOP in argv:
+        open_loop_bench()
+        return
 
-    driver = webdriver.Chrome(options=driver_opts)
-    driver.get("http://127.0.0.1:5000")
+    if arg_value(Args.REPLAY):
+        replay_bench()
+        return
+
+    if arg_value(Args.MATRIX):
+        matrix_bench()
+        return
+
+    if Args.CAPACITY in argv:
+        capacity_bench()
+        return
+
+    if arg_value(Args.IDLE_TABS):
+        idle_tabs_bench()
+        return
+
+    if arg_value(Args.SCENARIO):
+        scenario_bench()
+        return
+
+    engine = get_engine()
+    pool = WebDriverPool(engine, 1, BASE_URL, headless=Args.HEADLESS in argv)
+    driver = pool.acquire()
     username = generate_random_string()
     email = username + '@gmail.com'
     password = generate_random_string()
@@ -400,19 +420,44 @@ def main():
 
 
     start_time = time.time()
-    register(username=username, password=password, driver=driver)
+    engine.register(username=username, password=password, driver=driver)
 
-    login(username=username, password=password, driver=driver)
-    post(username=username, message=message, driver=driver)
-    edit_bio(username=username, bio='Hello, my name is ' + username, driver=driver)
-    logout(username=username, driver=driver)
-    forgot_password(email=email, driver=driver)
+    engine.login(username=username, password=password, driver=driver)
+    engine.post(username=username, message=message, driver=driver)
+    engine.edit_bio(username=username, bio='Hello, my name is ' + username, driver=driver)
+    engine.logout(username=username, driver=driver)
+    engine.forgot_password(email=email, driver=driver)
 
     stop_time = time.time()
     duration = stop_time - start_time
     logging.info(f"'{username}' successful run of all crawler tests: (Duration {duration:.5f} s)")
 
-    driver.quit()
+    pool.release(driver)
+    pool.close_all()
+
+def main():
+    if argv[1:2] == ['analyze']:
+        sys.exit(analyze.main(argv[2:]))
+
+    if arg_value(Args.IMPORT_ACCESS_LOG):
+        import_access_log(arg_value(Args.IMPORT_ACCESS_LOG))
+        return
+
+    if arg_value(Args.RESET_DB):
+        reset_db(arg_value(Args.RESET_DB))
+
+    if arg_value(Args.RECORD):
+        traffic.start()
+    sampler = start_soak() if Args.SOAK in argv else None
+    run()
+    if sampler:
+        sampler.stop()
+        soak.report(sampler, os.path.join(log_dir, f'{timestamp}_soak.json'))
+    if arg_value(Args.RECORD):
+        n_requests = traffic.save(arg_value(Args.RECORD))
+        logging.info(f"{n_requests} requests recorded to {arg_value(Args.RECORD)}")
+    stats.report(os.path.join(log_dir, f'{timestamp}_results.json'))
+    selenium_engine.report_skipped()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,117 @@
+"""A warm, health-checked pool of drivers shared by every bench.
+
+Starting Chrome dominates short runs, so the pool starts all of its drivers
+up front, in parallel and before anything is timed, and keeps them for the
+whole run. A driver is handed to one virtual user at a time; when it comes
+back its cookies and storage are cleared so the next user starts as a fresh
+visitor, and a driver that crashed or fails its health check is quit and
+replaced instead of taking the run down with it.
+
+`map` feeds tasks to the pool through a bounded queue with one thread per
+driver, so the pool can be much smaller than the task list and a producer
+can be a lazy (even paced) generator.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from queue import Queue
+import contextvars
+import logging
+import threading
+
+_DONE = object()
+
+class WebDriverPool:
+    def __init__(self, engine, size, base_url, headless=True):
+        self.engine = engine
+        self.size = size
+        self.base_url = base_url
+        self.headless = headless
+        self.replaced = 0
+        self._idle = Queue()
+        self._lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            for driver in executor.map(lambda _: self.create_driver(), range(size)):
+                self._idle.put(driver)
+        logging.info(f"Driver pool warm with {size} drivers")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close_all()
+
+    def create_driver(self):
+        return self.engine.create_driver(self.base_url, headless=self.headless)
+
+    def replace(self, driver):
+        """Quit a broken driver and start a new one in its place."""
+        try:
+            self.engine.quit_driver(driver)
+        except Exception as e:
+            logging.info(f"Could not quit a broken driver: {e}")
+        with self._lock:
+            self.replaced += 1
+        logging.warning("Replacing a driver that failed its health check")
+        return self.create_driver()
+
+    def acquire(self, timeout=None):
+        """Take an idle driver, waiting up to `timeout` seconds for one."""
+        driver = self._idle.get(timeout=timeout)
+        if not self.engine.driver_alive(driver):
+            driver = self.replace(driver)
+        return driver
+
+    def release(self, driver):
+        """Give a driver back, reset for the next virtual user."""
+        try:
+            self.engine.reset_driver(driver)
+        except Exception as e:
+            logging.info(f"Driver reset failed: {e}")
+            driver = self.replace(driver)
+        self._idle.put(driver)
+
+    @contextmanager
+    def session(self):
+        """One virtual user's turn with a driver."""
+        driver = self.acquire()
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def map(self, fn, tasks, queue_size=None):
+        """Run `fn(driver, *task)` for every task; return the results.
+
+        Tasks are read lazily into a queue of at most `queue_size` entries
+        (twice the pool size by default), each with the context it was
+        produced in, so a task produced under `stats.scheduled` keeps its
+        intended start time. A task that raises is logged and gives None.
+        """
+        queue = Queue(maxsize=queue_size or 2 * self.size)
+        results = []
+
+        def work():
+            while (item := queue.get()) is not _DONE:
+                context, task = item
+                with self.session() as driver:
+                    try:
+                        results.append(context.run(fn, driver, *task))
+                    except Exception as e:
+                        logging.error(f"Generated an exception: {e}")
+                        results.append(None)
+
+        workers = [threading.Thread(target=work) for _ in range(self.size)]
+        for worker in workers:
+            worker.start()
+        for task in tasks:
+            queue.put((contextvars.copy_context(), task))
+        for _ in workers:
+            queue.put(_DONE)
+        for worker in workers:
+            worker.join()
+        return results
+
+    def close_all(self):
+        """Quit every idle driver."""
+        while not self._idle.empty():
+            self.engine.quit_driver(self._idle.get())
@@ -0,0 +1,361 @@
+"""Crawler actions that talk plain HTTP to the server, without a browser.
+
+Each action is written once as a *flow*: a generator that yields the
+`HttpRequest`s a browser would make for it and receives the resulting `Page`
+back, then returns whether the action succeeded. `run_flow` drives a flow
+over a keep-alive `requests` session, so every virtual user costs one
+pooled connection instead of a whole Chrome process.
+"""
+from collections import namedtuple
+from html.parser import HTMLParser
+from urllib.parse import quote, urlencode, urljoin, urlparse
+import logging
+import time
+import requests
+
+import stats
+import traffic
+
+HttpRequest = namedtuple('HttpRequest', ['method', 'path', 'data'], defaults=[None])
+
+# Words common enough in posts that a search finds something
+SEARCH_TERMS = ('hello', 'post', 'the', 'test', 'message', 'microblog')
+
+class PageParser(HTMLParser):
+    """Collects the bits of a microblog page the flows need to look at."""
+    def __init__(self):
+        super().__init__()
+        self.inputs = {}
+        self.alerts = []
+        self.links = []
+        self.h1 = None
+        self._text = None
+        self._link = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        if tag == 'input' and attrs.get('name'):
+            self.inputs[attrs['name']] = attrs.get('value') or ''
+        elif tag == 'div' and 'alert-info' in classes:
+            self._text = ('alert', [])
+        elif tag == 'h1' and self.h1 is None:
+            self._text = ('h1', [])
+        elif tag == 'a' and attrs.get('href'):
+            self._link = (attrs['href'], classes, [])
+
+    def handle_data(self, data):
+        if self._text:
+            self._text[1].append(data)
+        if self._link:
+            self._link[2].append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'div' and self._text and self._text[0] == 'alert':
+            self.alerts.append(''.join(self._text[1]).strip())
+            self._text = None
+        elif tag == 'h1' and self._text and self._text[0] == 'h1':
+            self.h1 = ''.join(self._text[1]).strip()
+            self._text = None
+        elif tag == 'a' and self._link:
+            href, classes, text = self._link
+            self.links.append((href, classes, ''.join(text).strip()))
+            self._link = None
+
+class Page:
+    """The parsed result of one request, as seen by a flow."""
+    def __init__(self, status, url, text):
+        self.status = status
+        self.url = url
+        self.text = text
+        parser = PageParser()
+        parser.feed(text)
+        self.inputs = parser.inputs
+        self.alerts = parser.alerts
+        self.links = parser.links
+        self.h1 = parser.h1
+
+    @property
+    def csrf_token(self):
+        return self.inputs.get('csrf_token', '')
+
+    @property
+    def flash(self):
+        return self.alerts[0] if self.alerts else None
+
+    def find_link(self, text, css_class=None):
+        for href, classes, link_text in self.links:
+            if link_text == text and (css_class is None or css_class in classes):
+                return href
+        return None
+
+    @property
+    def older_url(self):
+        """Where the pager's "Older posts" link goes, None on the last page."""
+        for href, classes, link_text in self.links:
+            # the disabled link on the last page renders next_url=None as is
+            if 'page-link' in classes and link_text.startswith('Older posts') and href != 'None':
+                return href
+        return None
+
+def register_flow(username, password):
+    page = yield HttpRequest('GET', '/auth/register')
+    page = yield HttpRequest('POST', '/auth/register', {
+        'csrf_token': page.csrf_token,
+        'username': username,
+        'email': username + '@gmail.com',
+        'password': password,
+        'password2': password,
+        'submit': 'Register',
+    })
+    return page.flash == 'Congratulations, you are now a registered user!'
+
+def login_flow(username, password):
+    page = yield HttpRequest('GET', '/auth/login')
+    page = yield HttpRequest('POST', '/auth/login', {
+        'csrf_token': page.csrf_token,
+        'username': username,
+        'password': password,
+        'submit': 'Sign In',
+    })
+    return page.h1 == 'Hi, ' + username + '!'
+
+def post_flow(message):
+    page = yield HttpRequest('GET', '/index')
+    page = yield HttpRequest('POST', '/index', {
+        'csrf_token': page.csrf_token,
+        'post': message,
+        'submit': 'Submit',
+    })
+    return page.flash is not None and 'Your post is now live!' in page.flash
+
+def edit_bio_flow(bio):
+    page = yield HttpRequest('GET', '/edit_profile')
+    page = yield HttpRequest('POST', '/edit_profile', {
+        'csrf_token': page.csrf_token,
+        'username': page.inputs.get('username', ''),
+        'about_me': bio,
+        'submit': 'Submit',
+    })
+    return page.flash == 'Your changes have been saved.'
+
+def logout_flow():
+    page = yield HttpRequest('GET', '/auth/logout')
+    return page.flash == 'Please log in to access this page.'
+
+def forgot_password_flow(email):
+    page = yield HttpRequest('GET', '/auth/reset_password_request')
+    page = yield HttpRequest('POST', '/auth/reset_password_request', {
+        'csrf_token': page.csrf_token,
+        'email': email,
+        'submit': 'Request Password Reset',
+    })
+    return page.flash == 'Check your email for the instructions to reset your password'
+
+def send_private_message_flow(target_username, message):
+    page = yield HttpRequest('GET', '/explore')
+    # users without recent posts are not linked from explore, go straight
+    # to their profile like a visitor with a bookmark would
+    user_url = page.find_link(target_username, 'user_popup') or f'/user/{quote(target_username)}'
+    page = yield HttpRequest('GET', user_url)
+    send_url = page.find_link('Send private message')
+    if send_url is None:
+        return False
+    page = yield HttpRequest('GET', send_url)
+    page = yield HttpRequest('POST', send_url, {
+        'csrf_token': page.csrf_token,
+        'message': message,
+        'submit': 'Submit',
+    })
+    return page.flash == 'Your message has been sent.'
+
+def explore_flow(path):
+    page = yield HttpRequest('GET', path)
+    return page.status == 200 and (page.h1 or '').startswith('Hi, ')
+
+def view_user_flow(target_username):
+    page = yield HttpRequest('GET', f'/user/{quote(target_username)}')
+    return page.h1 == 'User: ' + target_username
+
+def user_popup_flow(target_username):
+    # what initialize_popovers in base.html fetches when a username is hovered
+    page = yield HttpRequest('GET', f'/user/{quote(target_username)}/popup')
+    return page.status == 200 and page.find_link(target_username) is not None
+
+def search_flow(query):
+    page = yield HttpRequest('GET', '/search?' + urlencode({'q': query}))
+    return page.h1 == 'Search Results'
+
+def poll_notifications_flow(since=0):
+    # the poll every logged-in tab makes; a JSON list, a login page once
+    # the session has gone
+    page = yield HttpRequest('GET', f'/notifications?since={since}')
+    return page.status == 200 and page.text.lstrip().startswith('[')
+
+class HttpDriver(requests.Session):
+    """One virtual user: a keep-alive session with its own cookie jar."""
+    def __init__(self, base_url, timeout=10):
+        super().__init__()
+        self.base_url = base_url
+        self.timeout = timeout
+        # last page fetched, so read actions can follow links from it
+        self.page = None
+
+    def fetch(self, request):
+        traffic.record(self, request)
+        response = self.request(request.method, urljoin(self.base_url, request.path),
+                                data=request.data, timeout=self.timeout)
+        self.page = Page(response.status_code, response.url, response.text)
+        return self.page
+
+def run_flow(driver, flow):
+    """Run `flow` to completion over `driver` and return its result."""
+    try:
+        request = next(flow)
+        while True:
+            request = flow.send(driver.fetch(request))
+    except StopIteration as stop:
+        return stop.value
+
+def create_driver(base_url, headless=True):
+    return HttpDriver(base_url)
+
+def quit_driver(driver):
+    driver.close()
+
+def reset_driver(driver):
+    driver.cookies.clear()
+    driver.page = None
+
+def driver_alive(driver):
+    """A session has no process that could have died."""
+    return True
+
+def inject_session(driver, cookies):
+    """Take over a session logged in elsewhere (see sessions.py)."""
+    # for the server's host, so the cookies it sets later replace these
+    host = urlparse(driver.base_url).hostname
+    for name, value in cookies.items():
+        driver.cookies.set(name, value, domain=host, path='/')
+
+def prepare(action, driver):
+    """Flows fetch their own pages, there is nothing to navigate to."""
+
+# Log lines per action, as (success, failure, error) templates. They match what
+# the Selenium actions write so logs from either engine read the same.
+MESSAGES = {
+    'register': ("Registration successful for user '{username}'",
+                 "Registration failed for user '{username}'",
+                 "Failed to get registration success message"),
+    'login': ("Login successful for user '{username}'",
+              "Login failed for user '{username}'",
+              "An error occurred during login for '{username}'"),
+    'post': ("'{username}' submitted a post successfully",
+             "'{username}' post failed",
+             "Failed to confirm post submission"),
+    'edit_bio': ("Bio updated for user '{username}'",
+                 "Bio update failed for user '{username}'",
+                 "An error occurred while editing the bio"),
+    'logout': ("Logout successful for '{username}'",
+               "Logout failed for '{username}'",
+               "Failed to get logout confirmation message"),
+    'forgot_password': ("Forgot password request sent for email '{email}'",
+                        "Forgot password request failed for email '{email}'",
+                        "An error occurred while waiting for the forgot password confirmation"),
+    'send_private_message': ("Private message sent from '{username}' to '{target_username}'",
+                             "Private message failed for '{username}' to '{target_username}'",
+                             "An error occurred while sending private message to '{target_username}'"),
+    'explore': ("'{username}' viewed explore page '{path}'",
+                "'{username}' could not view explore page '{path}'",
+                "An error occurred while viewing explore page '{path}'"),
+    'view_user': ("'{username}' viewed the profile of '{target_username}'",
+                  "'{username}' could not view the profile of '{target_username}'",
+                  "An error occurred while viewing the profile of '{target_username}'"),
+    'user_popup': ("'{username}' opened the popup of '{target_username}'",
+                   "'{username}' could not open the popup of '{target_username}'",
+                   "An error occurred while opening the popup of '{target_username}'"),
+    'search': ("'{username}' searched for '{query}'",
+               "'{username}' search for '{query}' failed",
+               "An error occurred while searching for '{query}'"),
+    'poll_notifications': ("Notifications polled for '{username}'",
+                           "Notification poll failed for '{username}'",
+                           "An error occurred while polling notifications for '{username}'"),
+}
+
+def log_outcome(action, success, duration, **fields):
+    success_msg, failure_msg, _ = MESSAGES[action]
+    if success:
+        logging.info(f"{success_msg.format(**fields)}: (Duration {duration:.5f} s)")
+    else:
+        logging.error(f"{failure_msg.format(**fields)}: (Duration {duration:.5f} s)")
+
+def log_error(action, error, **fields):
+    logging.error(f"{MESSAGES[action][2].format(**fields)}: {error}")
+
+def perform(driver, action, flow, **fields):
+    """Run one action flow and log it the same way the Selenium actions do."""
+    start_time = time.time()
+    try:
+        with traffic.acting_as(fields.get('username') or fields.get('email')):
+            success = bool(run_flow(driver, flow))
+    except requests.RequestException as e:
+        log_error(action, e, **fields)
+        stats.record(action, time.time() - start_time, False)
+        return False
+    duration = time.time() - start_time
+    log_outcome(action, success, duration, **fields)
+    stats.record(action, duration, success)
+    return success
+
+def register(username, password, driver):
+    return perform(driver, 'register', register_flow(username, password),
+                   username=username)
+
+def login(username, password, driver):
+    return perform(driver, 'login', login_flow(username, password),
+                   username=username)
+
+def post(username, message, driver):
+    return perform(driver, 'post', post_flow(message), username=username)
+
+def edit_bio(username, bio, driver):
+    return perform(driver, 'edit_bio', edit_bio_flow(bio), username=username)
+
+def logout(username, driver):
+    return perform(driver, 'logout', logout_flow(), username=username)
+
+def forgot_password(email, driver):
+    return perform(driver, 'forgot_password', forgot_password_flow(email),
+                   email=email)
+
+def send_private_message(username, target_username, message, driver):
+    return perform(driver, 'send_private_message',
+                   send_private_message_flow(target_username, message),
+                   username=username, target_username=target_username)
+
+def explore_path(driver, older=False):
+    """`/explore`, or the "Older posts" link (a cursor) of the last page seen."""
+    older_url = driver.page.older_url if older and driver.page is not None else None
+    if older_url and older_url.startswith('/explore'):
+        return older_url
+    # past the last page (or with nothing to follow) start over at the top
+    return '/explore'
+
+def explore(username, driver, older=False):
+    path = explore_path(driver, older)
+    return perform(driver, 'explore', explore_flow(path), username=username, path=path)
+
+def view_user(username, target_username, driver):
+    return perform(driver, 'view_user', view_user_flow(target_username),
+                   username=username, target_username=target_username)
+
+def user_popup(username, target_username, driver):
+    return perform(driver, 'user_popup', user_popup_flow(target_username),
+                   username=username, target_username=target_username)
+
+def search(username, query, driver):
+    return perform(driver, 'search', search_flow(query), username=username, query=query)
+
+def poll_notifications(username, driver, since=0):
+    return perform(driver, 'poll_notifications', poll_notifications_flow(since),
+                   username=username)
@@ -0,0 +1,382 @@
+"""Open-loop load generation with asyncio.
+
+The benches in crawler.py are closed-loop: every worker waits for its last
+request before sending the next one, so a slow server quietly lowers the
+offered load. Here requests are launched on an arrival schedule (constant or
+Poisson at a target rate) no matter how many are still in flight, which is
+what exposes queueing delay and the point where the server saturates.
+
+Virtual users are aiohttp sessions that share one connection pool but keep
+their own cookie jar, so a single process can hold thousands of them.
+
+`idle_tabs` covers the other half of the traffic: logged-in browser tabs
+nobody is looking at, each polling `/notifications?since=` every ten seconds
+like base.html does. A tab is just a coroutine and a timestamp on top of a
+virtual user's session, so tens of thousands fit in one process.
+
+`replay` sends a recorded trace (see traffic.py) again on its original
+schedule, sped up or slowed down, one session per recorded user.
+"""
+from collections import Counter
+from urllib.parse import urljoin
+import asyncio
+import logging
+import random
+import string
+import time
+import aiohttp
+
+import stats
+import traffic
+
+from http_engine import (HttpRequest, Page, SEARCH_TERMS, explore_path, log_outcome,
+                         log_error, register_flow, login_flow, post_flow,
+                         edit_bio_flow, forgot_password_flow,
+                         send_private_message_flow, explore_flow,
+                         view_user_flow, user_popup_flow, search_flow,
+                         poll_notifications_flow)
+
+ARRIVALS = ('constant', 'poisson')
+# logout is left out on purpose: it would end the virtual user's session
+ACTIONS = ('register', 'login', 'post', 'edit_bio', 'forgot_password',
+           'send_private_message', 'explore', 'view_user', 'user_popup',
+           'search', 'poll_notifications')
+# Actions of a visitor who is not logged in; each arrival gets a brand new
+# session with an empty cookie jar, the virtual users' sessions would be
+# redirected away from these pages
+ANONYMOUS_ACTIONS = ('register', 'login', 'forgot_password')
+
+class AsyncHttpDriver:
+    """One virtual user on top of a shared aiohttp connection pool."""
+    def __init__(self, base_url, connector, timeout=10):
+        self.base_url = base_url
+        self.session = aiohttp.ClientSession(
+            connector=connector, connector_owner=False,
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+            timeout=aiohttp.ClientTimeout(total=timeout))
+        self.page = None
+
+    async def fetch(self, request):
+        traffic.record(self, request)
+        async with self.session.request(request.method,
+                                        urljoin(self.base_url, request.path),
+                                        data=request.data) as response:
+            self.page = Page(response.status, str(response.url), await response.text())
+            return self.page
+
+    async def close(self):
+        await self.session.close()
+
+async def arun_flow(driver, flow):
+    """Async counterpart of http_engine.run_flow."""
+    try:
+        request = next(flow)
+        while True:
+            request = flow.send(await driver.fetch(request))
+    except StopIteration as stop:
+        return stop.value
+
+async def aperform(driver, action, flow, **fields):
+    """Run one action flow, log it like the other engines and time it."""
+    start_time = time.perf_counter()
+    try:
+        with traffic.acting_as(fields.get('username') or fields.get('email')):
+            success = bool(await arun_flow(driver, flow))
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log_error(action, e, **fields)
+        duration = time.perf_counter() - start_time
+        stats.record(action, duration, False)
+        return False, duration
+    duration = time.perf_counter() - start_time
+    log_outcome(action, success, duration, **fields)
+    stats.record(action, duration, success)
+    return success, duration
+
+def random_name():
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=10))
+
+class VirtualUser:
+    def __init__(self, base_url, connector):
+        self.username = random_name()
+        self.password = random_name()
+        self.driver = AsyncHttpDriver(base_url, connector)
+
+    async def setup(self):
+        """Register and log in; not part of the measured load."""
+        with traffic.acting_as(self.username):
+            return (await arun_flow(self.driver, register_flow(self.username, self.password))
+                    and await arun_flow(self.driver, login_flow(self.username, self.password)))
+
+async def ready_population(base_url, connector, users, setup_concurrency=16):
+    """Register and log in `users` virtual users, keeping those that made it."""
+    population = [VirtualUser(base_url, connector) for _ in range(users)]
+    limit = asyncio.Semaphore(setup_concurrency)
+    async def setup(vu):
+        async with limit:
+            return await vu.setup()
+    ready = await asyncio.gather(*(setup(vu) for vu in population))
+    for vu, ok in zip(population, ready):
+        if not ok:
+            await vu.driver.close()
+    population = [vu for vu, ok in zip(population, ready) if ok]
+    if not population:
+        raise RuntimeError("None of the virtual users could register and log in")
+    return population
+
+def action_flow(action, vu, users):
+    """The flow and log fields for one arrival of `action` performed by `vu`."""
+    if action == 'register':
+        username = random_name()
+        return register_flow(username, random_name()), {'username': username}
+    if action == 'login':
+        return login_flow(vu.username, vu.password), {'username': vu.username}
+    if action == 'post':
+        return post_flow(random_name()), {'username': vu.username}
+    if action == 'edit_bio':
+        return edit_bio_flow('Hello, my name is ' + vu.username), {'username': vu.username}
+    if action == 'forgot_password':
+        email = vu.username + '@gmail.com'
+        return forgot_password_flow(email), {'email': email}
+    if action == 'send_private_message':
+        target = random.choice([user for user in users if user is not vu] or users)
+        return (send_private_message_flow(target.username, random_name()),
+                {'username': vu.username, 'target_username': target.username})
+    if action == 'explore':
+        # every arrival pages one deeper than the user's last, like scrolling
+        path = explore_path(vu.driver, older=True)
+        return explore_flow(path), {'username': vu.username, 'path': path}
+    if action in ('view_user', 'user_popup'):
+        target = random.choice([user for user in users if user is not vu] or users)
+        flow = view_user_flow if action == 'view_user' else user_popup_flow
+        return flow(target.username), {'username': vu.username, 'target_username': target.username}
+    if action == 'search':
+        query = random.choice(SEARCH_TERMS)
+        return search_flow(query), {'username': vu.username, 'query': query}
+    if action == 'poll_notifications':
+        return poll_notifications_flow(), {'username': vu.username}
+    raise ValueError(f"Unknown action '{action}'")
+
+def arrival_offsets(rate, arrival, duration, rng=random):
+    """Intended send times, in seconds from the start of the run."""
+    offset, i = 0.0, 0
+    while offset < duration:
+        yield offset
+        i += 1
+        if arrival == 'poisson':
+            offset += rng.expovariate(rate)
+        else:
+            offset = i / rate
+
+async def run_arrival(action, vu, users, base_url, connector, counts, intended):
+    # latency is also measured from the scheduled time, so a late start
+    # caused by an overloaded load generator or server is not hidden
+    stats.intended_start.set(intended)
+    flow, fields = action_flow(action, vu, users)
+    if action in ANONYMOUS_ACTIONS:
+        driver = AsyncHttpDriver(base_url, connector)
+        try:
+            success, _ = await aperform(driver, action, flow, **fields)
+        finally:
+            await driver.close()
+    else:
+        success, _ = await aperform(vu.driver, action, flow, **fields)
+    counts['ok' if success else 'error'] += 1
+
+async def offer_load(population, base_url, connector, rate, duration, action='post',
+                     arrival='constant', max_inflight=10000):
+    """Offer `rate` arrivals/s of `action` from a ready population.
+
+    Returns counters for the run: how many arrivals were scheduled, sent,
+    dropped (more than `max_inflight` already outstanding), succeeded and
+    failed, plus the elapsed time including the drain of in-flight requests.
+    """
+    counts = Counter()
+    inflight = set()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    wall_start = time.time()
+    for i, offset in enumerate(arrival_offsets(rate, arrival, duration)):
+        delay = start + offset - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        counts['scheduled'] += 1
+        if len(inflight) >= max_inflight:
+            counts['dropped'] += 1
+            continue
+        vu = population[i % len(population)]
+        task = asyncio.create_task(
+            run_arrival(action, vu, population, base_url, connector, counts,
+                        wall_start + offset))
+        inflight.add(task)
+        task.add_done_callback(inflight.discard)
+        counts['sent'] += 1
+    await asyncio.gather(*inflight)
+
+    counts['elapsed'] = loop.time() - start
+    counts['duration'] = duration
+    return counts
+
+async def open_loop(base_url, rate, duration, action='post', arrival='constant',
+                    users=100, max_inflight=10000, setup_concurrency=16):
+    """Register `users` virtual users, then `offer_load` for `duration` seconds."""
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action '{action}'")
+    connector = aiohttp.TCPConnector(limit=0)
+    population = await ready_population(base_url, connector, users, setup_concurrency)
+    logging.info(f"{len(population)} virtual users ready for the open-loop run")
+
+    counts = await offer_load(population, base_url, connector, rate, duration,
+                              action, arrival, max_inflight)
+
+    for vu in population:
+        await vu.driver.close()
+    await connector.close()
+    return counts
+
+async def poll_tab(vu, start, wall_start, duration, interval, counts):
+    """One idle tab: poll `/notifications?since=` every `interval` seconds.
+
+    Polls run on a fixed schedule from a random phase, with the intended time
+    recorded, so a slow server shows up as corrected latency instead of as
+    fewer polls. Nothing is logged per poll; the histogram is the result.
+    """
+    loop = asyncio.get_running_loop()
+    url = urljoin(vu.driver.base_url, '/notifications')
+    since = 0.0
+    offset = random.uniform(0, interval)
+    while offset < duration:
+        delay = start + offset - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        stats.intended_start.set(wall_start + offset)
+        with traffic.acting_as(vu.username):
+            traffic.record(vu.driver, HttpRequest('GET', f'/notifications?since={since}'))
+        start_time = time.perf_counter()
+        success = False
+        try:
+            async with vu.driver.session.get(url, params={'since': since}) as response:
+                # an expired session is redirected to the login page
+                if response.status == 200 and response.content_type == 'application/json':
+                    notifications = await response.json()
+                    if notifications:
+                        since = notifications[-1]['timestamp']
+                    success = True
+                else:
+                    await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        stats.record('poll_notifications', time.perf_counter() - start_time, success)
+        counts['ok' if success else 'error'] += 1
+        offset += interval
+
+async def idle_tabs(base_url, tabs, duration, users=100, interval=10.0):
+    """Keep `tabs` idle logged-in tabs polling for `duration` seconds.
+
+    Tabs are spread round-robin over `users` virtual users, sharing their
+    sessions the way several tabs of one browser share its cookies.
+    """
+    connector = aiohttp.TCPConnector(limit=0)
+    population = await ready_population(base_url, connector, users)
+    logging.info(f"{tabs} idle tabs for {len(population)} virtual users, "
+                 f"polling every {interval} s")
+
+    counts = Counter()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    wall_start = time.time()
+    await asyncio.gather(*(poll_tab(population[i % len(population)], start, wall_start,
+                                    duration, interval, counts)
+                           for i in range(tabs)))
+    elapsed = loop.time() - start
+
+    for vu in population:
+        await vu.driver.close()
+    await connector.close()
+
+    counts['scheduled'] = counts['sent'] = counts['ok'] + counts['error']
+    counts['elapsed'] = elapsed
+    counts['duration'] = duration
+    return counts
+
+async def replay_user(events, driver, start, wall_start, speed, counts):
+    """Send one user's requests in order, each no earlier than it is due."""
+    loop = asyncio.get_running_loop()
+    for event in events:
+        offset = event['t'] / speed
+        delay = start + offset - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        data = event['data']
+        if data and 'csrf_token' in data:
+            # the recorded token belonged to another session
+            data = {**data, 'csrf_token': driver.page.csrf_token if driver.page else ''}
+        stats.intended_start.set(wall_start + offset)
+        start_time = time.perf_counter()
+        try:
+            page = await driver.fetch(HttpRequest(event['method'], event['path'], data))
+            success = page.status < 400
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            success = False
+        stats.record(traffic.endpoint(event['method'], event['path']),
+                     time.perf_counter() - start_time, success)
+        counts['ok' if success else 'error'] += 1
+
+async def replay(events, base_url, speed=1.0):
+    """Send the trace `events` to `base_url`, `speed` times as fast as recorded.
+
+    Every recorded user gets a fresh session and sends its requests in the
+    recorded order; when one runs late, that user's later requests wait for
+    it rather than overtaking it, and the corrected latency shows the delay.
+    """
+    by_user = {}
+    for event in events:
+        by_user.setdefault(event['user'], []).append(event)
+    connector = aiohttp.TCPConnector(limit=0)
+    drivers = [AsyncHttpDriver(base_url, connector) for _ in by_user]
+    logging.info(f"Replaying {len(events)} requests of {len(by_user)} users at {speed}x")
+
+    counts = Counter()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    wall_start = time.time()
+    await asyncio.gather(*(replay_user(user_events, driver, start, wall_start, speed, counts)
+                           for user_events, driver in zip(by_user.values(), drivers)))
+    elapsed = loop.time() - start
+
+    for driver in drivers:
+        await driver.close()
+    await connector.close()
+
+    duration = events[-1]['t'] / speed if events else 0.0
+    counts['scheduled'] = counts['sent'] = counts['ok'] + counts['error']
+    counts['elapsed'] = elapsed
+    # a trace of one instant has no span to offer it over
+    counts['duration'] = duration or elapsed
+    return counts
+
+def replay_worker(events, base_url, speed):
+    return asyncio.run(replay(events, base_url, speed))
+
+def idle_tabs_worker(base_url, tabs, duration, users, interval):
+    counts = asyncio.run(idle_tabs(base_url, tabs, duration, users=users, interval=interval))
+    return counts, stats.collect(), traffic.collect()
+
+def open_loop_worker(base_url, rate, duration, action, arrival, users):
+    counts = asyncio.run(open_loop(base_url, rate, duration, action=action,
+                                   arrival=arrival, users=users))
+    return counts, stats.collect(), traffic.collect()
+
+def report(counts, rate):
+    """Log and print offered vs. achieved rate for a finished run."""
+    duration, elapsed = counts['duration'], counts['elapsed']
+    offered = counts['scheduled'] / duration
+    achieved = counts['ok'] / elapsed if elapsed else 0.0
+    lines = [
+        f"Target rate: {rate:.2f} req/s",
+        f"Offered rate: {offered:.2f} req/s ({counts['scheduled']} arrivals in {duration:.1f} s)",
+        f"Achieved rate: {achieved:.2f} req/s ({counts['ok']} ok, {counts['error']} errors, "
+        f"{counts['dropped']} dropped, {elapsed:.1f} s including drain)",
+    ]
+    for line in lines:
+        logging.info(line)
+        print(line)
@@ -0,0 +1,260 @@
+"""Run one crawler scenario against a matrix of server configurations.
+
+A matrix file (TOML) names the scenario and lists the settings to vary;
+every combination is launched locally as a gunicorn subprocess, waited on
+until it answers, loaded with the scenario over a fresh database, then
+stopped, and the results of all of them end up in one table:
+
+    scenario = "scenarios/write_mix.toml"   # relative to this file
+    duration = 60                           # overrides the scenario's
+    users = 10
+    seed = ["--users", "1000", "--seed", "1"]   # `flask seed` arguments
+    # snapshot = "seeded"                   # or restore a saved snapshot
+
+    [matrix]
+    workers = [1, 2, 4]
+    worker_class = ["sync", "gthread"]
+    threads = [4]
+    cache = ["SimpleCache", "NullCache"]
+    database = ["sqlite", "postgres"]
+    timeline = ["table", "merge"]
+    recent_posts_cache = ["default", "RedisCache"]
+
+`threads` only applies to the gthread worker class; gunicorn would quietly
+turn any other worker into gthread when given more than one, so the other
+classes always run with one thread and are not repeated along that axis.
+
+`timeline` is the TIMELINE_BACKEND and `recent_posts_cache` the
+RECENT_POSTS_CACHE_TYPE of the server; "default" leaves the type to the
+app, which picks Redis for the merge backend. Only the merge backend uses
+that cache, so the other backends run with the default once. Both are set
+for every configuration, whatever the shell running the matrix exports.
+
+`database` entries are "sqlite" (a new file per configuration),
+"postgres" (a throwaway cluster started with initdb/pg_ctl when they are
+on the PATH, so no container is needed) or any SQLAlchemy URL.
+"""
+from collections import namedtuple
+from itertools import product
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tomllib
+import requests
+
+import scenario
+import stats
+from driver_pool import WebDriverPool
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'microblog')
+DEFAULTS = {
+    'workers': [4],
+    'worker_class': ['sync'],
+    'threads': [1],
+    'cache': ['SimpleCache'],
+    'database': ['sqlite'],
+    'timeline': ['table'],
+    'recent_posts_cache': ['default'],
+}
+
+ServerConfig = namedtuple('ServerConfig', list(DEFAULTS))
+
+def label(config):
+    return (f"{config.database} {config.worker_class}x{config.workers}"
+            + (f" ({config.threads} threads)" if config.threads > 1 else '')
+            + f" {config.cache}"
+            + (f" {config.timeline}" if config.timeline != 'table' else '')
+            + (f" {config.recent_posts_cache}" if config.recent_posts_cache != 'default' else ''))
+
+def load_matrix(path):
+    """Parse a matrix file into (settings, configurations); raises ValueError when it is wrong."""
+    with open(path, 'rb') as f:
+        try:
+            data = tomllib.load(f)
+        except tomllib.TOMLDecodeError as e:
+            raise ValueError(f"{path}: {e}")
+    if 'scenario' not in data:
+        raise ValueError(f"{path}: needs a scenario")
+    matrix = data.get('matrix', {})
+    unknown = set(matrix) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"{path}: unknown matrix keys {', '.join(sorted(unknown))}, "
+                         f"expected: {', '.join(DEFAULTS)}")
+    axes = []
+    for key, default in DEFAULTS.items():
+        values = matrix.get(key, default)
+        if not isinstance(values, list) or not values:
+            raise ValueError(f"{path}: matrix.{key} must be a non-empty list")
+        axes.append(values)
+    settings = dict(data)
+    settings['scenario'] = os.path.join(os.path.dirname(os.path.abspath(path)), data['scenario'])
+    configs = []
+    for config in (ServerConfig(*values) for values in product(*axes)):
+        if config.worker_class != 'gthread':
+            config = config._replace(threads=1)
+        if config.timeline != 'merge':
+            config = config._replace(recent_posts_cache='default')
+        if config not in configs:
+            configs.append(config)
+    return settings, configs
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class LocalPostgres:
+    """A throwaway Postgres cluster in a temporary directory."""
+    def __init__(self):
+        if not all(shutil.which(tool) for tool in ('initdb', 'pg_ctl', 'createdb')):
+            raise RuntimeError("initdb, pg_ctl and createdb are not on the PATH, cannot start a local Postgres")
+        self.dir = tempfile.mkdtemp(prefix='matrix-pg-')
+        self.port = free_port()
+        data = os.path.join(self.dir, 'data')
+        subprocess.run(['initdb', '-D', data, '-U', 'postgres', '--auth=trust'],
+                       check=True, capture_output=True)
+        subprocess.run(['pg_ctl', '-D', data, '-l', os.path.join(self.dir, 'postgres.log'), '-w',
+                        '-o', f'-p {self.port} -k {self.dir} -c listen_addresses=127.0.0.1', 'start'],
+                       check=True, capture_output=True)
+        self.data = data
+
+    def url(self, name):
+        subprocess.run(['createdb', '-h', '127.0.0.1', '-p', str(self.port), '-U', 'postgres', name],
+                       check=True, capture_output=True)
+        return f'postgresql://postgres@127.0.0.1:{self.port}/{name}'
+
+    def stop(self):
+        subprocess.run(['pg_ctl', '-D', self.data, '-m', 'fast', 'stop'], capture_output=True)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+class Server:
+    """gunicorn running the app with one configuration, on a free port."""
+    def __init__(self, config, database_url, log_path):
+        self.config = config
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.env = dict(os.environ, FLASK_APP='microblog.py', DATABASE_URL=database_url,
+                        CACHE_TYPE=config.cache, TIMELINE_BACKEND=config.timeline,
+                        RECENT_POSTS_CACHE_TYPE='' if config.recent_posts_cache == 'default'
+                        else config.recent_posts_cache,
+                        LOG_TO_STDOUT='1')
+        self.log = open(log_path, 'a')
+        self.process = None
+
+    def flask(self, *args):
+        result = subprocess.run(['flask', *args], cwd=APP_DIR, env=self.env, capture_output=True, text=True)
+        if result.returncode:
+            error = result.stderr.strip().splitlines()[-1:] or ['unknown error']
+            raise RuntimeError(f"flask {' '.join(args)} failed: {error[0]}")
+
+    def start(self, timeout=60):
+        threads = ['--threads', str(self.config.threads)] if self.config.worker_class == 'gthread' else []
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-b', f'127.0.0.1:{self.port}',
+             '-w', str(self.config.workers), '-k', self.config.worker_class,
+             *threads, 'microblog:app'],
+            cwd=APP_DIR, env=self.env, stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with status {self.process.returncode}")
+            try:
+                if requests.get(self.base_url + '/auth/login', timeout=2).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        raise RuntimeError(f"server not ready after {timeout} s")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.log.close()
+
+def run_config(config, name, settings, engine, workdir, postgres, log_path):
+    """Launch one configuration, run the scenario against it, return its `Recorder`."""
+    if config.database == 'sqlite':
+        database_url = 'sqlite:///' + os.path.join(workdir, f'{name}.db')
+    elif config.database == 'postgres':
+        database_url = postgres.url(name)
+    else:
+        database_url = config.database
+    server = Server(config, database_url, log_path)
+    try:
+        if settings.get('snapshot'):
+            server.flask('snapshot', 'restore', settings['snapshot'])
+        else:
+            server.flask('db', 'upgrade')
+            if settings.get('seed') is not None:
+                server.flask('seed', *settings['seed'])
+        server.start()
+
+        workload = scenario.load_scenario(settings['scenario'])
+        workload.users = settings.get('users', workload.users)
+        workload.duration = settings.get('duration', workload.duration)
+        with WebDriverPool(engine, workload.users, server.base_url) as pool:
+            stats.reset()
+            scenario.run_scenario(workload, pool)
+        return stats.collect()
+    finally:
+        server.stop()
+
+def run_matrix(path, engine, log_dir, timestamp):
+    """Run every configuration of the matrix file at `path`; returns [(config, recorder)]."""
+    settings, configs = load_matrix(path)
+    results = []
+    postgres = None
+    workdir = tempfile.mkdtemp(prefix='matrix-')
+    try:
+        if any(config.database == 'postgres' for config in configs):
+            postgres = LocalPostgres()
+        for i, config in enumerate(configs, 1):
+            logging.info(f"Matrix configuration {i}/{len(configs)}: {label(config)}")
+            print(f"[{i}/{len(configs)}] {label(config)}")
+            try:
+                recorder = run_config(config, f'matrix_{i}', settings, engine, workdir, postgres,
+                                      os.path.join(log_dir, f'{timestamp}_server_{i}.log'))
+            except (RuntimeError, OSError) as e:
+                logging.error(f"Matrix configuration {label(config)} failed: {e}")
+                print(f"  failed: {e}")
+                recorder = None
+            results.append((config, recorder))
+    finally:
+        if postgres:
+            postgres.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def report(results, path):
+    """Print one comparison table of every configuration and write it to `path` as JSON."""
+    header = (f"{'configuration':<44}{'action':<22}{'count':>7}{'errors':>8}{'req/s':>9}"
+              f"{'p50':>9}{'p95':>9}{'p99':>9}")
+    print(header)
+    print('-' * len(header))
+    data = []
+    for config, recorder in results:
+        entry = {**config._asdict(), 'label': label(config), 'results': None}
+        if recorder is None:
+            print(f"{label(config):<44}{'failed to run':<22}")
+        else:
+            entry['results'] = recorder.to_dict()
+            for action, action_stats in sorted(recorder.actions.items()):
+                latency = action_stats.latency
+                throughput = action_stats.count / recorder.duration if recorder.duration else 0.0
+                print(f"{label(config):<44}{action:<22}{action_stats.count:>7}{action_stats.errors:>8}"
+                      f"{throughput:>9.2f}" + ''.join(f"{latency.percentile(p) * 1e3:>9.1f}"
+                                                       for p in (50, 95, 99)))
+        data.append(entry)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+    logging.info(f"Matrix results written to {path}")
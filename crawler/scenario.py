@@ -0,0 +1,250 @@
+"""Declarative, weighted workload scenarios.
+
+A scenario is a TOML file describing a population of virtual users and a
+weighted mix of behaviours, each a list of crawler actions:
+
+    users = 20               # population size
+    duration = 120           # seconds
+    think_time = [1.0, 3.0]  # seconds between behaviours, uniform
+
+    [[behaviour]]
+    name = "post"
+    weight = 20
+    steps = ["post"]
+
+    [[behaviour]]
+    name = "message"
+    weight = 5
+    steps = ["send_private_message"]
+    think_time = [5.0, 10.0]
+
+A step is an action name or an inline table `{action = "...", ...}` whose
+other keys are passed to the step as keyword arguments. Every virtual user
+is registered and logged in before the measured window, then loops until
+the duration is up: pick a behaviour by weight, run its steps, think.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import random
+import string
+import time
+import tomllib
+
+import stats
+from http_engine import SEARCH_TERMS
+
+def random_string():
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=10))
+
+class ScenarioUser:
+    def __init__(self, engine, driver):
+        self.engine = engine
+        self.driver = driver
+        self.username = random_string()
+        self.password = random_string()
+
+    @property
+    def email(self):
+        return self.username + '@gmail.com'
+
+def other_user(vu, population):
+    others = [user for user in population if user is not vu]
+    return random.choice(others or population)
+
+def step_register(vu, population):
+    username = random_string()
+    vu.engine.prepare('logout', vu.driver)
+    vu.engine.logout(vu.username, vu.driver)
+    vu.engine.prepare('register', vu.driver)
+    vu.engine.register(username, random_string(), vu.driver)
+    vu.engine.prepare('login', vu.driver)
+    vu.engine.login(vu.username, vu.password, vu.driver)
+
+def step_login(vu, population):
+    vu.engine.prepare('logout', vu.driver)
+    vu.engine.logout(vu.username, vu.driver)
+    vu.engine.prepare('login', vu.driver)
+    vu.engine.login(vu.username, vu.password, vu.driver)
+
+def step_post(vu, population):
+    vu.engine.prepare('post', vu.driver)
+    vu.engine.post(vu.username, random_string(), vu.driver)
+
+def step_edit_bio(vu, population):
+    vu.engine.prepare('edit_bio', vu.driver)
+    vu.engine.edit_bio(vu.username, 'Hello, my name is ' + vu.username, vu.driver)
+
+def step_forgot_password(vu, population):
+    vu.engine.prepare('logout', vu.driver)
+    vu.engine.logout(vu.username, vu.driver)
+    vu.engine.prepare('forgot_password', vu.driver)
+    vu.engine.forgot_password(vu.email, vu.driver)
+    vu.engine.prepare('login', vu.driver)
+    vu.engine.login(vu.username, vu.password, vu.driver)
+
+def step_send_private_message(vu, population):
+    target = other_user(vu, population)
+    vu.engine.prepare('send_private_message', vu.driver)
+    vu.engine.send_private_message(vu.username, target.username, random_string(), vu.driver)
+
+def step_explore(vu, population, pages=1, page=None):
+    # start at the top and follow "Older posts" for the rest; explore pages
+    # are linked by cursor, so reaching `page` means walking there too
+    vu.engine.prepare('explore', vu.driver)
+    vu.engine.explore(vu.username, vu.driver)
+    for _ in range((page or 1) - 1 + pages - 1):
+        vu.engine.explore(vu.username, vu.driver, older=True)
+
+def step_view_user(vu, population):
+    target = other_user(vu, population)
+    vu.engine.prepare('view_user', vu.driver)
+    vu.engine.view_user(vu.username, target.username, vu.driver)
+
+def step_user_popup(vu, population):
+    target = other_user(vu, population)
+    vu.engine.prepare('user_popup', vu.driver)
+    vu.engine.user_popup(vu.username, target.username, vu.driver)
+
+def step_search(vu, population, query=None):
+    vu.engine.prepare('search', vu.driver)
+    vu.engine.search(vu.username, query or random.choice(SEARCH_TERMS), vu.driver)
+
+def step_poll_notifications(vu, population):
+    vu.engine.prepare('poll_notifications', vu.driver)
+    vu.engine.poll_notifications(vu.username, vu.driver)
+
+# Building blocks a scenario's steps can use. Steps that need an anonymous
+# visitor (register, forgot_password) log out first and back in afterwards.
+STEPS = {
+    'register': step_register,
+    'login': step_login,
+    'post': step_post,
+    'edit_bio': step_edit_bio,
+    'forgot_password': step_forgot_password,
+    'send_private_message': step_send_private_message,
+    'explore': step_explore,
+    'view_user': step_view_user,
+    'user_popup': step_user_popup,
+    'search': step_search,
+    'poll_notifications': step_poll_notifications,
+}
+
+def parse_think_time(value, where):
+    if isinstance(value, (int, float)):
+        value = [value, value]
+    if (not isinstance(value, list) or len(value) != 2
+            or not all(isinstance(v, (int, float)) and v >= 0 for v in value)
+            or value[0] > value[1]):
+        raise ValueError(f"{where}: think_time must be a number or [min, max] seconds")
+    return tuple(value)
+
+def parse_step(step, where):
+    if isinstance(step, str):
+        step = {'action': step}
+    if not isinstance(step, dict) or 'action' not in step:
+        raise ValueError(f"{where}: a step is an action name or a table with an 'action' key")
+    params = dict(step)
+    action = params.pop('action')
+    if action not in STEPS:
+        raise ValueError(f"{where}: unknown action '{action}', expected one of: {', '.join(STEPS)}")
+    return action, params
+
+class Behaviour:
+    def __init__(self, name, weight, steps, think_time):
+        self.name = name
+        self.weight = weight
+        self.steps = steps
+        self.think_time = think_time
+
+class Scenario:
+    def __init__(self, name, users, duration, think_time, behaviours):
+        self.name = name
+        self.users = users
+        self.duration = duration
+        self.think_time = think_time
+        self.behaviours = behaviours
+
+    def pick(self):
+        return random.choices(self.behaviours, weights=[b.weight for b in self.behaviours])[0]
+
+def load_scenario(path):
+    """Parse and validate a scenario file; raises ValueError when it is wrong."""
+    with open(path, 'rb') as f:
+        try:
+            data = tomllib.load(f)
+        except tomllib.TOMLDecodeError as e:
+            raise ValueError(f"{path}: {e}")
+
+    users = data.get('users', 10)
+    duration = data.get('duration', 60)
+    if not isinstance(users, int) or users < 1:
+        raise ValueError(f"{path}: users must be a positive integer")
+    if not isinstance(duration, (int, float)) or duration <= 0:
+        raise ValueError(f"{path}: duration must be a positive number of seconds")
+    think_time = parse_think_time(data.get('think_time', 0), path)
+
+    behaviours = []
+    for i, entry in enumerate(data.get('behaviour', [])):
+        name = entry.get('name', f'behaviour {i + 1}')
+        where = f"{path}: behaviour '{name}'"
+        weight = entry.get('weight', 1)
+        if not isinstance(weight, (int, float)) or weight <= 0:
+            raise ValueError(f"{where}: weight must be a positive number")
+        steps = [parse_step(step, where) for step in entry.get('steps', [])]
+        if not steps:
+            raise ValueError(f"{where}: needs at least one step")
+        behaviour_think_time = parse_think_time(entry['think_time'], where) \
+            if 'think_time' in entry else think_time
+        behaviours.append(Behaviour(name, weight, steps, behaviour_think_time))
+    if not behaviours:
+        raise ValueError(f"{path}: no [[behaviour]] defined")
+
+    return Scenario(data.get('name', path), users, duration, think_time, behaviours)
+
+def run_user(vu, scenario, population, deadline):
+    completed = 0
+    while time.time() < deadline:
+        behaviour = scenario.pick()
+        for action, params in behaviour.steps:
+            try:
+                STEPS[action](vu, population, **params)
+            except Exception as e:
+                logging.error(f"Step '{action}' of behaviour '{behaviour.name}' failed for '{vu.username}': {e}")
+        completed += 1
+        time.sleep(max(0.0, min(random.uniform(*behaviour.think_time), deadline - time.time())))
+    return completed
+
+def setup_user(pool):
+    engine = pool.engine
+    vu = ScenarioUser(engine, pool.acquire())
+    engine.prepare('register', vu.driver)
+    if not engine.register(vu.username, vu.password, vu.driver):
+        return vu, False
+    engine.prepare('login', vu.driver)
+    return vu, engine.login(vu.username, vu.password, vu.driver)
+
+def run_scenario(scenario, pool):
+    """Run `scenario` with one thread and pooled driver per virtual user.
+
+    Returns the number of behaviours run. Drivers go back to `pool`, reset,
+    when the run is over.
+    """
+    with ThreadPoolExecutor(max_workers=scenario.users) as executor:
+        ready = list(executor.map(lambda _: setup_user(pool), range(scenario.users)))
+        population = [vu for vu, ok in ready if ok]
+        for vu, ok in ready:
+            if not ok:
+                pool.release(vu.driver)
+        if not population:
+            raise RuntimeError("None of the virtual users could register and log in")
+        # registering the population is setup, not part of the measured run
+        stats.reset()
+
+        logging.info(f"Scenario '{scenario.name}': {len(population)} virtual users for {scenario.duration} s")
+        deadline = time.time() + scenario.duration
+        completed = sum(executor.map(lambda vu: run_user(vu, scenario, population, deadline), population))
+
+    for vu in population:
+        pool.release(vu.driver)
+    logging.info(f"Scenario '{scenario.name}' finished: {completed} behaviours completed")
+    return completed
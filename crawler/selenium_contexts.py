@@ -0,0 +1,172 @@
+"""The Selenium actions, many virtual users to one Chrome.
+
+Every virtual user gets its own browser context (what an incognito window
+is) created over the DevTools protocol, so it has its own cookie jar and
+storage but shares the renderer, GPU and network processes of a handful of
+Chrome instances. A WebDriver session only drives one window at a time, so
+each context also gets its own session, attached to the running Chrome
+through its DevTools address: the contexts of one browser run their actions
+side by side, and only opening and disposing of contexts goes through the
+session that started the browser. A chromedriver per user is a fraction of
+the memory of a Chrome per user, and with think time between actions
+BROWSERS processes carry far more concurrent users than that would fit.
+"""
+import logging
+import threading
+
+import selenium_engine
+
+# How many Chrome processes the contexts are spread over
+BROWSERS = 2
+
+class Browser:
+    def __init__(self, base_url, headless):
+        self.driver = selenium_engine.create_driver(base_url, headless=headless)
+        # guards the DevTools commands sent through `driver`, not the actions
+        self.lock = threading.Lock()
+        self.contexts = 0
+
+    def new_context(self):
+        """Open a window in a fresh browser context; returns (context id, target id)."""
+        with self.lock:
+            context_id = self.driver.execute_cdp_cmd(
+                'Target.createBrowserContext', {'disposeOnDetach': False})['browserContextId']
+            target_id = self.driver.execute_cdp_cmd(
+                'Target.createTarget', {'url': self.driver.base_url, 'browserContextId': context_id})['targetId']
+        return context_id, target_id
+
+    def dispose_context(self, context_id):
+        """Close a context along with its windows."""
+        with self.lock:
+            self.driver.execute_cdp_cmd('Target.disposeBrowserContext', {'browserContextId': context_id})
+
+_browsers = []
+# How many browsers are being started; guarded by, and waited on with, the condition
+_starting = 0
+_browsers_changed = threading.Condition()
+
+def get_browser(base_url, headless):
+    """The least loaded browser, starting another while there are fewer than BROWSERS."""
+    global _starting
+    with _browsers_changed:
+        while True:
+            if len(_browsers) + _starting < BROWSERS:
+                _starting += 1
+                break
+            if _browsers:
+                browser = min(_browsers, key=lambda b: b.contexts)
+                browser.contexts += 1
+                return browser
+            # every browser is still starting
+            _browsers_changed.wait()
+    # Chrome takes seconds to start, launch it outside the lock so the
+    # browsers warm up side by side
+    browser = None
+    try:
+        browser = Browser(base_url, headless)
+    finally:
+        with _browsers_changed:
+            _starting -= 1
+            if browser is not None:
+                browser.contexts += 1
+                _browsers.append(browser)
+            _browsers_changed.notify_all()
+    return browser
+
+class ContextDriver:
+    """One virtual user: a browser context inside a shared `Browser`, and a
+    WebDriver session of its own to drive it."""
+    def __init__(self, browser):
+        self.browser = browser
+        self.session = selenium_engine.attach_driver(browser.driver)
+        try:
+            self.open()
+        except Exception:
+            self.session.quit()
+            raise
+
+    @property
+    def base_url(self):
+        return self.session.base_url
+
+    def open(self):
+        """Open a fresh context and point the session at its window."""
+        self.context_id, target_id = self.browser.new_context()
+        # chromedriver names windows after their DevTools target
+        handle = next(h for h in self.session.window_handles if h.endswith(target_id))
+        self.session.switch_to.window(handle)
+        selenium_engine.block_urls(self.session)
+
+def create_driver(base_url, headless=True):
+    return ContextDriver(get_browser(base_url, headless))
+
+def quit_driver(driver):
+    browser = driver.browser
+    try:
+        browser.dispose_context(driver.context_id)
+    except Exception as e:
+        logging.info(f"Could not dispose of a browser context: {e}")
+    # an attached session detaches on quit, the browser keeps running
+    selenium_engine.quit_driver(driver.session)
+    with _browsers_changed:
+        browser.contexts -= 1
+        idle = browser.contexts == 0
+        if idle:
+            _browsers.remove(browser)
+            _browsers_changed.notify_all()
+    if idle:
+        selenium_engine.quit_driver(browser.driver)
+
+def reset_driver(driver):
+    """Swap the context for a fresh one, which forgets cookies and storage."""
+    selenium_engine.count_skipped(driver.session)
+    driver.browser.dispose_context(driver.context_id)
+    driver.open()
+
+def driver_alive(driver):
+    try:
+        return selenium_engine.driver_alive(driver.session)
+    except Exception:
+        return False
+
+def inject_session(driver, cookies):
+    selenium_engine.inject_session(driver.session, cookies)
+
+def prepare(action, driver):
+    selenium_engine.prepare(action, driver.session)
+
+def register(username, password, driver):
+    return selenium_engine.register(username, password, driver.session)
+
+def login(username, password, driver):
+    return selenium_engine.login(username, password, driver.session)
+
+def post(username, message, driver):
+    return selenium_engine.post(username, message, driver.session)
+
+def edit_bio(username, bio, driver):
+    return selenium_engine.edit_bio(username, bio, driver.session)
+
+def logout(username, driver):
+    return selenium_engine.logout(username, driver.session)
+
+def forgot_password(email, driver):
+    return selenium_engine.forgot_password(email, driver.session)
+
+def send_private_message(username, target_username, message, driver):
+    return selenium_engine.send_private_message(username, target_username, message, driver.session)
+
+def explore(username, driver, older=False):
+    return selenium_engine.explore(username, driver.session, older=older)
+
+def view_user(username, target_username, driver):
+    return selenium_engine.view_user(username, target_username, driver.session)
+
+def user_popup(username, target_username, driver):
+    return selenium_engine.user_popup(username, target_username, driver.session)
+
+def search(username, query, driver):
+    return selenium_engine.search(username, query, driver.session)
+
+def poll_notifications(username, driver, since=0):
+    return selenium_engine.poll_notifications(username, driver.session, since=since)
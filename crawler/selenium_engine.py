@@ -0,0 +1,473 @@
+"""Crawler actions that drive a real (headless) Chrome through Selenium.
+
+With LIGHTWEIGHT set, browsers load pages eagerly (the action continues at
+DOMContentLoaded) and refuse images and the third-party resources in
+BLOCKED_URLS, the gravatar avatars: the image content setting is off and
+every pattern is handed to the DevTools Network.setBlockedURLs command.
+Stylesheets and scripts stay, since they are part of the render cost and
+popovers and notification polling need Bootstrap. On a network that cannot
+reach the CDNs, run the server with LOCAL_ASSETS (see `flask assets fetch`)
+so it serves its own copies; a page still pointing at a CDN is warned about.
+
+What the browsers downloaded, from Network.loadingFinished, and what
+LIGHTWEIGHT skipped are read back from the performance log and summed by
+`report_skipped`.
+"""
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from collections import Counter
+import json
+import logging
+import threading
+import time
+
+import stats
+
+LIGHTWEIGHT = False
+# Network.setBlockedURLs wildcard patterns, third-party resources only
+BLOCKED_URLS = ['*gravatar.com*']
+# Hosts base.html loads its assets from unless the server has LOCAL_ASSETS
+CDN_HOSTS = ('cdn.jsdelivr.net', 'cdnjs.cloudflare.com')
+
+# Blocked URL -> times it was blocked, across every driver of the run
+skipped = Counter()
+# Responses and their encoded bytes, across every driver of the run
+downloaded = Counter()
+_skipped_lock = threading.Lock()
+_cdn_warned = threading.Event()
+
+# Page each action expects the browser to be on when it starts
+START_PAGES = {
+    'register': '/auth/login',
+    'login': '/auth/login',
+    'post': '/index',
+    'edit_bio': '/index',
+    'logout': '/index',
+    'forgot_password': '/auth/login',
+    'send_private_message': '/index',
+    'explore': '/index',
+    'view_user': '/index',
+    'user_popup': '/explore',
+    'search': '/index',
+    'poll_notifications': '/index',
+}
+
+def session_options():
+    """What every WebDriver session asks for, whether it starts Chrome or attaches to one."""
+    driver_opts = Options()
+    if LIGHTWEIGHT:
+        driver_opts.page_load_strategy = 'eager'
+    # network events for `count_skipped`, in both modes so they compare
+    driver_opts.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+    driver_opts.add_experimental_option('perfLoggingPrefs', {'enableNetwork': True, 'enablePage': False})
+    return driver_opts
+
+def create_driver(base_url, headless=True):
+    driver_opts = session_options()
+    if headless:
+        driver_opts.add_argument("--window-size=1920,1080")
+        driver_opts.add_argument('--no-sandbox')
+        driver_opts.add_argument('--disable-dev-shm-usage')
+        driver_opts.add_argument("--headless=new")
+    if LIGHTWEIGHT:
+        driver_opts.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+
+    driver = webdriver.Chrome(options=driver_opts)
+    driver.base_url = base_url
+    block_urls(driver)
+    driver.get(base_url)
+    if LIGHTWEIGHT and not _cdn_warned.is_set() and \
+            any(host in driver.page_source for host in CDN_HOSTS):
+        _cdn_warned.set()
+        logging.warning("The server loads its assets from CDNs, which stall pages on an "
+                        "isolated network; start it with LOCAL_ASSETS set")
+    return driver
+
+def attach_driver(driver):
+    """Another WebDriver session on the Chrome `driver` started.
+
+    It has its own chromedriver, so it drives its windows independently of the
+    session that started the browser; quitting it leaves the browser running.
+    """
+    driver_opts = session_options()
+    driver_opts.debugger_address = driver.capabilities['goog:chromeOptions']['debuggerAddress']
+    attached = webdriver.Chrome(options=driver_opts)
+    attached.base_url = driver.base_url
+    return attached
+
+def block_urls(driver):
+    """Turn on BLOCKED_URLS for the window the driver is on, when LIGHTWEIGHT."""
+    if LIGHTWEIGHT:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URLS})
+
+def count_skipped(driver):
+    """Drain the performance log, counting what the browser blocked and downloaded."""
+    urls = {}
+    blocked = Counter()
+    responses = total_bytes = 0
+    for entry in driver.get_log('performance'):
+        message = json.loads(entry['message'])['message']
+        params = message.get('params', {})
+        if message['method'] == 'Network.requestWillBeSent':
+            urls[params['requestId']] = params['request']['url']
+        elif message['method'] == 'Network.loadingFailed' and params.get('blockedReason'):
+            blocked[urls.get(params['requestId'], '(unknown)')] += 1
+        elif message['method'] == 'Network.loadingFinished':
+            responses += 1
+            total_bytes += int(params.get('encodedDataLength', 0))
+    with _skipped_lock:
+        skipped.update(blocked)
+        downloaded.update(responses=responses, bytes=total_bytes)
+
+def report_skipped():
+    """Log and print what the browsers downloaded and what LIGHTWEIGHT skipped.
+
+    A blocked request never reaches the network, so its size is unknown;
+    the saving is the difference from the bytes a run without LIGHTWEIGHT
+    downloads.
+    """
+    if not skipped and not downloaded:
+        return
+    line = (f"Browsers downloaded {downloaded['bytes'] / 1024:.1f} KiB in "
+            f"{downloaded['responses']} responses and skipped {sum(skipped.values())} "
+            f"requests to {len(skipped)} URLs")
+    logging.info(line)
+    print(line)
+
+def quit_driver(driver):
+    count_skipped(driver)
+    driver.quit()
+
+def reset_driver(driver):
+    """Forget the last virtual user: cookies, storage, and back to the start."""
+    count_skipped(driver)
+    driver.delete_all_cookies()
+    driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+    driver.get(driver.base_url)
+
+def inject_session(driver, cookies):
+    """Take over a session logged in elsewhere (see sessions.py) and go home."""
+    # cookies can only be set for the site the browser is on
+    if not driver.current_url.startswith(driver.base_url):
+        driver.get(driver.base_url)
+    for name, value in cookies.items():
+        driver.add_cookie({'name': name, 'value': value, 'path': '/'})
+    driver.get(driver.base_url)
+
+def driver_alive(driver):
+    try:
+        driver.current_url
+        return True
+    except Exception:
+        return False
+
+def prepare(action, driver):
+    """Navigate to the page `action` starts from, when chaining actions freely."""
+    driver.get(driver.base_url.rstrip('/') + START_PAGES[action])
+
+@stats.timed('edit_bio')
+def edit_bio(username, bio, driver):
+    start_time = time.time()
+    try:
+        profile_link = WebDriverWait(driver, 10).until(
+            EC.presence_of_element_located((By.XPATH, "//a[@class='nav-link' and text()='Profile']"))
+        )
+        profile_link.click()
+    except Exception as e:
+        logging.info(e)
+        logging.error(f"Failed to find or click the Profile link: {e}")
+        return
+    try:
+        driver.find_element(By.LINK_TEXT, 'Edit your profile').click()
+        driver.find_element(By.ID, 'about_me').clear()
+        driver.find_element(By.ID, 'about_me').send_keys(bio)
+        driver.find_element(By.ID, 'submit').click()
+        success = driver.find_element(By.CLASS_NAME, 'alert-info').text
+        duration = time.time() - start_time
+        if success == 'Your changes have been saved.':
+            logging.info(f"Bio updated for user '{username}': (Duration {duration:.5f} s)")
+            return True
+        else:
+            logging.error(f"Bio update failed for user '{username}': (Duration {duration:.5f} s)")
+            return False
+    except Exception as e:
+        logging.error(f"An error occurred while editing the bio: {e}")
+        return False
+
+@stats.timed('register')
+def register(username, password, driver):
+    start_time = time.time()
+    driver.find_element(By.LINK_TEXT, 'Click to Register!').click()
+    driver.find_element(By.ID, 'username').send_keys(username)
+    driver.find_element(By.ID, 'email').send_keys(username + '@gmail.com')
+    driver.find_element(By.ID, 'password').send_keys(password)
+    driver.find_element(By.ID, 'password2').send_keys(password)
+    driver.find_element(By.ID, 'submit').click()
+    try:
+        success = WebDriverWait(driver, 10).until(
+            EC.visibility_of_element_located((By.CLASS_NAME, 'alert-info'))
+        ).text
+        duration = time.time() - start_time
+        if success == 'Congratulations, you are now a registered user!':
+            logging.info(f"Registration successful for user '{username}': (Duration {duration:.5f} s)")
+            return True
+        else:
+            logging.error(f"Registration failed for user '{username}': (Duration {duration:.5f} s)")
+            return False
+    except Exception as e:
+        logging.error(f"Failed to get registration success message: {e}")
+        return False
+
+@stats.timed('forgot_password')
+def forgot_password(email, driver):
+    start_time = time.time()
+    driver.find_element(By.LINK_TEXT, 'Click to Reset It').click()
+    driver.find_element(By.ID, 'email').send_keys(email)
+    driver.find_element(By.ID, 'submit').click()
+    try:
+        WebDriverWait(driver, 10).until(
+            EC.presence_of_element_located((By.CLASS_NAME, 'alert-info'))
+        )
+        success = driver.find_element(By.CLASS_NAME, 'alert-info').text
+        duration = time.time() - start_time
+        if success == 'Check your email for the instructions to reset your password':
+            logging.info(f"Forgot password request sent for email '{email}': (Duration {duration:.5f} s)")
+            return True
+        else:
+            logging.error(f"Forgot password request failed for email '{email}': (Duration {duration:.5f} s)")
+            return False
+    except Exception as e:
+        logging.error(f"An error occurred while waiting for the forgot password confirmation: {e}")
+        return False
+
+@stats.timed('login')
+def login(username, password, driver):
+    start_time = time.time()
+    driver.find_element(By.ID, 'username').send_keys(username)
+    driver.find_element(By.ID, 'password').send_keys(password)
+    driver.find_element(By.ID, 'submit').click()
+    try:
+        success = WebDriverWait(driver, 10).until(
+                EC.visibility_of_element_located((By.TAG_NAME, 'h1'))
+        ).text
+        duration = time.time() - start_time
+        if success == 'Hi, ' + username + '!':
+            logging.info(f"Login successful for user '{username}': (Duration {duration:.5f} s)")
+            return True
+        else:
+            logging.error(f"Login failed for user '{username}': (Duration {duration:.5f} s)")
+            return False
+    except Exception as e:
+        logging.info(f"An error occurred during login for '{username}': {e}")
+        return False
+
+@stats.timed('logout')
+def logout(username, driver):
+    start_time = time.time()
+    try:
+        profile_link = WebDriverWait(driver, 5).until(
+            EC.presence_of_element_located((By.XPATH, "//a[@class='nav-link' and text()='Logout']"))
+        )
+        profile_link.click()
+    except Exception as e:
+        logging.info(e)
+        logging.error(f"Failed to find or click the Profile link: {e}")
+        return
+    try:
+        success = WebDriverWait(driver, 10).until(
+            EC.visibility_of_element_located((By.CLASS_NAME, 'alert-info'))
+        ).text
+        duration = time.time() - start_time
+        if success == 'Please log in to access this page.':
+            logging.info(f"Logout successful for '{username}': (Duration {duration:.5f} s)")
+            return True
+        else:
+            logging.error(f"Logout failed for '{username}': (Duration {duration:.5f} s)")
+            return False
+    except Exception as e:
+        logging.error(f"Failed to get logout confirmation message: {e}")
+        return False
+
+@stats.timed('post')
+def post(username, message, driver):
+    start_time = time.time()
+    driver.find_element(By.ID, 'post').send_keys(message)
+    driver.find_element(By.ID, 'submit').click()
+    try:
+        post = WebDriverWait(driver, 10).until(
+            EC.visibility_of_element_located((By.CLASS_NAME, "alert"))
+        ).text
+        duration = time.time() - start_time
+        if "Your post is now live!" in post:
+            logging.info(f"'{username}' submitted a post successfully: (Duration {duration:.5f} s)")
+            return True
+        else:
+            logging.error(f"'{username}' post failed: (Duration {duration:.5f} s)")
+            return False
+    except Exception as e:
+        logging.error(f"Failed to confirm post submission: {e}")
+        return False
+
+@stats.timed('send_private_message')
+def send_private_message(username, target_username, message, driver):
+    try:
+        explore_link = WebDriverWait(driver, 5).until(
+            EC.presence_of_element_located((By.LINK_TEXT, "Explore"))
+        )
+        explore_link.click()
+        user_links = driver.find_elements(By.CLASS_NAME, "user_popup")
+        for link in user_links:
+            if link.text.strip() == target_username:
+                link.click()
+                break
+        else:
+            logging.info(f"Could not find a link matching the target username: '{target_username}'")
+            return False
+
+        WebDriverWait(driver, 5).until(
+            EC.presence_of_element_located((By.LINK_TEXT, "Send private message"))
+        ).click()
+
+        message_textarea = WebDriverWait(driver, 5).until(
+            EC.presence_of_element_located((By.TAG_NAME, 'textarea'))
+        )
+        message_textarea.send_keys(message)
+        submit_button = driver.find_element(By.ID, 'submit')
+        submit_button.click()
+
+        success_message = WebDriverWait(driver, 5).until(
+            EC.presence_of_element_located((By.CLASS_NAME, 'alert-info'))
+        ).text
+        if success_message == 'Your message has been sent.':
+            logging.info(f"Private message sent from '{username}' to '{target_username}'")
+            return True
+        else:
+            logging.error(f"Private message failed for '{username}' to '{target_username}'")
+            return False
+    except Exception as e:
+        logging.error(f"An error occurred while sending private message to '{target_username}': {e}")
+        return False
+
+@stats.timed('explore')
+def explore(username, driver, older=False):
+    start_time = time.time()
+    path = '/explore'
+    try:
+        older_links = driver.find_elements(By.PARTIAL_LINK_TEXT, 'Older posts') if older else []
+        older_url = older_links[0].get_attribute('href') if older_links else None
+        if older_url and '/explore' in older_url and not older_url.endswith('None'):
+            older_links[0].click()
+        else:
+            WebDriverWait(driver, 5).until(
+                EC.presence_of_element_located((By.LINK_TEXT, "Explore"))
+            ).click()
+        heading = WebDriverWait(driver, 10).until(
+            EC.visibility_of_element_located((By.TAG_NAME, 'h1'))
+        ).text
+        path = driver.current_url[len(driver.base_url.rstrip('/')):]
+        duration = time.time() - start_time
+        if heading == 'Hi, ' + username + '!':
+            logging.info(f"'{username}' viewed explore page '{path}': (Duration {duration:.5f} s)")
+            return True
+        else:
+            logging.error(f"'{username}' could not view explore page '{path}': (Duration {duration:.5f} s)")
+            return False
+    except Exception as e:
+        logging.error(f"An error occurred while viewing explore page '{path}': {e}")
+        return False
+
+@stats.timed('view_user')
+def view_user(username, target_username, driver):
+    start_time = time.time()
+    try:
+        driver.get(f"{driver.base_url.rstrip('/')}/user/{target_username}")
+        heading = WebDriverWait(driver, 10).until(
+            EC.visibility_of_element_located((By.TAG_NAME, 'h1'))
+        ).text
+        duration = time.time() - start_time
+        if heading == 'User: ' + target_username:
+            logging.info(f"'{username}' viewed the profile of '{target_username}': (Duration {duration:.5f} s)")
+            return True
+        else:
+            logging.error(f"'{username}' could not view the profile of '{target_username}': (Duration {duration:.5f} s)")
+            return False
+    except Exception as e:
+        logging.error(f"An error occurred while viewing the profile of '{target_username}': {e}")
+        return False
+
+@stats.timed('user_popup')
+def user_popup(username, target_username, driver):
+    start_time = time.time()
+    try:
+        user_links = driver.find_elements(By.CLASS_NAME, "user_popup")
+        for link in user_links:
+            if link.text.strip() == target_username:
+                break
+        else:
+            logging.info(f"Could not find a link matching the target username: '{target_username}'")
+            return False
+        # hovering is what fires the popup request, after a 500 ms delay
+        ActionChains(driver).move_to_element(link).perform()
+        WebDriverWait(driver, 10).until(
+            EC.visibility_of_element_located((By.CSS_SELECTOR, '.popover .popover-body a'))
+        )
+        popup = driver.find_element(By.CLASS_NAME, 'popover').text
+        duration = time.time() - start_time
+        ActionChains(driver).move_by_offset(0, 200).perform()
+        if target_username in popup:
+            logging.info(f"'{username}' opened the popup of '{target_username}': (Duration {duration:.5f} s)")
+            return True
+        else:
+            logging.error(f"'{username}' could not open the popup of '{target_username}': (Duration {duration:.5f} s)")
+            return False
+    except Exception as e:
+        logging.error(f"An error occurred while opening the popup of '{target_username}': {e}")
+        return False
+
+@stats.timed('search')
+def search(username, query, driver):
+    start_time = time.time()
+    try:
+        search_box = driver.find_element(By.NAME, 'q')
+        search_box.clear()
+        search_box.send_keys(query + Keys.ENTER)
+        heading = WebDriverWait(driver, 10).until(
+            EC.visibility_of_element_located((By.TAG_NAME, 'h1'))
+        ).text
+        duration = time.time() - start_time
+        if heading == 'Search Results':
+            logging.info(f"'{username}' searched for '{query}': (Duration {duration:.5f} s)")
+            return True
+        else:
+            logging.error(f"'{username}' search for '{query}' failed: (Duration {duration:.5f} s)")
+            return False
+    except Exception as e:
+        logging.error(f"An error occurred while searching for '{query}': {e}")
+        return False
+
+@stats.timed('poll_notifications')
+def poll_notifications(username, driver, since=0):
+    start_time = time.time()
+    try:
+        # the same fetch base.html runs every 10 seconds, from inside the page
+        status = driver.execute_async_script(
+            "const done = arguments[arguments.length - 1];"
+            "fetch('/notifications?since=' + arguments[0])"
+            ".then(r => r.ok && r.headers.get('Content-Type').startsWith('application/json') ? r.status : 0)"
+            ".then(done, () => done(0));", since)
+        duration = time.time() - start_time
+        if status == 200:
+            logging.info(f"Notifications polled for '{username}': (Duration {duration:.5f} s)")
+            return True
+        else:
+            logging.error(f"Notification poll failed for '{username}': (Duration {duration:.5f} s)")
+            return False
+    except Exception as e:
+        logging.error(f"An error occurred while polling notifications for '{username}': {e}")
+        return False
@@ -0,0 +1,41 @@
+"""Log each virtual user in once and hand its session cookie around.
+
+Logging in through the form costs a page load, a form post and a password
+hash check, which used to dwarf the post or message a task was timing.
+`SessionCache` logs a user in over plain HTTP the first time it is asked
+for them, outside of any measurement, and keeps the cookies; engines then
+`inject_session` them into whichever driver picks up that user's task.
+
+Only the form login gives a session cookie: tokens from /api/tokens are
+accepted by the API blueprint, not by the pages the actions use.
+"""
+import logging
+import threading
+
+import http_engine
+import traffic
+
+class SessionCache:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self._cookies = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, username, password):
+        """Cookies of a logged-in session for `username`; None if login fails."""
+        with self._lock:
+            lock = self._locks.setdefault(username, threading.Lock())
+        # one login per user even when several tasks ask for it at once
+        with lock:
+            if username not in self._cookies:
+                self._cookies[username] = self.login(username, password)
+            return self._cookies[username]
+
+    def login(self, username, password):
+        with http_engine.HttpDriver(self.base_url) as session, traffic.acting_as(username):
+            if not http_engine.run_flow(session, http_engine.login_flow(username, password)):
+                logging.error(f"Could not log '{username}' in to share the session")
+                return None
+            return session.cookies.get_dict()
+
@@ -0,0 +1,196 @@
+"""Soak runs: watch the server's worker processes while a long run goes on.
+
+A `Sampler` thread reads every gunicorn worker's resident memory, CPU time,
+open file descriptors and thread count from /proc every few seconds, and at
+the same moments takes the latency histograms the run recorded since the
+last sample, so memory and load end up on one timeline. Those come from a
+tap of its own (`stats.taps`), so the run's recorder, which benches like
+--capacity judge their steps on, is left whole. Workers come and go
+(max_requests, crashes), so they are looked up again at every sample and
+each pid is its own series.
+
+A worker is flagged when its memory grew in each third of the run and by
+more than GROWTH_THRESHOLD overall: a slow climb that never levels off is
+what a leak looks like, while a cache filling up flattens out.
+
+Only the server has to be on this machine; it is found by its command line
+(a gunicorn master and its workers) unless given with --server-pid, in
+which case that process' children are sampled, or the process itself if it
+has none (the Flask development server). Stats recorded in worker
+processes (--processes above 1) only come back at the end of the run, so
+the timeline's throughput and latency need a single-process bench.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import stats
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+# Least growth, as a fraction of the first sample, that can be flagged
+GROWTH_THRESHOLD = 0.05
+
+def read_stat(pid):
+    """(parent pid, CPU seconds) of `pid`, from /proc/<pid>/stat."""
+    with open(f'/proc/{pid}/stat') as f:
+        # the command in parentheses may contain spaces, split after it
+        fields = f.read().rsplit(')', 1)[1].split()
+    return int(fields[1]), (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+def is_gunicorn(pid):
+    """Whether `pid` runs gunicorn: `gunicorn ...`, `python -m gunicorn ...` or `python .../gunicorn ...`."""
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            args = f.read().decode(errors='replace').split('\0')
+    except OSError:
+        return False
+    return 'gunicorn' in (os.path.basename(arg) for arg in args[:3])
+
+def processes():
+    """{pid: parent pid} of every process still around."""
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                parents[int(entry)] = read_stat(entry)[0]
+            except (OSError, IndexError, ValueError):
+                pass
+    return parents
+
+def find_gunicorn():
+    """The pid of the gunicorn master, None if there is none."""
+    for pid, parent in processes().items():
+        if is_gunicorn(pid) and not is_gunicorn(parent):
+            return pid
+    return None
+
+def workers(server_pid):
+    """The server's children, or the server itself if it has none."""
+    children = [pid for pid, parent in processes().items() if parent == server_pid]
+    return children or [server_pid]
+
+def sample(pid):
+    """One reading of a worker; raises OSError if it has gone."""
+    with open(f'/proc/{pid}/statm') as f:
+        rss = int(f.read().split()[1]) * PAGE_SIZE
+    with open(f'/proc/{pid}/status') as f:
+        threads = next(int(line.split()[1]) for line in f if line.startswith('Threads:'))
+    return {
+        'pid': pid,
+        'rss': rss,
+        'cpu': read_stat(pid)[1],
+        'fds': len(os.listdir(f'/proc/{pid}/fd')),
+        'threads': threads,
+    }
+
+class Sampler(threading.Thread):
+    """Samples `server_pid`'s workers and the run's stats every `interval` seconds."""
+    def __init__(self, server_pid, interval=10.0):
+        super().__init__(name='soak-sampler', daemon=True)
+        self.server_pid = server_pid
+        self.interval = interval
+        self.samples = []
+        self.windows = []
+        # what the run recorded since the last sample
+        self.recorder = stats.Recorder()
+        stats.taps.append(self.recorder)
+        self.started = None
+        self._done = threading.Event()
+
+    def run(self):
+        self.started = time.time()
+        self.take()
+        while not self._done.wait(self.interval):
+            self.take()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.take()
+        stats.taps.remove(self.recorder)
+
+    def take(self):
+        now = time.time()
+        offset = now - self.started
+        for pid in workers(self.server_pid):
+            try:
+                self.samples.append({'t': offset, **sample(pid)})
+            except (OSError, StopIteration):
+                # exited between listing and reading
+                pass
+        window = self.recorder.take()
+        previous = self.windows[-1]['t'] if self.windows else 0.0
+        requests = sum(s.count for s in window.actions.values())
+        latency = stats.Histogram()
+        for action_stats in window.actions.values():
+            latency.merge(action_stats.latency)
+        self.windows.append({
+            't': offset,
+            'requests': requests,
+            'errors': sum(s.errors for s in window.actions.values()),
+            'throughput': requests / (offset - previous) if offset > previous else 0.0,
+            'p50': latency.percentile(50),
+            'p95': latency.percentile(95),
+        })
+
+    def series(self):
+        """Samples grouped by pid, in time order."""
+        by_pid = {}
+        for s in self.samples:
+            by_pid.setdefault(s['pid'], []).append(s)
+        return by_pid
+
+def growth(samples):
+    """Memory growth of one worker: (MB per hour, whether it looks like a leak)."""
+    if len(samples) < 3:
+        return 0.0, False
+    # least-squares slope of RSS over time
+    n = len(samples)
+    mean_t = sum(s['t'] for s in samples) / n
+    mean_rss = sum(s['rss'] for s in samples) / n
+    spread = sum((s['t'] - mean_t) ** 2 for s in samples)
+    slope = (sum((s['t'] - mean_t) * (s['rss'] - mean_rss) for s in samples) / spread
+             if spread else 0.0)
+    thirds = [samples[i * n // 3:(i + 1) * n // 3] for i in range(3)]
+    means = [sum(s['rss'] for s in third) / len(third) for third in thirds]
+    growing = means[0] < means[1] < means[2]
+    grew = samples[-1]['rss'] - samples[0]['rss'] > GROWTH_THRESHOLD * samples[0]['rss']
+    return slope * 3600 / 2**20, growing and grew
+
+def report(sampler, path):
+    """Print one line per worker and the timeline, and write everything to `path` as JSON."""
+    header = (f"{'pid':>8}{'samples':>9}{'RSS MB':>16}{'MB/hour':>10}{'CPU s':>8}"
+              f"{'fds':>10}{'threads':>10}  memory")
+    lines = ['Workers (first -> last sample):', header, '-' * len(header)]
+    workers_data = []
+    for pid, samples in sorted(sampler.series().items()):
+        first, last = samples[0], samples[-1]
+        rate, leak = growth(samples)
+        rss = f"{first['rss'] / 2**20:.1f} -> {last['rss'] / 2**20:.1f}"
+        fds = f"{first['fds']} -> {last['fds']}"
+        threads = f"{first['threads']} -> {last['threads']}"
+        lines.append(f"{pid:>8}{len(samples):>9}{rss:>16}{rate:>10.1f}"
+                     f"{last['cpu'] - first['cpu']:>8.1f}{fds:>10}{threads:>10}"
+                     f"  {'GROWING' if leak else 'ok'}")
+        workers_data.append({'pid': pid, 'mb_per_hour': rate, 'growing': leak})
+        if leak:
+            logging.warning(f"Worker {pid} memory grew steadily: "
+                            f"{first['rss'] / 2**20:.1f} MB -> {last['rss'] / 2**20:.1f} MB "
+                            f"({rate:.1f} MB/hour)")
+
+    timeline_header = f"{'t (s)':>8}{'req/s':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'RSS MB':>10}"
+    lines += ['', 'Timeline (RSS summed over workers):', timeline_header, '-' * len(timeline_header)]
+    for window in sampler.windows:
+        rss = sum(s['rss'] for s in sampler.samples if s['t'] == window['t'])
+        lines.append(f"{window['t']:>8.0f}{window['throughput']:>9.1f}{window['errors']:>8}"
+                     f"{window['p50'] * 1e3:>9.1f}{window['p95'] * 1e3:>9.1f}{rss / 2**20:>10.1f}")
+    for line in lines:
+        print(line)
+
+    with open(path, 'w') as f:
+        json.dump({'interval': sampler.interval, 'workers': workers_data,
+                   'samples': sampler.samples, 'windows': sampler.windows}, f, indent=2)
+    logging.info(f"Soak samples written to {path}")
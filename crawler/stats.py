@@ -0,0 +1,300 @@
+"""Per-action latency histograms for crawler runs.
+
+Every action records its outcome and duration into a process-local
+`Recorder`. Histograms use HdrHistogram-style log-linear buckets: values are
+kept in microseconds, each power of two is split into 2**(SUB_BUCKET_BITS-1)
+linear buckets, so any recorded value is reproduced to within 1% while the
+histogram itself stays a small sparse dict. Recorders from worker processes
+are sent back to the parent and merged bucket by bucket.
+
+When the crawler runs on a schedule, each action also gets a second,
+coordinated-omission corrected histogram measured from the time the request
+was *meant* to be sent. A closed-loop worker stuck behind a stalled request
+sends its next one late, so the uncorrected histogram only ever sees one
+slow sample; the corrected one charges the stall to every request that was
+due during it.
+
+Something watching the run while it goes on (the soak sampler) adds a
+recorder of its own to `taps`, which every action is recorded into as
+well, and drains that one instead of the recorder the run is judged on.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+import contextvars
+import json
+import logging
+import threading
+import time
+
+SUB_BUCKET_BITS = 8
+PERCENTILES = (50, 90, 95, 99, 99.9)
+
+class Histogram:
+    def __init__(self, counts=None):
+        self.counts = Counter(counts or {})
+        self.total = sum(self.counts.values())
+
+    @staticmethod
+    def bucket_index(value):
+        if value < (1 << SUB_BUCKET_BITS):
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return (shift << (SUB_BUCKET_BITS - 1)) + (value >> shift)
+
+    @staticmethod
+    def bucket_value(index):
+        """Midpoint of the range of values that land in bucket `index`."""
+        shift = max(0, (index >> (SUB_BUCKET_BITS - 1)) - 1)
+        lowest = (index - (shift << (SUB_BUCKET_BITS - 1))) << shift
+        return lowest + ((1 << shift) - 1) / 2
+
+    def record(self, seconds, count=1):
+        self.counts[self.bucket_index(max(0, int(seconds * 1e6)))] += count
+        self.total += count
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.total += other.total
+
+    def percentile(self, percent):
+        """Latency in seconds below which `percent` % of the samples fall."""
+        if not self.total:
+            return 0.0
+        rank = max(1, percent / 100 * self.total)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return self.bucket_value(index) / 1e6
+        return self.max
+
+    @property
+    def min(self):
+        return self.bucket_value(min(self.counts)) / 1e6 if self.total else 0.0
+
+    @property
+    def max(self):
+        return self.bucket_value(max(self.counts)) / 1e6 if self.total else 0.0
+
+    @property
+    def mean(self):
+        if not self.total:
+            return 0.0
+        return sum(self.bucket_value(i) * n for i, n in self.counts.items()) / self.total / 1e6
+
+    def samples(self):
+        """Approximate the recorded samples, one bucket value per count."""
+        for index in sorted(self.counts):
+            yield from [self.bucket_value(index) / 1e6] * self.counts[index]
+
+class ActionStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.corrected = Histogram()
+        self.errors = 0
+
+    @property
+    def count(self):
+        return self.latency.total
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.corrected.merge(other.corrected)
+        self.errors += other.errors
+
+class Recorder:
+    """Thread-safe collection of `ActionStats` keyed by action name."""
+    def __init__(self):
+        self.actions = {}
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def record(self, action, duration, success=True, intended=None):
+        now = time.time()
+        with self._lock:
+            stats = self.actions.setdefault(action, ActionStats())
+            stats.latency.record(duration)
+            if intended is not None:
+                stats.corrected.record(max(duration, now - intended))
+            if not success:
+                stats.errors += 1
+            if self.started is None or now - duration < self.started:
+                self.started = now - duration
+            if self.finished is None or now > self.finished:
+                self.finished = now
+
+    def take(self):
+        """Everything recorded so far, as a new Recorder, leaving this one empty.
+
+        Done under the lock, so a record() running in another thread lands
+        wholly in what is taken or wholly in what comes after.
+        """
+        taken = Recorder()
+        with self._lock:
+            taken.actions, self.actions = self.actions, {}
+            taken.started, self.started = self.started, None
+            taken.finished, self.finished = self.finished, None
+        return taken
+
+    def merge(self, other):
+        with self._lock:
+            for action, stats in other.actions.items():
+                self.actions.setdefault(action, ActionStats()).merge(stats)
+            if other.started is not None:
+                self.started = min(filter(None, (self.started, other.started)))
+                self.finished = max(filter(None, (self.finished, other.finished)))
+
+    @property
+    def duration(self):
+        if self.started is None:
+            return 0.0
+        return self.finished - self.started
+
+    def to_dict(self):
+        duration = self.duration
+        actions = {}
+        for action, stats in sorted(self.actions.items()):
+            latency = stats.latency
+            actions[action] = {
+                'count': stats.count,
+                'errors': stats.errors,
+                'throughput': stats.count / duration if duration else 0.0,
+                'mean': latency.mean,
+                'min': latency.min,
+                'max': latency.max,
+                **{f'p{p:g}': latency.percentile(p) for p in PERCENTILES},
+                'histogram': {str(i): n for i, n in sorted(latency.counts.items())},
+            }
+            if stats.corrected.total:
+                corrected = stats.corrected
+                actions[action]['corrected'] = {
+                    'mean': corrected.mean,
+                    'max': corrected.max,
+                    **{f'p{p:g}': corrected.percentile(p) for p in PERCENTILES},
+                    'histogram': {str(i): n for i, n in sorted(corrected.counts.items())},
+                }
+        return {
+            'started': self.started,
+            'finished': self.finished,
+            'duration': duration,
+            'sub_bucket_bits': SUB_BUCKET_BITS,
+            'actions': actions,
+        }
+
+    def summary(self):
+        """A fixed-width table of the run, one row per action, in milliseconds."""
+        header = (f"{'action':<22}{'count':>8}{'errors':>8}{'req/s':>9}"
+                  + ''.join(f"{'p' + format(p, 'g'):>10}" for p in PERCENTILES)
+                  + f"{'max':>10}")
+        lines = [header, '-' * len(header)]
+        duration = self.duration
+        for action, stats in sorted(self.actions.items()):
+            latency = stats.latency
+            throughput = stats.count / duration if duration else 0.0
+            lines.append(f"{action:<22}{stats.count:>8}{stats.errors:>8}{throughput:>9.2f}"
+                         + ''.join(f"{latency.percentile(p) * 1e3:>10.1f}" for p in PERCENTILES)
+                         + f"{latency.max * 1e3:>10.1f}")
+
+        corrected = {action: stats for action, stats in sorted(self.actions.items())
+                     if stats.corrected.total}
+        if corrected:
+            lines += ['', 'Coordinated-omission corrected, from the intended send time (raw / corrected):']
+            header = f"{'action':<22}" + ''.join(
+                f"{'p' + format(p, 'g'):>20}" for p in PERCENTILES) + f"{'max':>20}"
+            lines += [header, '-' * len(header)]
+            for action, stats in corrected.items():
+                pairs = [(stats.latency.percentile(p), stats.corrected.percentile(p))
+                         for p in PERCENTILES]
+                pairs.append((stats.latency.max, stats.corrected.max))
+                lines.append(f"{action:<22}" + ''.join(
+                    f"{f'{raw * 1e3:.1f} / {fixed * 1e3:.1f}':>20}" for raw, fixed in pairs))
+        return '\n'.join(lines)
+
+# Each process (and every thread in it) records into this one
+recorder = Recorder()
+# and into each of these, which their owners take from as they please
+taps = []
+
+# Wall-clock time the action being run was scheduled for, if it was
+intended_start = contextvars.ContextVar('intended_start', default=None)
+
+def record(action, duration, success=True):
+    intended = intended_start.get()
+    recorder.record(action, duration, success, intended)
+    for tap in taps:
+        tap.record(action, duration, success, intended)
+
+@contextmanager
+def scheduled(intended):
+    """Mark the actions run inside the block as due at wall-clock `intended`."""
+    token = intended_start.set(intended)
+    try:
+        yield
+    finally:
+        intended_start.reset(token)
+
+def paced(count, interval=None):
+    """Iterate `count` times, one iteration due every `interval` seconds.
+
+    Without an interval this is plain `range(count)`. With one, each
+    iteration waits for its slot (or starts at once if it is already late)
+    and runs under `scheduled`, so what it records gets a corrected latency.
+    """
+    if not interval:
+        yield from range(count)
+        return
+    start = time.time()
+    for i in range(count):
+        intended = start + i * interval
+        delay = intended - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        with scheduled(intended):
+            yield i
+
+def reset():
+    """Start this process with an empty recorder (mp.Pool initializer)."""
+    global recorder
+    recorder = Recorder()
+
+def collect():
+    """Hand what this process recorded back (to a parent process) and start over."""
+    return recorder.take()
+
+def merge(other):
+    recorder.merge(other)
+
+def timed(action):
+    """Record every call of the decorated action; a falsy result is an error."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            start_time = time.time()
+            success = False
+            try:
+                success = bool(f(*args, **kwargs))
+                return success
+            finally:
+                record(action, time.time() - start_time, success)
+        return wrapper
+    return decorator
+
+def report(path):
+    """Print the summary table and write the machine-readable results to `path`."""
+    if not recorder.actions:
+        return
+    print(recorder.summary())
+    with open(path, 'w') as f:
+        json.dump(recorder.to_dict(), f, indent=2)
+    logging.info(f"Latency summary written to {path}")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+import os
+import tempfile
+import unittest
+from analyze import mann_whitney
+from matrix import Server, load_matrix
+from soak import Sampler
+import stats
+from stats import Histogram, SUB_BUCKET_BITS
+
+
+class HistogramCase(unittest.TestCase):
+    def test_buckets(self):
+        # below 2**SUB_BUCKET_BITS microseconds every value has its own bucket
+        for value in range(1 << SUB_BUCKET_BITS):
+            self.assertEqual(Histogram.bucket_index(value), value)
+            self.assertEqual(Histogram.bucket_value(value), value)
+        # then each power of two is split in 128 buckets, 256 and 257 share one
+        self.assertEqual(Histogram.bucket_index(256), Histogram.bucket_index(257))
+        self.assertNotEqual(Histogram.bucket_index(257), Histogram.bucket_index(258))
+        self.assertEqual(Histogram.bucket_value(Histogram.bucket_index(256)), 256.5)
+        self.assertEqual(Histogram.bucket_index(511) + 1, Histogram.bucket_index(512))
+        # and every value comes back to within 1%
+        for value in range(1, 10 ** 8, 9973):
+            bucket = Histogram.bucket_value(Histogram.bucket_index(value))
+            self.assertLessEqual(abs(bucket - value) / value, 0.01)
+
+    def test_percentiles(self):
+        h = Histogram()
+        self.assertEqual(h.percentile(50), 0.0)
+        for ms in range(1, 101):
+            h.record(ms / 1e3)
+        self.assertEqual(h.total, 100)
+        for percent, expected in ((50, 0.050), (90, 0.090), (99, 0.099), (100, 0.100)):
+            self.assertAlmostEqual(h.percentile(percent), expected, delta=expected / 100)
+        self.assertEqual(h.percentile(100), h.max)
+        self.assertEqual(h.percentile(0), h.min)
+        self.assertAlmostEqual(h.mean, 0.0505, delta=0.0505 / 100)
+
+        other = Histogram()
+        other.record(0.0001, count=100)
+        h.merge(other)
+        self.assertEqual(h.total, 200)
+        self.assertEqual(h.percentile(50), 0.0001)
+
+
+class MannWhitneyCase(unittest.TestCase):
+    def test_p_values(self):
+        # U = 0, the samples do not overlap
+        self.assertAlmostEqual(mann_whitney([1, 2, 3], [4, 5, 6]), 0.049535, places=6)
+        self.assertAlmostEqual(mann_whitney([4, 5, 6], [1, 2, 3]), 0.049535, places=6)
+        # U = 6 of 16, interleaved
+        self.assertAlmostEqual(mann_whitney([.1, .3, .5, .7], [.2, .4, .6, .8]), 0.563703,
+                               places=6)
+        # U = 3 of 20, with ties
+        self.assertAlmostEqual(mann_whitney([1, 2, 2, 3], [2, 3, 3, 4, 5]), 0.075927, places=6)
+
+    def test_degenerate(self):
+        self.assertEqual(mann_whitney([], [1, 2]), 1.0)
+        self.assertEqual(mann_whitney([1, 2, 3], [3, 2, 1]), 1.0)
+        # all ties, no variance
+        self.assertEqual(mann_whitney([5, 5], [5, 5]), 1.0)
+
+
+class SoakCase(unittest.TestCase):
+    def test_sampler_leaves_the_run_alone(self):
+        stats.reset()
+        sampler = Sampler(os.getpid(), interval=60)
+        sampler.start()
+        stats.record('post', 0.01)
+        sampler.stop()
+        # the sample saw the action, and so does the run's recorder
+        self.assertEqual(sum(window['requests'] for window in sampler.windows), 1)
+        self.assertEqual(stats.collect().actions['post'].count, 1)
+        self.assertEqual(stats.taps, [])
+
+
+class MatrixCase(unittest.TestCase):
+    def test_backends(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'matrix.toml')
+            with open(path, 'w') as f:
+                f.write('scenario = "s.toml"\n[matrix]\ntimeline = ["table", "merge"]\n'
+                        'recent_posts_cache = ["default", "RedisCache"]\n')
+            _, configs = load_matrix(path)
+        # only the merge backend uses the recent posts cache
+        self.assertEqual([(c.timeline, c.recent_posts_cache) for c in configs],
+                         [('table', 'default'), ('merge', 'default'), ('merge', 'RedisCache')])
+
+        # both are set whatever the shell exports
+        os.environ['TIMELINE_BACKEND'] = 'query'
+        os.environ['RECENT_POSTS_CACHE_TYPE'] = 'SimpleCache'
+        try:
+            server = Server(configs[0], 'sqlite://', os.devnull)
+            server.log.close()
+        finally:
+            del os.environ['TIMELINE_BACKEND'], os.environ['RECENT_POSTS_CACHE_TYPE']
+        self.assertEqual(server.env['TIMELINE_BACKEND'], 'table')
+        self.assertEqual(server.env['RECENT_POSTS_CACHE_TYPE'], '')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,140 @@
+"""Record the requests a run sends, as a trace that can be replayed later.
+
+A trace is gzipped JSON lines, one request per line, in the order they were
+sent:
+
+    {"t": 1.204, "user": "aZ3kq9", "method": "POST", "path": "/index",
+     "data": {"csrf_token": "", "post": "hello", "submit": "Submit"}}
+
+`t` is seconds from the first request and `user` the virtual user that sent
+it, so `loadgen.replay` can keep every user's requests in their original
+order while it scales the gaps between them. CSRF tokens are only valid
+for the session that got them; they are blanked here and filled in again
+from the page the replaying session fetched last.
+
+Only the HTTP drivers (http_engine and loadgen) are recorded; a browser's
+requests go through Chrome. A gunicorn access log (`--access-logfile -`
+in microblog/boot.sh) can be turned into a trace too, see
+`import_access_log`.
+"""
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import count
+from urllib.parse import urlsplit
+import contextvars
+import gzip
+import json
+import re
+import threading
+import time
+
+# gunicorn's default access_log_format:
+# %(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"
+ACCESS_LOG_LINE = re.compile(
+    r'(?P<host>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<path>\S+) [^"]*" '
+    r'(?P<status>\d{3}) \S+ "[^"]*" "(?P<agent>[^"]*)"')
+ACCESS_LOG_TIME = '%d/%b/%Y:%H:%M:%S %z'
+
+# The virtual user the requests sent in this context belong to
+user = contextvars.ContextVar('trace_user', default=None)
+
+recording = False
+_events = []
+_lock = threading.Lock()
+_session_ids = count(1)
+
+@contextmanager
+def acting_as(username):
+    """Attribute the requests sent inside the block to `username`."""
+    token = user.set(username)
+    try:
+        yield
+    finally:
+        user.reset(token)
+
+def start():
+    """Start recording every request the HTTP drivers of this process send."""
+    global recording
+    recording = True
+
+def reset(enabled=False):
+    """Start this process over with no events (mp.Pool initializer)."""
+    global recording
+    recording = enabled
+    del _events[:]
+
+def record(driver, request):
+    if not recording:
+        return
+    username = user.get()
+    if username is None:
+        # nobody to attribute it to: the driver's session is the user
+        if not hasattr(driver, 'trace_session'):
+            driver.trace_session = f'session-{next(_session_ids)}'
+        username = driver.trace_session
+    data = request.data
+    if data:
+        data = {name: '' if name == 'csrf_token' else value for name, value in data.items()}
+    with _lock:
+        _events.append({'t': time.time(), 'user': username, 'method': request.method,
+                        'path': request.path, 'data': data})
+
+def collect():
+    """Hand this process' events back (to a parent process) and start over."""
+    with _lock:
+        collected = _events[:]
+        del _events[:]
+    return collected
+
+def merge(events):
+    with _lock:
+        _events.extend(events)
+
+def save(path, events=None):
+    """Write `events` (by default what was recorded) to `path`; returns how many."""
+    events = sorted(_events if events is None else events, key=lambda e: e['t'])
+    start_time = events[0]['t'] if events else 0.0
+    with gzip.open(path, 'wt') as f:
+        for event in events:
+            f.write(json.dumps({**event, 't': round(event['t'] - start_time, 6)},
+                               separators=(',', ':')) + '\n')
+    return len(events)
+
+def load(path):
+    """The events of the trace at `path`; raises ValueError on a malformed line."""
+    events = []
+    with gzip.open(path, 'rt') as f:
+        for number, line in enumerate(f, 1):
+            try:
+                event = json.loads(line)
+                events.append({'t': float(event['t']), 'user': event['user'],
+                               'method': event['method'], 'path': event['path'],
+                               'data': event.get('data')})
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"{path}:{number}: not a trace event ({e})")
+    return events
+
+def import_access_log(path):
+    """Turn a gunicorn access log into trace events.
+
+    Lines that are not access log lines (the error log shares stdout in
+    boot.sh) are skipped. A client is its address and user agent, which is
+    as close to a user as the log gets. Access logs carry no form fields,
+    so POSTs replay with an empty form: the server still does the routing,
+    session and validation work, but nothing gets written.
+    """
+    events = []
+    with open(path, errors='replace') as f:
+        for line in f:
+            match = ACCESS_LOG_LINE.search(line)
+            if match is None:
+                continue
+            sent = datetime.strptime(match['time'], ACCESS_LOG_TIME).timestamp()
+            events.append({'t': sent, 'user': f"{match['host']} {match['agent']}",
+                           'method': match['method'], 'path': match['path'], 'data': None})
+    return events
+
+def endpoint(method, path):
+    """What replayed requests are reported under: the method and first path segment."""
+    segment = urlsplit(path).path.strip('/').split('/')[0]
+    return f'{method} /{segment}'
@@ -16,6 +16,7 @@ from elasticsearch import Elasticsearch
 from redis import Redis
 import rq
 from config import Config
+from app import querystats
 
 # Initialize extensions
 db = SQLAlchemy()
@@ -27,6 +28,10 @@ mail = Mail()
 moment = Moment()
 babel = Babel()
 cache = Cache() # Cache
+# the per-author recent post lists of app/timeline.py
+recent_posts_cache = Cache()
+# cache types that live in one process
+IN_PROCESS_CACHES = ('SimpleCache', 'simple')
 socketio = SocketIO()
 
 def get_locale():
@@ -36,11 +41,26 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
-    cache.init_app(app, config={'CACHE_TYPE': 'simple'})  # Initialize cache here
+    cache.init_app(app, config={'CACHE_TYPE': app.config['CACHE_TYPE']})  # Initialize cache here
+    merge = app.config['TIMELINE_BACKEND'] == 'merge'
+    recent_posts_type = app.config['RECENT_POSTS_CACHE_TYPE'] or \
+        ('RedisCache' if merge else 'SimpleCache')
+    if merge and not (app.testing or app.debug) \
+            and recent_posts_type.rsplit('.', 1)[-1] in IN_PROCESS_CACHES:
+        raise RuntimeError('The merge timeline backend needs a RECENT_POSTS_CACHE_TYPE '
+                           f'shared by all workers, not {recent_posts_type}')
+    recent_posts_cache.init_app(app, config={
+        'CACHE_TYPE': recent_posts_type,
+        # clear() only drops these keys from a Redis shared with the task queue
+        'CACHE_KEY_PREFIX': 'recent_posts_',
+        'CACHE_THRESHOLD': app.config['RECENT_POSTS_CACHE_AUTHORS'],
+        'CACHE_REDIS_URL': app.config['REDIS_URL'],
+        'CACHE_DIR': app.config['RECENT_POSTS_CACHE_DIR']})
     Compress(app)
     minify(app=app, html=True, js=True, cssless=True)
 
     db.init_app(app)
+    querystats.init_app(app)
     socketio.init_app(app)
     migrate.init_app(app, db)
     login.init_app(app)
@@ -30,31 +30,34 @@ def get_user(id):
 @bp.route('/users', methods=['GET'])
 @token_auth.login_required
 def get_users():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = min(request.args.get('per_page', 10, type=int), 100)
-    logger.info(f'Fetching users: page {page}, per_page {per_page}')
-    return User.to_collection_dict(sa.select(User), page, per_page,
-                                   'api.get_users')
+    total = bool(request.args.get('total', 0, type=int))
+    logger.info(f'Fetching users: cursor {cursor}, per_page {per_page}')
+    return User.to_collection_dict(sa.select(User), cursor, per_page,
+                                   'api.get_users', total=total)
 
 @bp.route('/users/<int:id>/followers', methods=['GET'])
 @token_auth.login_required
 def get_followers(id):
     logger.info(f'Fetching followers for user ID: {id}')
     user = db.get_or_404(User, id)
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = min(request.args.get('per_page', 10, type=int), 100)
-    return User.to_collection_dict(user.followers.select(), page, per_page,
-                                   'api.get_followers', id=id)
+    total = bool(request.args.get('total', 0, type=int))
+    return User.to_collection_dict(user.followers.select(), cursor, per_page,
+                                   'api.get_followers', total=total, id=id)
 
 @bp.route('/users/<int:id>/following', methods=['GET'])
 @token_auth.login_required
 def get_following(id):
     logger.info(f'Fetching following for user ID: {id}')
     user = db.get_or_404(User, id)
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = min(request.args.get('per_page', 10, type=int), 100)
-    return User.to_collection_dict(user.following.select(), page, per_page,
-                                   'api.get_following', id=id)
+    total = bool(request.args.get('total', 0, type=int))
+    return User.to_collection_dict(user.following.select(), cursor, per_page,
+                                   'api.get_following', total=total, id=id)
 
 @bp.route('/users', methods=['POST'])
 def create_user():
@@ -1,7 +1,18 @@
 import os
+import re
+import random
 import logging
-from flask import Blueprint
+import sqlite3
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+from itertools import accumulate
+import sqlalchemy as sa
+from flask import Blueprint, current_app
+from werkzeug.security import generate_password_hash
 import click
+import requests
+from app import db, recent_posts_cache
+from app.models import User, Post, Message, followers, timeline
 
 
 logging.basicConfig(
@@ -70,3 +81,430 @@ def compile():
         raise RuntimeError('compile command failed')
     logger.info('Compile command succeeded.')
 
+
+
+# Relative share of activity per hour of day (UTC), busiest in the evening
+HOURLY_ACTIVITY = [2, 1, 1, 1, 1, 2, 3, 5, 6, 6, 6, 7,
+                   8, 7, 6, 6, 7, 8, 9, 10, 10, 9, 6, 4]
+HOURLY_CUM_WEIGHTS = list(accumulate(HOURLY_ACTIVITY))
+WORDS = ('hello', 'world', 'post', 'today', 'the', 'new', 'microblog', 'flask',
+         'python', 'coffee', 'weekend', 'music', 'test', 'message', 'great',
+         'just', 'finished', 'reading', 'about', 'my', 'first', 'day', 'back')
+
+
+def power_law_counts(rng, n, mean, alpha, cap=None):
+    """`n` counts following a Pareto(`alpha`) shape that average `mean`."""
+    weights = [rng.paretovariate(alpha) for _ in range(n)]
+    scale = mean * n / sum(weights) if weights else 0
+    return [min(round(w * scale), cap) if cap is not None else round(w * scale)
+            for w in weights]
+
+
+def random_timestamp(rng, end, days):
+    """A time in the `days` days before `end`, following HOURLY_ACTIVITY."""
+    hour = rng.choices(range(24), cum_weights=HOURLY_CUM_WEIGHTS)[0]
+    return end - timedelta(days=rng.randrange(1, days + 1), hours=-hour,
+                           seconds=-rng.uniform(0, 3600))
+
+
+def random_body(rng):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(3, 15)))[:140]
+
+
+def execute_chunks(statement, rows, batch_size):
+    """Execute `statement` for `rows` (an iterable of dicts), `batch_size`
+    at a time; returns how many rows there were."""
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            db.session.execute(statement, batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(statement, batch)
+        total += len(batch)
+    return total
+
+
+def insert_chunks(table, rows, batch_size):
+    """Insert `rows` (an iterable of dicts) `batch_size` at a time.
+
+    `table` is a Core table rather than a model, which skips the ORM's
+    bulk-insert bookkeeping.
+    """
+    return execute_chunks(sa.insert(table), rows, batch_size)
+
+
+def seed_database(users, posts=20, follows=50, messages=5, days=365,
+                  seed=None, password='password', prefix='user',
+                  batch_size=10000):
+    """Bulk insert a synthetic community; returns the row counts added.
+
+    Posting activity and popularity are Pareto distributed, so a few users
+    write most of the posts and collect most of the followers, and
+    everyone is followed preferentially by popularity. Every user gets the
+    same password, hashed once. The counters are written along with the
+    rows, the bulk inserts go around the ORM events that keep them.
+    """
+    rng = random.Random(seed)
+    # up to last midnight, so a seed gives the same data all day
+    end = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0,
+                                             microsecond=0)
+    password_hash = generate_password_hash(password)
+    post_counts = power_law_counts(rng, users, posts, alpha=1.5)
+    # who gets followed is drawn by popularity, how many each user
+    # follows by their own activity
+    popularity = list(accumulate(rng.paretovariate(1.2) for _ in range(users)))
+    follow_counts = power_law_counts(rng, users, follows, alpha=1.5,
+                                     cap=users - 1)
+
+    user_ids = []
+    for start in range(0, users, batch_size):
+        rows = [{
+            'username': f'{prefix}{i}',
+            'email': f'{prefix}{i}@example.com',
+            'password_hash': password_hash,
+            'about_me': random_body(rng),
+            'last_seen': random_timestamp(rng, end, days),
+            'posts_total': post_counts[i],
+            'following_total': follow_counts[i],
+        } for i in range(start, min(start + batch_size, users))]
+        user_ids += db.session.scalars(
+            sa.insert(User).returning(User.id, sort_by_parameter_order=True),
+            rows).all()
+    logger.info(f'Seeded {len(user_ids)} users.')
+
+    post_total = insert_chunks(Post.__table__, ({
+        'body': random_body(rng),
+        'timestamp': random_timestamp(rng, end, days),
+        'user_id': user_id,
+        'language': 'en',
+    } for user_id, count in zip(user_ids, post_counts)
+        for _ in range(count)), batch_size)
+    logger.info(f'Seeded {post_total} posts.')
+
+    follower_counts = Counter()
+
+    def follow_rows():
+        for follower, count in zip(user_ids, follow_counts):
+            followed = set()
+            while len(followed) < count:
+                followed.update(rng.choices(user_ids, cum_weights=popularity,
+                                            k=count - len(followed)))
+                followed.discard(follower)
+            follower_counts.update(followed)
+            for followed_id in followed:
+                yield {'follower_id': follower, 'followed_id': followed_id}
+
+    follow_total = insert_chunks(followers, follow_rows(), batch_size)
+    # known only once everyone has followed, by primary key per user
+    user = User.__table__
+    set_followers = sa.update(user).where(
+        user.c.id == sa.bindparam('b_id')).values(
+        followers_total=sa.bindparam('b_total'))
+    execute_chunks(set_followers, ({'b_id': user_id, 'b_total': total}
+                                   for user_id, total in follower_counts.items()),
+                   batch_size)
+    logger.info(f'Seeded {follow_total} follows.')
+
+    message_counts = power_law_counts(rng, users, messages, alpha=1.5)
+    message_total = insert_chunks(Message.__table__, ({
+        'sender_id': sender,
+        'recipient_id': rng.choices(user_ids, cum_weights=popularity)[0],
+        'body': random_body(rng),
+        'timestamp': random_timestamp(rng, end, days),
+    } for sender, count in zip(user_ids, message_counts)
+        for _ in range(count)), batch_size)
+    logger.info(f'Seeded {message_total} messages.')
+
+    db.session.commit()
+    return {'users': len(user_ids), 'posts': post_total,
+            'follows': follow_total, 'messages': message_total}
+
+
+@bp.cli.command()
+@click.option('--users', default=1000, show_default=True,
+              help='Number of users to create.')
+@click.option('--posts', default=20, show_default=True,
+              help='Average posts per user.')
+@click.option('--follows', default=50, show_default=True,
+              help='Average number of users each user follows.')
+@click.option('--messages', default=5, show_default=True,
+              help='Average private messages sent per user.')
+@click.option('--days', default=365, show_default=True,
+              help='Spread timestamps over this many days.')
+@click.option('--seed', type=int, default=None,
+              help='Random seed, for a reproducible dataset.')
+@click.option('--password', default='password', show_default=True,
+              help='Password of every seeded user.')
+@click.option('--prefix', default='user', show_default=True,
+              help='Usernames are the prefix followed by a number.')
+@click.option('--batch-size', default=10000, show_default=True,
+              help='Rows per INSERT statement.')
+def seed(users, posts, follows, messages, days, seed, password, prefix,
+         batch_size):
+    """Bulk insert a synthetic dataset for benchmarks."""
+    existing = db.session.scalar(sa.select(User.id).where(
+        User.username == f'{prefix}0'))
+    if existing is not None:
+        raise click.ClickException(
+            f"users named '{prefix}N' already exist, pick another --prefix")
+    logger.info(f'Seeding {users} users (seed {seed}).')
+    counts = seed_database(users, posts=posts, follows=follows,
+                           messages=messages, days=days, seed=seed,
+                           password=password, prefix=prefix,
+                           batch_size=batch_size)
+    click.echo(', '.join(f'{n} {name}' for name, n in counts.items()))
+
+
+def repair_counters(user_ids=None):
+    """Recount the counters of every user, or of those in `user_ids`, from
+    the tables; returns how many were off."""
+    user = User.__table__
+
+    def count(column):
+        # one pass over the table for every user, not one lookup per user
+        query = sa.select(column.label('user_id'), sa.func.count().label('n'))
+        if user_ids is not None:
+            query = query.where(column.in_(user_ids))
+        return query.group_by(column).subquery()
+
+    totals = {
+        'followers_total': count(followers.c.followed_id),
+        'following_total': count(followers.c.follower_id),
+        'posts_total': count(Post.__table__.c.user_id),
+    }
+    # every user's counts, zero for the users absent from a table
+    query = sa.select(user.c.id, *(
+        sa.func.coalesce(total.c.n, 0).label(name)
+        for name, total in totals.items()))
+    if user_ids is not None:
+        query = query.where(user.c.id.in_(user_ids))
+    for total in totals.values():
+        query = query.outerjoin(total, total.c.user_id == user.c.id)
+    actual = query.subquery()
+    drifted = db.session.execute(sa.update(user).where(
+        user.c.id == actual.c.id,
+        sa.or_(*(user.c[name] != actual.c[name] for name in totals))
+    ).values({name: actual.c[name] for name in totals})).rowcount
+    db.session.commit()
+    return drifted
+
+
+@bp.cli.command('repair-counters')
+def repair_counters_command():
+    """Recount the follower, following and post counters of every user."""
+    drifted = repair_counters()
+    click.echo(f'{drifted} users had counters out of step' if drifted
+               else 'All counters are right')
+
+
+def rebuild_timelines(username=None):
+    """Rebuild the timeline of `username`, or of every user; returns how
+    many rows were written."""
+    user = User.__table__
+    post = Post.__table__
+    users = sa.select(user.c.id)
+    if username is not None:
+        users = users.where(user.c.username == username)
+    user_ids = users.scalar_subquery()
+    db.session.execute(timeline.delete().where(timeline.c.user_id.in_(user_ids)))
+    own = sa.select(post.c.user_id, post.c.id, post.c.user_id,
+                    post.c.timestamp).where(post.c.user_id.in_(user_ids))
+    followed = sa.select(followers.c.follower_id, post.c.id, post.c.user_id,
+                         post.c.timestamp).join(
+        post, post.c.user_id == followers.c.followed_id).where(
+        followers.c.follower_id.in_(user_ids),
+        followers.c.follower_id != followers.c.followed_id)
+    written = db.session.execute(sa.insert(timeline).from_select(
+        ['user_id', 'post_id', 'author_id', 'timestamp'],
+        sa.union_all(own, followed))).rowcount
+    db.session.execute(sa.update(user).where(user.c.id.in_(user_ids)).values(
+        timeline_ready=True))
+    db.session.commit()
+    return written
+
+
+@bp.cli.group('timeline')
+def timeline_commands():
+    """Materialized home timeline commands."""
+    pass
+
+
+@timeline_commands.command('rebuild')
+@click.option('--user', 'username', help='Rebuild just this user.')
+def rebuild_timelines_command(username):
+    """Rebuild the home timelines from the posts and follows."""
+    if username is not None and db.session.scalar(
+            sa.select(User.id).where(User.username == username)) is None:
+        raise click.ClickException(f'no user named {username}')
+    click.echo(f'{rebuild_timelines(username)} timeline rows written')
+
+
+@timeline_commands.command('clear')
+def clear_timelines_command():
+    """Drop every home timeline; each is rebuilt at its user's next login."""
+    db.session.execute(timeline.delete())
+    db.session.execute(sa.update(User).values(timeline_ready=False))
+    db.session.commit()
+    click.echo('Timelines cleared')
+
+
+def snapshot_name(name):
+    if not re.fullmatch(r'\w+', name):
+        raise click.ClickException(
+            'snapshot names are letters, digits and underscores')
+    return name
+
+
+def postgres_template(name):
+    return f'{db.engine.url.database}_snapshot_{name}'
+
+
+def postgres_admin():
+    """An autocommit engine on the maintenance database of the server."""
+    url = db.engine.url.set(database='postgres')
+    return sa.create_engine(url, isolation_level='AUTOCOMMIT')
+
+
+def terminate_connections(conn, database):
+    # CREATE/DROP DATABASE refuse to run while anyone else is connected
+    conn.execute(sa.text(
+        'SELECT pg_terminate_backend(pid) FROM pg_stat_activity '
+        'WHERE datname = :database AND pid <> pg_backend_pid()'),
+        {'database': database})
+
+
+def save_snapshot(name):
+    """Capture the current database as snapshot `name`."""
+    db.session.remove()
+    if db.engine.url.get_backend_name() == 'sqlite':
+        os.makedirs(current_app.config['SNAPSHOT_DIR'], exist_ok=True)
+        path = os.path.join(current_app.config['SNAPSHOT_DIR'], f'{name}.db')
+        source = db.engine.raw_connection()
+        target = sqlite3.connect(path)
+        try:
+            source.driver_connection.backup(target)
+        finally:
+            target.close()
+            source.close()
+        return path
+    database = db.engine.url.database
+    template = postgres_template(name)
+    db.engine.dispose()
+    with postgres_admin().connect() as conn:
+        terminate_connections(conn, database)
+        conn.execute(sa.text(f'DROP DATABASE IF EXISTS "{template}"'))
+        conn.execute(sa.text(
+            f'CREATE DATABASE "{template}" TEMPLATE "{database}"'))
+    return template
+
+
+def restore_database(name):
+    """Replace the current database with snapshot `name`."""
+    db.session.remove()
+    if db.engine.url.get_backend_name() == 'sqlite':
+        path = os.path.join(current_app.config['SNAPSHOT_DIR'], f'{name}.db')
+        if not os.path.exists(path):
+            raise click.ClickException(f'no snapshot named {name}')
+        # the backup API copies pages into the live database, so a
+        # running server sees the restored data without reconnecting
+        source = sqlite3.connect(path)
+        target = db.engine.raw_connection()
+        try:
+            source.backup(target.driver_connection)
+        finally:
+            target.close()
+            source.close()
+        return path
+    database = db.engine.url.database
+    template = postgres_template(name)
+    db.engine.dispose()
+    with postgres_admin().connect() as conn:
+        if conn.scalar(sa.text('SELECT 1 FROM pg_database WHERE datname = :name'),
+                       {'name': template}) is None:
+            raise click.ClickException(f'no snapshot named {name}')
+        terminate_connections(conn, database)
+        conn.execute(sa.text(f'DROP DATABASE "{database}"'))
+        conn.execute(sa.text(
+            f'CREATE DATABASE "{database}" TEMPLATE "{template}"'))
+    return template
+
+
+def restore_snapshot(name):
+    """Restore snapshot `name` and drop the recent post lists cached from
+    the database it replaced."""
+    restored = restore_database(name)
+    recent_posts_cache.clear()
+    return restored
+
+
+@bp.cli.group()
+def snapshot():
+    """Benchmark database snapshot commands."""
+    pass
+
+
+@snapshot.command()
+@click.argument('name')
+def save(name):
+    """Save the database as a named snapshot."""
+    logger.info(f'Saving snapshot: {name}')
+    click.echo(f'Saved {save_snapshot(snapshot_name(name))}')
+
+
+@snapshot.command()
+@click.argument('name')
+def restore(name):
+    """Restore the database from a named snapshot."""
+    logger.info(f'Restoring snapshot: {name}')
+    click.echo(f'Restored {restore_snapshot(snapshot_name(name))}')
+
+
+@snapshot.command('list')
+def list_snapshots():
+    """List the saved snapshots."""
+    if db.engine.url.get_backend_name() == 'sqlite':
+        directory = current_app.config['SNAPSHOT_DIR']
+        names = sorted(f[:-3] for f in os.listdir(directory)
+                       if f.endswith('.db')) if os.path.isdir(directory) else []
+    else:
+        prefix = postgres_template('')
+        with postgres_admin().connect() as conn:
+            names = sorted(row[0][len(prefix):] for row in conn.execute(
+                sa.text('SELECT datname FROM pg_database')) if row[0].startswith(prefix))
+    for name in names:
+        click.echo(name)
+
+
+# static/vendor file -> where base.html loads it from without LOCAL_ASSETS
+ASSETS = {
+    'bootstrap.min.css':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css',
+    'bootstrap.bundle.min.js':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js',
+    'moment-with-locales.min.js':
+        'https://cdnjs.cloudflare.com/ajax/libs/moment.js/2.29.4/moment-with-locales.min.js',
+}
+
+
+@bp.cli.group()
+def assets():
+    """Local copies of the CDN assets, served with LOCAL_ASSETS."""
+    pass
+
+
+@assets.command()
+def fetch():
+    """Download the CDN assets into static/vendor."""
+    directory = os.path.join(current_app.static_folder, 'vendor')
+    os.makedirs(directory, exist_ok=True)
+    for filename, url in ASSETS.items():
+        response = requests.get(url, timeout=30)
+        if response.status_code != 200:
+            raise click.ClickException(f'{url}: HTTP {response.status_code}')
+        with open(os.path.join(directory, filename), 'wb') as f:
+            f.write(response.content)
+        click.echo(f'{filename}: {len(response.content)} bytes')
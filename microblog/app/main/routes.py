@@ -5,12 +5,15 @@ from flask_login import current_user, login_required
 from flask_caching import Cache
 from flask_babel import _, get_locale
 import sqlalchemy as sa
+import sqlalchemy.orm as so
 from langdetect import detect, LangDetectException
 from app import db
 from app.main.forms import EditProfileForm, EmptyForm, PostForm, SearchForm, \
     MessageForm
 from app.models import User, Post, Message, Notification
 from app.translate import translate
+from app.pagination import paginate
+from app.timeline import home_page
 from app.main import bp
 from app import cache
 from app import socketio
@@ -46,40 +49,37 @@ def index():
         flash(_('Your post is now live!'))
         return redirect(url_for('main.index'))
     
-    # Cache Stuff
+    # Cache Stuff, first page only: the key has no cursor in it
+    cursor = request.args.get('cursor')
     cache_key = f'index_view_{current_user.id}'
-    cached_response = cache.get(cache_key)
+    cached_response = cache.get(cache_key) if cursor is None else None
     if cached_response is not None:
         return cached_response
     
-    page = request.args.get('page', 1, type=int)
-    posts = db.paginate(current_user.following_posts(), page=page,
-                        per_page=current_app.config['POSTS_PER_PAGE'],
-                        error_out=False)
-    next_url = url_for('main.index', page=posts.next_num) \
+    posts = home_page(current_user, cursor,
+                      current_app.config['POSTS_PER_PAGE'])
+    next_url = url_for('main.index', cursor=posts.next_cursor) \
         if posts.has_next else None
-    prev_url = url_for('main.index', page=posts.prev_num) \
+    prev_url = url_for('main.index', cursor=posts.prev_cursor) \
         if posts.has_prev else None
     
     response = render_template('index.html', title=_('Home'), form=form, posts=posts.items, next_url=next_url, prev_url=prev_url)
-    cache.set(cache_key, response, timeout=60)
+    if cursor is None:
+        cache.set(cache_key, response, timeout=60)
 
-    return render_template('index.html', title=_('Home'), form=form,
-                           posts=posts.items, next_url=next_url,
-                           prev_url=prev_url)
+    return response
 
 
 @bp.route('/explore')
 @login_required
 def explore():
-    page = request.args.get('page', 1, type=int)
-    query = sa.select(Post).order_by(Post.timestamp.desc())
-    posts = db.paginate(query, page=page,
-                        per_page=current_app.config['POSTS_PER_PAGE'],
-                        error_out=False)
-    next_url = url_for('main.explore', page=posts.next_num) \
+    posts = paginate(sa.select(Post).options(so.selectinload(Post.author)),
+                     (Post.timestamp, Post.id),
+                     request.args.get('cursor'),
+                     current_app.config['POSTS_PER_PAGE'])
+    next_url = url_for('main.explore', cursor=posts.next_cursor) \
         if posts.has_next else None
-    prev_url = url_for('main.explore', page=posts.prev_num) \
+    prev_url = url_for('main.explore', cursor=posts.prev_cursor) \
         if posts.has_prev else None
     return render_template('index.html', title=_('Explore'),
                            posts=posts.items, next_url=next_url,
@@ -90,15 +90,13 @@ def explore():
 @login_required
 def user(username):
     user = db.first_or_404(sa.select(User).where(User.username == username))
-    page = request.args.get('page', 1, type=int)
-    query = user.posts.select().order_by(Post.timestamp.desc())
-    posts = db.paginate(query, page=page,
-                        per_page=current_app.config['POSTS_PER_PAGE'],
-                        error_out=False)
+    posts = paginate(user.posts.select(), (Post.timestamp, Post.id),
+                     request.args.get('cursor'),
+                     current_app.config['POSTS_PER_PAGE'])
     next_url = url_for('main.user', username=user.username,
-                       page=posts.next_num) if posts.has_next else None
+                       cursor=posts.next_cursor) if posts.has_next else None
     prev_url = url_for('main.user', username=user.username,
-                       page=posts.prev_num) if posts.has_prev else None
+                       cursor=posts.prev_cursor) if posts.has_prev else None
     form = EmptyForm()
     return render_template('user.html', user=user, posts=posts.items,
                            next_url=next_url, prev_url=prev_url, form=form)
@@ -219,15 +217,13 @@ def messages():
     current_user.last_message_read_time = datetime.now(timezone.utc)
     current_user.add_notification('unread_message_count', 0)
     db.session.commit()
-    page = request.args.get('page', 1, type=int)
-    query = current_user.messages_received.select().order_by(
-        Message.timestamp.desc())
-    messages = db.paginate(query, page=page,
-                           per_page=current_app.config['POSTS_PER_PAGE'],
-                           error_out=False)
-    next_url = url_for('main.messages', page=messages.next_num) \
+    messages = paginate(current_user.messages_received.select(),
+                        (Message.timestamp, Message.id),
+                        request.args.get('cursor'),
+                        current_app.config['POSTS_PER_PAGE'])
+    next_url = url_for('main.messages', cursor=messages.next_cursor) \
         if messages.has_next else None
-    prev_url = url_for('main.messages', page=messages.prev_num) \
+    prev_url = url_for('main.messages', cursor=messages.prev_cursor) \
         if messages.has_prev else None
     return render_template('messages.html', messages=messages.items,
                            next_url=next_url, prev_url=prev_url)
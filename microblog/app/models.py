@@ -14,6 +14,7 @@ import jwt
 import redis
 import rq
 from app import db, login
+from app.pagination import paginate
 from app.search import add_to_index, remove_from_index, query_index
 
 
@@ -36,10 +37,16 @@ class SearchableMixin:
         if total == 0:
             logger.warning('No results found.')
             return [], 0
+        return cls.in_order(ids), total
+
+    @classmethod
+    def in_order(cls, ids, *options):
+        """The rows with these ids, in the order the search index ranked them,
+        loaded with the loader `options`."""
         when = [(ids[i], i) for i in range(len(ids))]
         query = sa.select(cls).where(cls.id.in_(ids)).order_by(
-            db.case(*when, value=cls.id))
-        return db.session.scalars(query), total
+            db.case(*when, value=cls.id)).options(*options)
+        return db.session.scalars(query)
 
     @classmethod
     def before_commit(cls, session):
@@ -78,39 +85,61 @@ class SearchableMixin:
 db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
 db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
 
+# An id no row will have, to build a URL once and substitute ids into it
+URL_ID_PLACEHOLDER = 2**31 - 1
+
+
+def url_template(endpoint, **kwargs):
+    """`url_for(endpoint, id=...)` as a str.format template with an {id} field."""
+    return url_for(endpoint, id=URL_ID_PLACEHOLDER, **kwargs).replace(
+        str(URL_ID_PLACEHOLDER), '{id}')
+
+
 class PaginatedAPIMixin(object):
-    @staticmethod
-    def to_collection_dict(query, page, per_page, endpoint, **kwargs):
-        logger.info(f'Paginating collection for {endpoint}, page {page}, per_page {per_page}.')
-        resources = db.paginate(query, page=page, per_page=per_page,
-                                error_out=False)
+    @classmethod
+    def to_collection_dict(cls, query, cursor, per_page, endpoint, total=False,
+                           **kwargs):
+        logger.info(f'Paginating collection for {endpoint}, cursor {cursor}, per_page {per_page}.')
+        # in id order, a cursor at a time; the total costs a COUNT, so only
+        # when asked for
+        resources = paginate(query, (cls.id,), cursor, per_page,
+                             descending=False, count=total)
+        meta = {'per_page': per_page}
+        if total:
+            meta['total_items'] = resources.total
         data = {
-            'items': [item.to_dict() for item in resources.items],
-            '_meta': {
-                'page': page,
-                'per_page': per_page,
-                'total_pages': resources.pages,
-                'total_items': resources.total
-            },
+            'items': cls.to_dicts(resources.items),
+            '_meta': meta,
             '_links': {
-                'self': url_for(endpoint, page=page, per_page=per_page,
+                'self': url_for(endpoint, cursor=cursor, per_page=per_page,
                                 **kwargs),
-                'next': url_for(endpoint, page=page + 1, per_page=per_page,
-                                **kwargs) if resources.has_next else None,
-                'prev': url_for(endpoint, page=page - 1, per_page=per_page,
-                                **kwargs) if resources.has_prev else None
+                'next': url_for(endpoint, cursor=resources.next_cursor,
+                                per_page=per_page, **kwargs)
+                if resources.has_next else None,
+                'prev': url_for(endpoint, cursor=resources.prev_cursor,
+                                per_page=per_page, **kwargs)
+                if resources.has_prev else None
             }
         }
         logger.debug('Pagination result: %s', data)
         return data
 
+    @staticmethod
+    def to_dicts(items):
+        """The `to_dict` of every item; models override it to share work
+        across a page."""
+        return [item.to_dict() for item in items]
+
 followers = sa.Table(
     'followers',
     db.metadata,
     sa.Column('follower_id', sa.Integer, sa.ForeignKey('user.id'),
               primary_key=True),
     sa.Column('followed_id', sa.Integer, sa.ForeignKey('user.id'),
-              primary_key=True)
+              primary_key=True),
+    # the primary key leads with follower_id; this finds a user's followers
+    # for the fan-out and the counters without scanning the table
+    sa.Index('ix_followers_followed_id', 'followed_id'),
 )
 
 class User(PaginatedAPIMixin, UserMixin, db.Model):
@@ -127,6 +156,19 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     token: so.Mapped[Optional[str]] = so.mapped_column(
         sa.String(32), index=True, unique=True)
     token_expiration: so.Mapped[Optional[datetime]]
+    # kept in step by follow(), unfollow() and the Post insert/delete
+    # events, repaired by `flask repair-counters`
+    followers_total: so.Mapped[int] = so.mapped_column(
+        default=0, server_default='0')
+    following_total: so.Mapped[int] = so.mapped_column(
+        default=0, server_default='0')
+    posts_total: so.Mapped[int] = so.mapped_column(
+        default=0, server_default='0')
+    # whether this user's rows in `timeline` are complete; until they are
+    # built (at login or by `flask timeline rebuild`) the home page falls
+    # back to following_posts()
+    timeline_ready: so.Mapped[bool] = so.mapped_column(
+        default=False, server_default=sa.false())
 
     posts: so.WriteOnlyMapped['Post'] = so.relationship(
         back_populates='author')
@@ -166,11 +208,44 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         logger.info(f'{self.username} is following {user.username}.')
         if not self.is_following(user):
             self.following.add(user)
+            self._count_follow(user, 1)
+            self._timeline_add(user)
 
     def unfollow(self, user):
         logger.info(f'{self.username} is unfollowing {user.username}.')
         if self.is_following(user):
             self.following.remove(user)
+            self._count_follow(user, -1)
+            self._timeline_remove(user)
+
+    def _count_follow(self, user, delta):
+        # UPDATE ... SET n = n + delta, in the same transaction as the
+        # follow, so concurrent follows cannot lose an increment
+        db.session.execute(sa.update(User).where(User.id == self.id).values(
+            following_total=User.following_total + delta))
+        db.session.execute(sa.update(User).where(User.id == user.id).values(
+            followers_total=User.followers_total + delta))
+
+    def _timeline_add(self, user):
+        # backfill the newly followed user's posts
+        if not self.timeline_ready or user.id == self.id:
+            return
+        if current_app.config['TIMELINE_BACKEND'] != 'table':
+            # only the table backend backfills, the timeline now lacks
+            # these posts until it is rebuilt
+            self.timeline_ready = False
+            return
+        db.session.execute(sa.insert(timeline).from_select(
+            ['user_id', 'post_id', 'author_id', 'timestamp'],
+            sa.select(sa.literal(self.id), Post.id, Post.user_id,
+                      Post.timestamp).where(Post.user_id == user.id)))
+
+    def _timeline_remove(self, user):
+        # prune the posts of the user no longer followed
+        if user.id == self.id:
+            return
+        db.session.execute(timeline.delete().where(
+            timeline.c.user_id == self.id, timeline.c.author_id == user.id))
 
     def is_following(self, user):
         logger.debug(f'Checking if {self.username} is following {user.username}.')
@@ -178,16 +253,10 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         return db.session.scalar(query) is not None
 
     def followers_count(self):
-        logger.info(f'Counting followers for user: {self.username}.')
-        query = sa.select(sa.func.count()).select_from(
-            self.followers.select().subquery())
-        return db.session.scalar(query)
+        return self.followers_total
 
     def following_count(self):
-        logger.info(f'Counting following for user: {self.username}.')
-        query = sa.select(sa.func.count()).select_from(
-            self.following.select().subquery())
-        return db.session.scalar(query)
+        return self.following_total
 
     def following_posts(self):
         logger.debug(f'Fetching following posts for user: {self.username}.')
@@ -205,6 +274,43 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
             .order_by(Post.timestamp.desc())
         )
 
+    @property
+    def reads_timeline(self):
+        """Whether the home page reads this user's materialized timeline."""
+        return self.timeline_ready and \
+            current_app.config['TIMELINE_BACKEND'] == 'table'
+
+    def home_posts(self):
+        """The home page query, in the same order as following_posts().
+
+        With the `table` backend and a built timeline this is an index
+        range scan over the user's rows in `timeline`, otherwise it is
+        following_posts().
+        """
+        if not self.reads_timeline:
+            return self.following_posts()
+        return (
+            sa.select(Post)
+            .join(timeline, timeline.c.post_id == Post.id)
+            .where(timeline.c.user_id == self.id)
+            .order_by(timeline.c.timestamp.desc())
+        )
+
+    def rebuild_timeline(self):
+        """Fill this user's timeline from the posts and follows tables."""
+        logger.info(f'Rebuilding the timeline of user: {self.username}.')
+        db.session.execute(timeline.delete().where(
+            timeline.c.user_id == self.id))
+        followed = sa.select(followers.c.followed_id).where(
+            followers.c.follower_id == self.id)
+        db.session.execute(sa.insert(timeline).from_select(
+            ['user_id', 'post_id', 'author_id', 'timestamp'],
+            sa.select(sa.literal(self.id), Post.id, Post.user_id,
+                      Post.timestamp).where(sa.or_(
+                          Post.user_id == self.id,
+                          Post.user_id.in_(followed)))))
+        self.timeline_ready = True
+
     def get_reset_password_token(self, expires_in=600):
         logger.info(f'Generating reset password token for user: {self.username}.')
         return jwt.encode(
@@ -259,32 +365,41 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         return db.session.scalar(query)
 
     def posts_count(self):
-        logger.info(f'Counting posts for user: {self.username}.')
-        query = sa.select(sa.func.count()).select_from(
-            self.posts.select().subquery())
-        return db.session.scalar(query)
+        return self.posts_total
 
     def to_dict(self, include_email=False):
         logger.debug(f'Converting user: {self.username} to dict.')
-        data = {
-            'id': self.id,
-            'username': self.username,
-            'last_seen': self.last_seen.replace(
-                tzinfo=timezone.utc).isoformat(),
-            'about_me': self.about_me,
-            'post_count': self.posts_count(),
-            'follower_count': self.followers_count(),
-            'following_count': self.following_count(),
-            '_links': {
-                'self': url_for('api.get_user', id=self.id),
-                'followers': url_for('api.get_followers', id=self.id),
-                'following': url_for('api.get_following', id=self.id),
-                'avatar': self.avatar(128)
+        return User.to_dicts([self], include_email)[0]
+
+    @staticmethod
+    def to_dicts(users, include_email=False):
+        # the counts are columns and the links are built once for the
+        # whole page, so a page costs no queries or URL lookups per user
+        links = {name: url_template(endpoint) for name, endpoint in (
+            ('self', 'api.get_user'),
+            ('followers', 'api.get_followers'),
+            ('following', 'api.get_following'))}
+        items = []
+        for user in users:
+            data = {
+                'id': user.id,
+                'username': user.username,
+                'last_seen': user.last_seen.replace(
+                    tzinfo=timezone.utc).isoformat(),
+                'about_me': user.about_me,
+                'post_count': user.posts_count(),
+                'follower_count': user.followers_count(),
+                'following_count': user.following_count(),
+                '_links': {
+                    **{name: link.format(id=user.id)
+                       for name, link in links.items()},
+                    'avatar': user.avatar(128)
+                }
             }
-        }
-        if include_email:
-            data['email'] = self.email
-        return data
+            if include_email:
+                data['email'] = user.email
+            items.append(data)
+        return items
 
     def from_dict(self, data, new_user=False):
         logger.debug(f'Updating user: {self.username} from dict.')
@@ -340,11 +455,75 @@ class Post(SearchableMixin, db.Model):
 
     author: so.Mapped[User] = so.relationship(back_populates='posts')
 
+    # a user's posts in keyset order, for their profile page
+    __table_args__ = (
+        sa.Index('ix_post_user_id_timestamp_id', 'user_id', 'timestamp', 'id'),
+    )
+
     def __repr__(self):
         logger.debug(f'Creating string representation for Post: {self.body}.')
         return '<Post {}>'.format(self.body)
 
 
+def count_post(delta):
+    def listener(mapper, connection, post):
+        connection.execute(sa.update(User.__table__).where(
+            User.__table__.c.id == post.user_id).values(
+            posts_total=User.__table__.c.posts_total + delta))
+    return listener
+
+
+db.event.listen(Post, 'after_insert', count_post(1))
+db.event.listen(Post, 'after_delete', count_post(-1))
+
+# The home timelines, materialized: a row per post on each built timeline
+# it belongs to, written when the post is (fan-out on write) and read as
+# one range of the (user_id, timestamp) index
+timeline = sa.Table(
+    'timeline',
+    db.metadata,
+    sa.Column('user_id', sa.Integer, sa.ForeignKey('user.id'),
+              primary_key=True),
+    sa.Column('post_id', sa.Integer, sa.ForeignKey('post.id'),
+              primary_key=True),
+    sa.Column('author_id', sa.Integer, sa.ForeignKey('user.id'),
+              nullable=False),
+    sa.Column('timestamp', sa.DateTime, nullable=False),
+    sa.Index('ix_timeline_user_id_timestamp_post_id', 'user_id', 'timestamp',
+             'post_id'),
+)
+
+
+def fan_out_post(mapper, connection, post):
+    # onto the built timelines of the author and their followers, found
+    # through ix_followers_followed_id
+    user = User.__table__
+    readers = sa.select(followers.c.follower_id).where(
+        followers.c.followed_id == post.user_id)
+    built = (user.c.timeline_ready,
+             sa.or_(user.c.id == post.user_id, user.c.id.in_(readers)))
+    if current_app.config['TIMELINE_BACKEND'] != 'table':
+        # the other backends do not fan out, so these timelines now miss
+        # the post; they are rebuilt at their users' next login with the
+        # table backend instead of being served stale
+        connection.execute(sa.update(user).where(*built).values(
+            timeline_ready=False))
+        return
+    connection.execute(sa.insert(timeline).from_select(
+        ['user_id', 'post_id', 'author_id', 'timestamp'],
+        sa.select(user.c.id, sa.literal(post.id), sa.literal(post.user_id),
+                  sa.literal(post.timestamp, sa.DateTime)).where(*built)))
+
+
+def remove_post(mapper, connection, post):
+    connection.execute(timeline.delete().where(
+        timeline.c.post_id == post.id))
+
+
+db.event.listen(Post, 'after_insert', fan_out_post)
+db.event.listen(Post, 'before_delete', remove_post)
+
+
 class Message(db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     sender_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id),
@@ -362,6 +541,12 @@ class Message(db.Model):
         foreign_keys='Message.recipient_id',
         back_populates='messages_received')
 
+    # a user's inbox in keyset order
+    __table_args__ = (
+        sa.Index('ix_message_recipient_id_timestamp_id', 'recipient_id',
+                 'timestamp', 'id'),
+    )
+
     def __repr__(self):
         logger.debug(f'Creating string representation for Message: {self.body}.')
         return '<Message {}>'.format(self.body)
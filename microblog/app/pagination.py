@@ -0,0 +1,105 @@
+"""Keyset pagination: a page starts after the last row of the one before.
+
+`db.paginate` counts the rows and skips OFFSET of them, so page 1000 reads
+the 25000 rows above it. Here the query is ordered by key columns, e.g.
+(timestamp, id), and the next page is the rows with a key below the last
+one shown, an index range that costs the same at any depth. The position
+travels in an opaque cursor, URL-safe base64 of the key and a direction,
+so pages are linked to, never numbered, and no count is run unless asked.
+
+The last key column has to be unique, otherwise rows sharing a key with
+the end of a page could be skipped.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+import sqlalchemy as sa
+from flask import abort
+from app import db
+
+
+class Page:
+    """One page: its items, the cursors of its neighbours and, when
+    requested, the total row count."""
+    def __init__(self, items, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(key, direction):
+    """The cursor of the page after (`next`) or before (`prev`) `key`."""
+    values = [value.isoformat() if isinstance(value, datetime) else value
+              for value in key]
+    data = json.dumps([direction[0], values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, keys):
+    """(key, direction) from a cursor over `keys`; aborts with 400 when it
+    is not one of ours."""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(data)
+        if direction not in ('n', 'p') or len(values) != len(keys):
+            raise ValueError(cursor)
+        key = tuple(datetime.fromisoformat(value)
+                    if isinstance(column.type, sa.DateTime) else value
+                    for column, value in zip(keys, values))
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        abort(400, 'invalid cursor')
+    return key, 'next' if direction == 'n' else 'prev'
+
+
+def make_page(rows, per_page, key=None, direction='next', total=None):
+    """The Page for `rows`, (item, key) pairs fetched in `direction` from
+    `key`, per_page + 1 of them if there are more."""
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+    if not rows:
+        return Page([], total=total)
+    # going forward the rows just left are the previous page, going
+    # backwards the ones just left are the next one
+    has_next = more if direction == 'next' else True
+    has_prev = key is not None if direction == 'next' else more
+    return Page([item for item, _ in rows],
+                encode_cursor(rows[-1][1], 'next') if has_next else None,
+                encode_cursor(rows[0][1], 'prev') if has_prev else None,
+                total)
+
+
+def paginate(query, keys, cursor=None, per_page=25, descending=True,
+             count=False):
+    """The page of `query` that `cursor` points to, the first without one.
+
+    `keys` are the columns to order by, newest first unless `descending`
+    is false; the query's own ORDER BY is replaced. With `count` the page
+    also has the total, at the cost of a COUNT over the whole query.
+    """
+    query = query.order_by(None)
+    total = db.session.scalar(sa.select(sa.func.count()).select_from(
+        query.subquery())) if count else None
+    key, direction = decode_cursor(cursor, keys) if cursor else (None, 'next')
+    # whether this page is read towards smaller keys; a prev page is read
+    # the other way and turned around
+    down = (direction == 'next') == descending
+    if key is not None:
+        position = sa.tuple_(*keys)
+        query = query.where(position < key if down else position > key)
+    query = query.order_by(*(column.desc() if down else column.asc()
+                             for column in keys))
+    rows = db.session.execute(query.add_columns(*keys).limit(per_page + 1))
+    return make_page([(row[0], tuple(row[1:])) for row in rows], per_page,
+                     key, direction, total)
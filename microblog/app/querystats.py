@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+import sqlalchemy as sa
+from flask import g, has_app_context, request
+
+
+logger = logging.getLogger(__name__)
+
+# Open count_queries() blocks, each gets every statement run while it is
+_collectors = []
+_collectors_lock = threading.Lock()
+
+
+class QueryStats:
+    """The statements run in one request (or one count_queries block)."""
+    def __init__(self):
+        self.statements = []
+
+    def add(self, statement, duration):
+        self.statements.append((statement, duration))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def duration(self):
+        return sum(duration for _, duration in self.statements)
+
+    def __repr__(self):
+        return f'<QueryStats {self.count} queries, {self.duration * 1e3:.1f} ms>'
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    duration = time.perf_counter() - conn.info['query_start'].pop()
+    if has_app_context():
+        stats = g.get('query_stats')
+        if stats is not None:
+            stats.add(statement, duration)
+    with _collectors_lock:
+        for stats in _collectors:
+            stats.add(statement, duration)
+
+
+def handle_error(context):
+    # a statement that raised never reaches after_cursor_execute, drop its
+    # start so the next one on the connection is timed from its own
+    starts = context.connection.info.get('query_start') \
+        if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def listen():
+    """Time every statement of every engine; safe to call more than once."""
+    if not sa.event.contains(sa.engine.Engine, 'before_cursor_execute',
+                             before_cursor_execute):
+        sa.event.listen(sa.engine.Engine, 'before_cursor_execute',
+                        before_cursor_execute)
+        sa.event.listen(sa.engine.Engine, 'after_cursor_execute',
+                        after_cursor_execute)
+        sa.event.listen(sa.engine.Engine, 'handle_error', handle_error)
+
+
+@contextmanager
+def count_queries():
+    """Collect the statements run inside the block, for tests:
+
+        with count_queries() as queries:
+            client.get('/index')
+        assert queries.count <= 10
+    """
+    listen()
+    stats = QueryStats()
+    with _collectors_lock:
+        _collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        with _collectors_lock:
+            _collectors.remove(stats)
+
+
+@contextmanager
+def query_budget(limit):
+    """Fail with an AssertionError listing the statements when the block
+    runs more than `limit` of them."""
+    with count_queries() as stats:
+        yield stats
+    if stats.count > limit:
+        statements = '\n'.join(statement for statement, _ in stats.statements)
+        raise AssertionError(f'{stats.count} queries, over the budget of '
+                             f'{limit}:\n{statements}')
+
+
+def init_app(app):
+    """With QUERY_STATS set, count and time the queries of every request.
+
+    The totals go out in a Server-Timing header, which browser dev tools
+    show next to the request, and to the log.
+    """
+    if not app.config.get('QUERY_STATS'):
+        return
+    listen()
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+
+    @app.after_request
+    def report_query_stats(response):
+        stats = g.get('query_stats')
+        if stats is not None:
+            response.headers.add(
+                'Server-Timing',
+                f'db;dur={stats.duration * 1e3:.2f};desc="{stats.count} queries"')
+            logger.info(f'{request.method} {request.path}: {stats.count} queries '
+                        f'in {stats.duration * 1e3:.2f} ms')
+        return response
@@ -0,0 +1,168 @@
+"""Home pages, and reading them by merging the followed authors' posts.
+
+home_page() reads a page of any TIMELINE_BACKEND. The `merge` one is the
+pull model next to the fan-out `table` backend: nothing is written per
+reader. Each author has a short list of their newest (timestamp, post id)
+pairs in the cache, at most RECENT_POSTS_PER_AUTHOR of them, and a
+reader's page is a k-way merge of the lists of everyone they follow that
+stops as soon as the page is full.
+
+A list holding the full RECENT_POSTS_PER_AUTHOR may have left older posts
+out, so a page reaching past the end of one goes to the database instead.
+The lists have a cache of their own, RECENT_POSTS_CACHE_TYPE, so the page
+cache can be turned off without them. A list is dropped from it when its
+author's posts change, after the commit, and rebuilt on the next read; a
+read missing several lists loads them all in one query. The cache has to
+be shared by the workers (Redis by default) for a post committed in one of
+them to reach the pages the others serve. With the other backends posts
+are written without touching the cache.
+"""
+import heapq
+import logging
+from datetime import datetime, timedelta
+from itertools import islice
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import current_app
+from app import db, recent_posts_cache as cache
+from app.models import Post, followers, timeline
+from app.pagination import decode_cursor, make_page, paginate
+
+
+logger = logging.getLogger(__name__)
+
+
+# Timestamps are kept as whole microseconds since EPOCH, which compare
+# exactly, unlike float seconds
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# How every home page is ordered, and what its cursors hold
+HOME_KEYS = (Post.timestamp, Post.id)
+TIMELINE_KEYS = (timeline.c.timestamp, timeline.c.post_id)
+
+
+def cache_key(author_id):
+    return str(author_id)
+
+
+def to_entry(key):
+    timestamp, post_id = key
+    return (timestamp.replace(tzinfo=None) - EPOCH) // MICROSECOND, post_id
+
+
+def to_key(entry):
+    micros, post_id = entry
+    return EPOCH + micros * MICROSECOND, post_id
+
+
+def load_recent_posts(author_ids, limit):
+    """{author id: [(microseconds, post id), ...] newest first}, in one query."""
+    rank = sa.func.row_number().over(
+        partition_by=Post.user_id,
+        order_by=(Post.timestamp.desc(), Post.id.desc())).label('rank')
+    ranked = sa.select(Post.user_id, Post.id, Post.timestamp, rank).where(
+        Post.user_id.in_(author_ids)).subquery()
+    recent = {author_id: [] for author_id in author_ids}
+    for author_id, post_id, timestamp in db.session.execute(
+            sa.select(ranked.c.user_id, ranked.c.id, ranked.c.timestamp)
+            .where(ranked.c.rank <= limit)
+            .order_by(ranked.c.user_id, ranked.c.rank)):
+        recent[author_id].append(to_entry((timestamp, post_id)))
+    return recent
+
+
+def recent_posts(author_ids):
+    """The cached recent post list of every author, loading the missing ones."""
+    limit = current_app.config['RECENT_POSTS_PER_AUTHOR']
+    keys = [cache_key(author_id) for author_id in author_ids]
+    cached = dict(zip(author_ids, cache.get_many(*keys))) if keys else {}
+    missing = [author_id for author_id, posts in cached.items()
+               if posts is None]
+    if missing:
+        loaded = load_recent_posts(missing, limit)
+        cache.set_many({cache_key(author_id): posts
+                        for author_id, posts in loaded.items()})
+        cached.update(loaded)
+    return cached
+
+
+def merged_page(user, cursor, per_page):
+    """The page of `user`'s home timeline `cursor` points to, or None when
+    the cached lists do not reach that far back."""
+    followed = db.session.scalars(sa.select(followers.c.followed_id).where(
+        followers.c.follower_id == user.id)).all()
+    lists = recent_posts(list({user.id, *followed}))
+    limit = current_app.config['RECENT_POSTS_PER_AUTHOR']
+    # the newest entry that older, uncached posts might come right after
+    horizon = max((posts[-1] for posts in lists.values()
+                   if len(posts) >= limit), default=None)
+    key, direction = decode_cursor(cursor, HOME_KEYS) if cursor \
+        else (None, 'next')
+    start = to_entry(key) if key is not None else None
+    if direction == 'next':
+        merged = heapq.merge(*(
+            (entry for entry in posts if start is None or entry < start)
+            for posts in lists.values()), reverse=True)
+    else:
+        # the lists are newest first, the entries above the cursor are a
+        # head of each, merged oldest first
+        merged = heapq.merge(*(
+            reversed([entry for entry in posts if entry > start])
+            for posts in lists.values()))
+    # one more than the page, to know whether there is another
+    entries = list(islice(merged, per_page + 1))
+    if horizon is not None:
+        if direction == 'next' and (len(entries) <= per_page or
+                                    entries[per_page - 1] < horizon):
+            return None
+        if direction == 'prev' and start < horizon:
+            return None
+    page = make_page([(entry[1], to_key(entry)) for entry in entries],
+                     per_page, key, direction)
+    page.items = Post.in_order(page.items, so.selectinload(Post.author)) \
+        .all() if page.items else []
+    return page
+
+
+def home_page(user, cursor, per_page):
+    """The page of `user`'s home timeline `cursor` points to, read the
+    configured way."""
+    if current_app.config['TIMELINE_BACKEND'] == 'merge':
+        merged = merged_page(user, cursor, per_page)
+        if merged is not None:
+            return merged
+        logger.debug(f'A page of {user.username} is past the cached posts, '
+                     'reading it from the database.')
+    # the same cursors work on the timeline's copy of the keys, which its
+    # index covers
+    keys = TIMELINE_KEYS if user.reads_timeline else HOME_KEYS
+    # the page shows every post's author, load them in one query, not one
+    # per author
+    return paginate(user.home_posts().options(so.selectinload(Post.author)),
+                    keys, cursor, per_page)
+
+
+def note_author(mapper, connection, post):
+    # only the merge backend keeps the lists, the others must not need the
+    # cache to write a post
+    if current_app.config['TIMELINE_BACKEND'] != 'merge':
+        return
+    session = so.object_session(post)
+    if session is not None:
+        session.info.setdefault('changed_authors', set()).add(post.user_id)
+
+
+def forget_authors(session):
+    authors = session.info.pop('changed_authors', None)
+    if authors:
+        cache.delete_many(*(cache_key(author_id) for author_id in authors))
+
+
+def discard_authors(session):
+    session.info.pop('changed_authors', None)
+
+
+db.event.listen(Post, 'after_insert', note_author)
+db.event.listen(Post, 'after_delete', note_author)
+db.event.listen(db.session, 'after_commit', forget_authors)
+db.event.listen(db.session, 'after_rollback', discard_authors)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""Time the hot endpoints in process, through the Flask test client.
+
+The app is built on an in-memory SQLite database seeded with
+`seed_database` (or on an existing seeded SQLite file), a reader and an
+API token are logged in once, and each endpoint is requested a few times
+to warm up and then `--repeat` times on the clock. The page cache is
+off by default so the views themselves are timed, not cache hits.
+
+Results are compared with a JSON baseline; an endpoint whose median got
+slower than the baseline by more than `--threshold` is a regression and
+the script exits with status 1:
+
+    python benchmarks.py --save          # record the baseline
+    python benchmarks.py                 # compare with it after a change
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from base64 import b64encode
+import sqlalchemy as sa
+from app import create_app, db
+from app.cli import seed_database
+from app.models import User, followers
+from config import Config, basedir
+
+logger = logging.getLogger(__name__)
+
+BASELINE = os.path.join(basedir, 'benchmark_baseline.json')
+
+
+class BenchmarkConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    WTF_CSRF_ENABLED = False
+    ELASTICSEARCH_URL = None
+    CACHE_TYPE = 'NullCache'
+    # the merge timeline's author lists are data, not pages, keep them
+    RECENT_POSTS_CACHE_TYPE = 'SimpleCache'
+
+
+def endpoints(reader, author):
+    """(name, method, url, form, expected status) of every benchmark.
+
+    `reader` is the logged-in user, `author` the one whose pages are read.
+    The post submit goes last, it is the only one that writes.
+    """
+    return [
+        ('main.index', 'GET', '/index', None, 200),
+        ('main.explore', 'GET', '/explore', None, 200),
+        ('main.user', 'GET', f'/user/{author.username}', None, 200),
+        ('main.user_popup', 'GET', f'/user/{author.username}/popup', None, 200),
+        ('main.notifications', 'GET', '/notifications?since=0', None, 200),
+        ('api.get_users', 'GET', '/api/users?per_page=100', None, 200),
+        ('api.get_followers', 'GET', f'/api/users/{author.id}/followers?per_page=100',
+         None, 200),
+        ('main.index POST', 'POST', '/index',
+         {'post': 'Benchmarking the post submit path', 'submit': 'Submit'}, 302),
+    ]
+
+
+def pick_users():
+    """The user following the most people, and the one with the most followers."""
+    def most(column):
+        user_id = db.session.scalar(
+            sa.select(column).group_by(column)
+            .order_by(sa.func.count().desc(), column).limit(1))
+        return db.session.get(User, user_id) if user_id is not None else None
+    reader = most(followers.c.follower_id)
+    author = most(followers.c.followed_id)
+    if reader is None or author is None:
+        raise RuntimeError('the database has no follows to benchmark with')
+    return reader, author
+
+
+def time_endpoint(client, method, url, form, status, headers, warmup, repeat):
+    """Seconds taken by each of `repeat` requests, after `warmup` untimed ones."""
+    timings = []
+    for i in range(warmup + repeat):
+        start = time.perf_counter()
+        response = client.open(url, method=method, data=form, headers=headers)
+        elapsed = time.perf_counter() - start
+        if response.status_code != status:
+            raise RuntimeError(f'{method} {url} returned {response.status_code}, '
+                               f'expected {status}')
+        if i >= warmup:
+            timings.append(elapsed)
+    return timings
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'repeat': len(timings),
+        'min': timings[0],
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+        'p95': timings[min(len(timings) - 1, int(0.95 * len(timings)))],
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+    }
+
+
+def run_benchmarks(app, password='password', warmup=5, repeat=50, only=None):
+    """Benchmark every endpoint of `endpoints` on `app`; returns {name: summary}."""
+    with app.app_context():
+        reader, author = pick_users()
+        client = app.test_client()
+        response = client.post('/auth/login', data={
+            'username': reader.username, 'password': password,
+            'submit': 'Sign In'})
+        if response.status_code != 302:
+            raise RuntimeError(f'could not log {reader.username} in')
+        credentials = b64encode(f'{reader.username}:{password}'.encode()).decode()
+        token = client.post('/api/tokens', headers={
+            'Authorization': f'Basic {credentials}'}).get_json()['token']
+        api_headers = {'Authorization': f'Bearer {token}'}
+
+        results = {}
+        for name, method, url, form, status in endpoints(reader, author):
+            if only and name not in only:
+                continue
+            headers = api_headers if url.startswith('/api/') else None
+            timings = time_endpoint(client, method, url, form, status, headers,
+                                    warmup, repeat)
+            results[name] = summarize(timings)
+            logger.info(f'{name}: median {results[name]["median"] * 1e3:.2f} ms')
+        return results
+
+
+def compare(results, baseline, threshold=0.1):
+    """Lines comparing medians with `baseline`, and the names that regressed."""
+    lines = [f"{'endpoint':<22}{'baseline ms':>12}{'now ms':>10}{'change':>9}"]
+    regressions = []
+    for name, summary in results.items():
+        before = baseline.get(name, {}).get('median')
+        now = summary['median']
+        if before is None:
+            lines.append(f'{name:<22}{"-":>12}{now * 1e3:>10.2f}{"new":>9}')
+            continue
+        change = now / before - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        lines.append(f'{name:<22}{before * 1e3:>12.2f}{now * 1e3:>10.2f}'
+                     f'{change:>+9.1%}{flag}')
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='an already seeded SQLite file '
+                        '(default: seed an in-memory database)')
+    parser.add_argument('--users', type=int, default=500,
+                        help='users to seed in memory')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--password', default='password',
+                        help='password of the seeded users')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--cache', default='NullCache',
+                        help='CACHE_TYPE to run with')
+    parser.add_argument('--timeline', choices=['table', 'merge', 'query'],
+                        default=Config.TIMELINE_BACKEND,
+                        help='TIMELINE_BACKEND to run with')
+    parser.add_argument('--only', action='append',
+                        help='benchmark just this endpoint (repeatable)')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true',
+                        help='write the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown of the median that counts as a regression')
+    args = parser.parse_args(argv)
+
+    class RunConfig(BenchmarkConfig):
+        CACHE_TYPE = args.cache
+        TIMELINE_BACKEND = args.timeline
+        if args.database:
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.abspath(args.database)
+
+    app = create_app(RunConfig)
+    if not args.database:
+        with app.app_context():
+            db.create_all()
+            seed_database(args.users, seed=args.seed, password=args.password)
+
+    results = run_benchmarks(app, args.password, args.warmup, args.repeat, args.only)
+
+    if args.save or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Baseline written to {args.baseline}')
+        for name, summary in results.items():
+            print(f'{name:<22}{summary["median"] * 1e3:>10.2f} ms')
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    lines, regressions = compare(results, baseline, args.threshold)
+    print('\n'.join(lines))
+    if regressions:
+        print(f'{len(regressions)} endpoint(s) slower than the baseline by more '
+              f'than {args.threshold:.0%}: {", ".join(regressions)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,6 +22,31 @@ class Config:
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://'
     POSTS_PER_PAGE = 25
+    CACHE_TYPE = os.environ.get('CACHE_TYPE') or 'SimpleCache'
+    QUERY_STATS = os.environ.get('QUERY_STATS') is not None
+    # 'table' reads home pages from the materialized timelines, 'merge'
+    # merges the cached recent posts of the followed authors (app/timeline.py)
+    # and 'query' runs following_posts(); writing a post or a follow with
+    # anything but 'table' marks the timelines it misses as not built
+    TIMELINE_BACKEND = os.environ.get('TIMELINE_BACKEND') or 'table'
+    RECENT_POSTS_PER_AUTHOR = int(os.environ.get('RECENT_POSTS_PER_AUTHOR') or 100)
+    # the merge backend's lists have to be shared by every worker, so a new
+    # post drops its author's list in all of them: RedisCache unless set,
+    # and an in-process cache is refused outside of testing and debugging.
+    # The other backends never use the lists, which stay in an unused
+    # SimpleCache
+    RECENT_POSTS_CACHE_TYPE = os.environ.get('RECENT_POSTS_CACHE_TYPE')
+    # where the FileSystemCache type keeps the lists
+    RECENT_POSTS_CACHE_DIR = os.environ.get('RECENT_POSTS_CACHE_DIR') or \
+        os.path.join(basedir, 'recent_posts')
+    # lists kept by the in-process cache types before they start evicting
+    RECENT_POSTS_CACHE_AUTHORS = int(
+        os.environ.get('RECENT_POSTS_CACHE_AUTHORS') or 100000)
+    # serve Bootstrap and moment.js from static/vendor, downloaded there with
+    # `flask assets fetch`, for load tests on a network without the CDNs
+    LOCAL_ASSETS = os.environ.get('LOCAL_ASSETS') is not None
+    SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR') or \
+        os.path.join(basedir, 'snapshots')
 
     
     LOGGING_LEVEL = logging.DEBUG if os.environ.get('DEBUG') else logging.INFO
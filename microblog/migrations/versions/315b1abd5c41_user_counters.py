@@ -0,0 +1,43 @@
+"""user counters
+
+Revision ID: 315b1abd5c41
+Revises: 834b1a697901
+Create Date: 2026-10-18 09:12:44.318520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '315b1abd5c41'
+down_revision = '834b1a697901'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('followers_total', sa.Integer(),
+                                      server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('following_total', sa.Integer(),
+                                      server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('posts_total', sa.Integer(),
+                                      server_default='0', nullable=False))
+
+    # backfill from the tables the counters summarize
+    op.execute(
+        'UPDATE "user" SET '
+        'followers_total = (SELECT count(*) FROM followers '
+        'WHERE followers.followed_id = "user".id), '
+        'following_total = (SELECT count(*) FROM followers '
+        'WHERE followers.follower_id = "user".id), '
+        'posts_total = (SELECT count(*) FROM post '
+        'WHERE post.user_id = "user".id)')
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('posts_total')
+        batch_op.drop_column('following_total')
+        batch_op.drop_column('followers_total')
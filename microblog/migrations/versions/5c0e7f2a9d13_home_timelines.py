@@ -0,0 +1,48 @@
+"""home timelines
+
+Revision ID: 5c0e7f2a9d13
+Revises: 315b1abd5c41
+Create Date: 2026-10-18 11:40:07.512093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c0e7f2a9d13'
+down_revision = '315b1abd5c41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('timeline',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['author_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'post_id')
+    )
+    with op.batch_alter_table('timeline', schema=None) as batch_op:
+        batch_op.create_index('ix_timeline_user_id_timestamp',
+                              ['user_id', 'timestamp'], unique=False)
+
+    # every timeline starts cold and is built at its user's next login
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('timeline_ready', sa.Boolean(),
+                                      server_default=sa.false(),
+                                      nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('timeline_ready')
+
+    with op.batch_alter_table('timeline', schema=None) as batch_op:
+        batch_op.drop_index('ix_timeline_user_id_timestamp')
+
+    op.drop_table('timeline')
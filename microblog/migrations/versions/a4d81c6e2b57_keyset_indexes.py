@@ -0,0 +1,44 @@
+"""keyset indexes
+
+Revision ID: a4d81c6e2b57
+Revises: 5c0e7f2a9d13
+Create Date: 2026-10-18 14:05:31.284719
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d81c6e2b57'
+down_revision = '5c0e7f2a9d13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.create_index('ix_post_user_id_timestamp_id',
+                              ['user_id', 'timestamp', 'id'], unique=False)
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index('ix_message_recipient_id_timestamp_id',
+                              ['recipient_id', 'timestamp', 'id'], unique=False)
+
+    with op.batch_alter_table('timeline', schema=None) as batch_op:
+        batch_op.drop_index('ix_timeline_user_id_timestamp')
+        batch_op.create_index('ix_timeline_user_id_timestamp_post_id',
+                              ['user_id', 'timestamp', 'post_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('timeline', schema=None) as batch_op:
+        batch_op.drop_index('ix_timeline_user_id_timestamp_post_id')
+        batch_op.create_index('ix_timeline_user_id_timestamp',
+                              ['user_id', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_recipient_id_timestamp_id')
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_user_id_timestamp_id')
@@ -0,0 +1,27 @@
+"""followers followed_id index
+
+Revision ID: b7e3f1c9a2d4
+Revises: a4d81c6e2b57
+Create Date: 2026-10-18 16:42:09.513827
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3f1c9a2d4'
+down_revision = 'a4d81c6e2b57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('followers', schema=None) as batch_op:
+        batch_op.create_index('ix_followers_followed_id', ['followed_id'],
+                              unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('followers', schema=None) as batch_op:
+        batch_op.drop_index('ix_followers_followed_id')
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+"""How the model query methods scale with table size and follower fan-out.
+
+Two sweeps, each over freshly generated data:
+
+- table size: `seed_database` fills the tables with about N posts (N from
+  --sizes) while a probe user keeps the same small neighbourhood, so a
+  method that only looks at the probe's rows should cost about the same
+  at every N. A cost that grows with N means it reads rows that are not
+  the probe's, i.e. a full scan.
+- fan-out: the probe follows and is followed by F users (F from
+  --fanouts), so per-user work is expected to grow at most linearly in F.
+
+Each method is timed at every point and its growth exponent is fitted on
+a log-log scale; a method growing faster than EXPECTED_GROWTH for the
+sweep is flagged, and the script exits with status 1. The SQL each method
+runs is captured and explained at the largest point, and full scans in
+those plans are listed next to the curve:
+
+    python scaling.py --sizes 1000,100000,10000000 --fanouts 1,1000,100000
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import sqlalchemy as sa
+from flask import current_app
+from app import create_app, db
+from app.cli import seed_database, repair_counters, rebuild_timelines
+from app.models import User, Post, Message, followers
+from app.pagination import paginate
+from app.timeline import HOME_KEYS, home_page
+from benchmarks import BenchmarkConfig, summarize
+
+# Largest growth exponent (cost ~ size**k) each sweep should show
+EXPECTED_GROWTH = {'size': 0.3, 'fanout': 1.1}
+# Follows, followers, posts and unread messages of the probe in the size sweep
+PROBE_FANOUT = 10
+PROBE_USERNAME = 'probe'
+
+
+def following_posts(probe):
+    # the first page of the home timeline, as the query backend reads it
+    return paginate(probe.following_posts(), HOME_KEYS, per_page=25).items
+
+
+def home_posts(probe):
+    # the same page, read from the probe's materialized timeline
+    return home_page(probe, None, 25).items
+
+
+def search(probe):
+    if current_app.elasticsearch:
+        return list(Post.search('hello', 1, 25)[0])
+    # without an index, the half of the search the database does, for a
+    # page of hits the index could have returned
+    return Post.in_order(list(range(25, 0, -1))).all()
+
+
+METHODS = {
+    'User.following_posts': following_posts,
+    'User.home_posts': home_posts,
+    'User.followers_count': lambda probe: probe.followers_count(),
+    'User.unread_message_count': lambda probe: probe.unread_message_count(),
+    'SearchableMixin.search': search,
+}
+
+
+def add_probe(rng, fanout):
+    """Create the probe user with `fanout` follows, followers, posts and messages."""
+    now = datetime.now(timezone.utc)
+    probe_id = db.session.scalar(sa.insert(User).returning(User.id), [{
+        'username': PROBE_USERNAME, 'email': f'{PROBE_USERNAME}@example.com'}])
+    db.session.execute(sa.insert(Post), [{
+        'body': f'probe post {i}', 'timestamp': now, 'user_id': probe_id,
+        'language': 'en'} for i in range(PROBE_FANOUT)])
+    db.session.execute(sa.insert(Message), [{
+        'sender_id': sender, 'recipient_id': probe_id, 'body': 'hello probe',
+        'timestamp': now} for sender in sample_users(rng, probe_id, PROBE_FANOUT)])
+    set_fanout(rng, probe_id, fanout)
+    return probe_id
+
+
+def sample_users(rng, probe_id, k):
+    user_ids = db.session.scalars(
+        sa.select(User.id).where(User.id != probe_id)).all()
+    return rng.sample(user_ids, min(k, len(user_ids)))
+
+
+def set_fanout(rng, probe_id, fanout):
+    """Make the probe follow, and be followed by, `fanout` other users."""
+    linked = followers.c.follower_id == probe_id, followers.c.followed_id == probe_id
+    # only these users' counters change, recounting everyone's would cost a
+    # pass over the whole dataset at every step
+    changed = {probe_id, *db.session.scalars(sa.select(sa.case(
+        (linked[0], followers.c.followed_id), else_=followers.c.follower_id)).where(
+        sa.or_(*linked)))}
+    db.session.execute(followers.delete().where(sa.or_(*linked)))
+    others = sample_users(rng, probe_id, fanout)
+    if others:
+        db.session.execute(followers.insert(), [
+            {'follower_id': probe_id, 'followed_id': other} for other in others])
+        db.session.execute(followers.insert(), [
+            {'follower_id': other, 'followed_id': probe_id} for other in others])
+    db.session.commit()
+    repair_counters(changed | set(others))
+    rebuild_timelines(PROBE_USERNAME)
+
+
+@contextmanager
+def captured_statements():
+    """Collect the (statement, parameters) sent to the database inside the block."""
+    statements = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+    sa.event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        yield statements
+    finally:
+        sa.event.remove(db.engine, 'before_cursor_execute', capture)
+
+
+def explain(statements):
+    """The query plan of every statement and the full table scans among them."""
+    sqlite = db.engine.dialect.name == 'sqlite'
+    prefix = 'EXPLAIN QUERY PLAN ' if sqlite else 'EXPLAIN '
+    plans, scans = [], []
+    for statement, parameters in statements:
+        rows = db.session.connection().exec_driver_sql(
+            prefix + statement, parameters).all()
+        plan = [row[-1] if sqlite else row[0] for row in rows]
+        plans.append({'sql': statement, 'plan': plan})
+        for line in plan:
+            line = line.strip()
+            if (sqlite and line.startswith('SCAN ') and 'INDEX' not in line) \
+                    or 'Seq Scan' in line:
+                scans.append(line)
+    return {'statements': plans, 'full_scans': sorted(set(scans))}
+
+
+def time_method(method, probe, warmup, repeat):
+    timings = []
+    for i in range(warmup + repeat):
+        start = time.perf_counter()
+        method(probe)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            timings.append(elapsed)
+        # every call starts from the database, not the identity map
+        db.session.expire_all()
+    return summarize(timings)
+
+
+def measure(points, prepare, warmup, repeat):
+    """Time every method at every point; `prepare(point)` sets the data up."""
+    curves = {name: [] for name in METHODS}
+    plans = {}
+    for i, point in enumerate(points):
+        prepare(point)
+        probe = db.session.scalar(
+            sa.select(User).where(User.username == PROBE_USERNAME))
+        for name, method in METHODS.items():
+            summary = time_method(method, probe, warmup, repeat)
+            curves[name].append({'size': point, **summary})
+            print(f'  {name:<28}{point:>10}{summary["median"] * 1e3:>12.3f} ms',
+                  flush=True)
+            if i == len(points) - 1:
+                with captured_statements() as statements:
+                    method(probe)
+                    db.session.expire_all()
+                plans[name] = explain(statements)
+    return curves, plans
+
+
+def growth(curve):
+    """Least-squares exponent k of median ~ size**k."""
+    points = [(math.log(p['size']), math.log(p['median']))
+              for p in curve if p['size'] > 0 and p['median'] > 0]
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if not spread:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def size_sweep(sizes, seed, warmup, repeat):
+    rng = random.Random(seed)
+
+    def prepare(size):
+        db.drop_all()
+        db.create_all()
+        # about 20 posts, 5 messages and up to 50 follows per user
+        seed_database(max(size // 20, PROBE_FANOUT + 1), seed=seed)
+        add_probe(rng, PROBE_FANOUT)
+        print(f'size {size}: {db.session.scalar(sa.select(sa.func.count(Post.id)))} posts',
+              flush=True)
+    return measure(sizes, prepare, warmup, repeat)
+
+
+def fanout_sweep(fanouts, seed, warmup, repeat):
+    rng = random.Random(seed)
+    db.drop_all()
+    db.create_all()
+    seed_database(max(fanouts) + 1, posts=5, follows=5, messages=1, seed=seed)
+    probe_id = add_probe(rng, 0)
+
+    def prepare(fanout):
+        set_fanout(rng, probe_id, fanout)
+        print(f'fan-out {fanout}', flush=True)
+    return measure(fanouts, prepare, warmup, repeat)
+
+
+def report(results):
+    """Print each method's growth per sweep; returns the flagged (sweep, method)s."""
+    flagged = []
+    print(f"\n{'sweep':<8}{'method':<28}{'exponent':>10}{'expected':>10}  full scans")
+    for sweep, (curves, plans) in results.items():
+        for name, curve in curves.items():
+            exponent = growth(curve)
+            expected = EXPECTED_GROWTH[sweep]
+            scans = plans.get(name, {}).get('full_scans', [])
+            flag = exponent > expected
+            if flag:
+                flagged.append((sweep, name))
+            print(f"{sweep:<8}{name:<28}{exponent:>10.2f}{expected:>10.2f}  "
+                  f"{'; '.join(scans) or '-'}{'  GROWS TOO FAST' if flag else ''}")
+    return flagged
+
+
+def parse_list(value):
+    return [int(float(v)) for v in value.split(',') if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=parse_list, default=[1000, 10000, 100000],
+                        help='approximate post counts of the size sweep')
+    parser.add_argument('--fanouts', type=parse_list, default=[1, 10, 100, 1000],
+                        help='follows and followers of the probe in the fan-out sweep')
+    parser.add_argument('--database-url',
+                        help='where to generate the data (default: a temporary SQLite file)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', default='scaling_results.json')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='scaling-')
+
+    class RunConfig(BenchmarkConfig):
+        SQLALCHEMY_DATABASE_URI = args.database_url or \
+            'sqlite:///' + os.path.join(workdir, 'scaling.db')
+
+    app = create_app(RunConfig)
+    with app.app_context():
+        results = {}
+        if args.sizes:
+            results['size'] = size_sweep(args.sizes, args.seed, args.warmup, args.repeat)
+        if args.fanouts:
+            results['fanout'] = fanout_sweep(args.fanouts, args.seed, args.warmup,
+                                             args.repeat)
+        db.session.remove()
+        db.drop_all()
+    shutil.rmtree(workdir, ignore_errors=True)
+    flagged = report(results)
+
+    with open(args.output, 'w') as f:
+        json.dump({sweep: {'curves': curves, 'plans': plans,
+                           'exponents': {name: growth(curve)
+                                         for name, curve in curves.items()}}
+                   for sweep, (curves, plans) in results.items()}, f, indent=2)
+    print(f'Curves and plans written to {args.output}')
+    return 1 if flagged else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,20 @@
 #!/usr/bin/env python
+from base64 import b64encode
 from datetime import datetime, timezone, timedelta
 import unittest
 import logging
-from app import create_app, db
-from app.models import User, Post
+import os
+import tempfile
+import sqlalchemy as sa
+from werkzeug.exceptions import BadRequest
+from app import create_app, db, recent_posts_cache
+from app.cli import seed_database, save_snapshot, restore_snapshot, \
+    repair_counters, rebuild_timelines
+from app.models import User, Post, timeline
+from app.pagination import paginate
+from app.querystats import query_budget
+from app.timeline import home_page, merged_page
+from benchmarks import run_benchmarks, compare
 from config import Config
 
 
@@ -161,6 +172,372 @@ class UserModelCase(unittest.TestCase):
             db.session.add(u2)
             db.session.commit()
 
+    def test_counters(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        u1.follow(u2)
+        u1.follow(u2)
+        db.session.add_all([Post(body='hi', author=u2),
+                            Post(body='hello', author=u2)])
+        db.session.commit()
+        self.assertEqual((u1.following_count(), u1.followers_count()), (1, 0))
+        self.assertEqual((u2.followers_count(), u2.posts_count()), (1, 2))
+        self.assertEqual(repair_counters(), 0)
+
+        u1.unfollow(u2)
+        db.session.execute(sa.update(User).values(posts_total=7))
+        db.session.commit()
+        self.assertEqual((u1.following_count(), u2.followers_count()), (0, 0))
+        self.assertEqual(repair_counters(), 2)
+        self.assertEqual((u1.posts_count(), u2.posts_count()), (0, 2))
+
+    def test_timeline(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        now = datetime.now(timezone.utc)
+        db.session.add_all([
+            Post(body='old from susan', author=u2,
+                 timestamp=now - timedelta(days=2)),
+            Post(body='old from mary', author=u3,
+                 timestamp=now - timedelta(days=1))])
+        db.session.commit()
+
+        def home(user):
+            return [p.body for p in db.session.scalars(user.home_posts())]
+
+        def rows(user):
+            return db.session.scalar(sa.select(sa.func.count()).select_from(
+                timeline).where(timeline.c.user_id == user.id))
+
+        # cold: served by following_posts(), nothing materialized
+        u1.follow(u2)
+        db.session.commit()
+        self.assertFalse(u1.timeline_ready)
+        self.assertEqual(home(u1), ['old from susan'])
+        self.assertEqual(rows(u1), 0)
+
+        u1.rebuild_timeline()
+        db.session.commit()
+        self.assertEqual(rows(u1), 1)
+        # new posts fan out, follows backfill and unfollows prune
+        db.session.add_all([Post(body='new from susan', author=u2),
+                            Post(body='new from john', author=u1)])
+        u1.follow(u3)
+        db.session.commit()
+        self.assertEqual(home(u1), db.session.scalars(
+            u1.following_posts().with_only_columns(Post.body)).all())
+        self.assertEqual(len(home(u1)), 4)
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(sorted(home(u1)), ['new from john', 'old from mary'])
+        # susan's timeline was never built, so nothing fanned out to it
+        self.assertEqual(rows(u2), 0)
+
+        self.assertEqual(rebuild_timelines(), 2 + 2 + 1)
+        self.assertTrue(all(u.timeline_ready for u in (u1, u2, u3)))
+        self.assertEqual(home(u1), db.session.scalars(
+            u1.following_posts().with_only_columns(Post.body)).all())
+
+        # the other backends do not fan out or backfill, so the timelines
+        # that miss a post stop being read instead of going stale
+        self.app.config['TIMELINE_BACKEND'] = 'query'
+        db.session.add(Post(body='missed by the timelines', author=u3))
+        db.session.commit()
+        self.assertEqual([u.timeline_ready for u in (u1, u2, u3)],
+                         [False, True, False])
+        u2.follow(u3)
+        db.session.commit()
+        self.assertFalse(u2.timeline_ready)
+        self.app.config['TIMELINE_BACKEND'] = 'table'
+        self.assertEqual(home(u1)[0], 'missed by the timelines')
+        self.assertEqual(home(u2)[0], 'missed by the timelines')
+
+    def test_merged_timeline(self):
+        self.app.config['TIMELINE_BACKEND'] = 'merge'
+        self.app.config['RECENT_POSTS_PER_AUTHOR'] = 3
+        seed_database(20, posts=4, follows=5, messages=0, seed=2)
+        u = db.session.scalar(sa.select(User).order_by(
+            User.following_total.desc()).limit(1))
+
+        def pages(read):
+            cursor, ids = None, []
+            while True:
+                result = read(cursor)
+                ids.append([p.id for p in result.items])
+                if not result.has_next:
+                    return ids
+                cursor = result.next_cursor
+
+        expected = pages(lambda cursor: paginate(
+            u.following_posts(), (Post.timestamp, Post.id), cursor, 4))
+        self.assertGreater(len(expected), 2)
+        # the first pages come from the cached lists, the deeper ones from
+        # the database, and both agree with following_posts()
+        first = merged_page(u, None, 4)
+        self.assertIsNotNone(first)
+        self.assertIsNone(merged_page(u, first.next_cursor, 4 * len(expected)))
+        self.assertEqual(pages(lambda cursor: home_page(u, cursor, 4)),
+                         expected)
+        # and back up from the second page
+        second = home_page(u, first.next_cursor, 4)
+        self.assertEqual(home_page(u, second.prev_cursor, 4).items,
+                         first.items)
+        # with every post cached, every page comes from the lists
+        self.app.config['RECENT_POSTS_PER_AUTHOR'] = 100
+        recent_posts_cache.clear()
+        self.assertEqual(pages(lambda cursor: merged_page(u, cursor, 4)),
+                         expected)
+        second = merged_page(u, merged_page(u, None, 4).next_cursor, 4)
+        self.assertEqual(merged_page(u, second.prev_cursor, 4).items,
+                         first.items)
+
+        # a new post drops its author's list from the cache
+        db.session.add(Post(body='newest', author=u))
+        db.session.commit()
+        self.assertEqual(home_page(u, None, 4).items[0].body, 'newest')
+
+    def test_keyset_pagination(self):
+        u = User(username='john', email='john@example.com')
+        now = datetime.now(timezone.utc)
+        # pairs of posts share a timestamp, the id breaks the tie
+        posts = [Post(body=f'post {i}', author=u,
+                      timestamp=now + timedelta(seconds=i // 2))
+                 for i in range(7)]
+        db.session.add_all(posts)
+        db.session.commit()
+        keys = (Post.timestamp, Post.id)
+        query = sa.select(Post)
+
+        page = paginate(query, keys, per_page=3, count=True)
+        self.assertEqual(page.total, 7)
+        self.assertFalse(page.has_prev)
+        seen = [page.items]
+        while page.has_next:
+            page = paginate(query, keys, page.next_cursor, per_page=3)
+            seen.append(page.items)
+        self.assertEqual(seen, [posts[6:3:-1], posts[3:0:-1], posts[:1]])
+        self.assertIsNone(page.total)
+        # and back again
+        page = paginate(query, keys, page.prev_cursor, per_page=3)
+        self.assertEqual(page.items, posts[3:0:-1])
+        page = paginate(query, keys, page.prev_cursor, per_page=3)
+        self.assertEqual((page.items, page.has_prev), (posts[6:3:-1], False))
+
+        with self.assertRaises(BadRequest):
+            paginate(query, keys, 'not-a-cursor', per_page=3)
+
+    def test_seed(self):
+        counts = seed_database(50, posts=4, follows=5, messages=2, seed=1,
+                               password='cat', batch_size=16)
+        self.assertEqual(counts['users'], 50)
+        self.assertEqual(db.session.scalar(
+            sa.select(sa.func.count()).select_from(Post)), counts['posts'])
+        u = db.session.scalar(sa.select(User).where(User.username == 'user7'))
+        self.assertTrue(u.check_password('cat'))
+        self.assertNotIn(u, db.session.scalars(u.following.select()).all())
+        # the counters were written with the rows
+        self.assertEqual(repair_counters(), 0)
+        posts = db.session.scalars(
+            sa.select(Post.body).order_by(Post.id)).all()
+
+        # the same seed gives the same dataset
+        db.drop_all()
+        db.create_all()
+        self.assertEqual(seed_database(50, posts=4, follows=5, messages=2,
+                                       seed=1, password='cat',
+                                       batch_size=16), counts)
+        self.assertEqual(db.session.scalars(
+            sa.select(Post.body).order_by(Post.id)).all(), posts)
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as snapshots:
+            self.app.config['SNAPSHOT_DIR'] = snapshots
+            db.session.add(User(username='john', email='john@example.com'))
+            db.session.commit()
+            save_snapshot('base')
+
+            db.session.add(User(username='susan', email='susan@example.com'))
+            db.session.commit()
+            recent_posts_cache.set('1', [(0, 1)])
+            restore_snapshot('base')
+            self.assertEqual(db.session.scalars(sa.select(User.username)).all(),
+                             ['john'])
+            # nothing cached from before the restore is served
+            self.assertIsNone(recent_posts_cache.get('1'))
+
+    def test_benchmarks(self):
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        seed_database(20, posts=2, follows=3, messages=1, seed=1)
+        results = run_benchmarks(self.app, warmup=0, repeat=2)
+        self.assertIn('main.index POST', results)
+        self.assertEqual(results['api.get_followers']['repeat'], 2)
+
+        baseline = {name: dict(summary, median=summary['median'] / 2)
+                    for name, summary in results.items()}
+        _, regressions = compare(results, baseline, threshold=0.5)
+        self.assertEqual(sorted(regressions), sorted(results))
+        _, regressions = compare(results, results)
+        self.assertEqual(regressions, [])
+
+
+class SharedRecentPostsCase(unittest.TestCase):
+    """Two app instances on one database, like two gunicorn workers."""
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+        class WorkerConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(
+                self.dir.name, 'app.db')
+            TIMELINE_BACKEND = 'merge'
+            RECENT_POSTS_CACHE_TYPE = 'FileSystemCache'
+            RECENT_POSTS_CACHE_DIR = os.path.join(self.dir.name, 'recent_posts')
+
+        self.config = WorkerConfig
+        self.workers = [create_app(WorkerConfig) for _ in range(2)]
+        with self.workers[0].app_context():
+            db.create_all()
+            u1 = User(username='john', email='john@example.com')
+            u2 = User(username='susan', email='susan@example.com')
+            db.session.add_all([u1, u2, Post(body='old from susan', author=u2)])
+            u1.follow(u2)
+            db.session.commit()
+
+    def tearDown(self):
+        with self.workers[0].app_context():
+            db.drop_all()
+        self.dir.cleanup()
+
+    def home(self, worker):
+        with worker.app_context():
+            u = db.session.scalar(sa.select(User).where(User.username == 'john'))
+            return [p.body for p in home_page(u, None, 10).items]
+
+    def test_invalidation_reaches_other_workers(self):
+        first, second = self.workers
+        self.assertEqual(self.home(second), ['old from susan'])
+        with first.app_context():
+            u = db.session.scalar(sa.select(User).where(User.username == 'susan'))
+            db.session.add(Post(body='new from susan', author=u))
+            db.session.commit()
+        # the list the second worker cached was dropped by the first
+        self.assertEqual(self.home(second), ['new from susan', 'old from susan'])
+
+    def test_other_backends_leave_the_cache_alone(self):
+        # the default backend with the lists in a Redis nobody runs
+        class NoRedisConfig(TestConfig):
+            TIMELINE_BACKEND = Config.TIMELINE_BACKEND
+            RECENT_POSTS_CACHE_TYPE = 'RedisCache'
+            REDIS_URL = 'redis://127.0.0.1:1'
+
+        app = create_app(NoRedisConfig)
+        with app.app_context():
+            db.create_all()
+            u = User(username='mary', email='mary@example.com')
+            db.session.add_all([u, Post(body='hi', author=u)])
+            db.session.commit()
+            self.assertEqual(u.posts_count(), 1)
+            db.drop_all()
+
+    def test_in_process_cache_refused(self):
+        class DeployConfig(self.config):
+            TESTING = False
+            RECENT_POSTS_CACHE_TYPE = 'SimpleCache'
+
+        with self.assertRaises(RuntimeError):
+            create_app(DeployConfig)
+
+
+class QueryBudgetCase(unittest.TestCase):
+    # Most queries each request may run, with ten authors on the page. These
+    # are what the pages cost, with no headroom: none of them grows with the
+    # number of authors, so an N+1 goes over. Lower them when a change
+    # saves queries
+    BUDGETS = {
+        ('GET', '/index'): 6,
+        ('GET', '/explore'): 6,
+        ('GET', '/user/user1'): 7,
+        ('GET', '/user/user1/popup'): 4,
+        ('GET', '/notifications'): 3,
+        ('GET', '/api/users'): 3,
+        ('GET', '/api/users/1/followers'): 3,
+        ('GET', '/api/users/1/following?per_page=100'): 3,
+        # one more for the fan-out onto the followers' timelines
+        ('POST', '/index'): 6,
+    }
+
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        users = [User(username=f'user{i}', email=f'user{i}@example.com')
+                 for i in range(11)]
+        for u in users:
+            u.set_password('cat')
+            db.session.add(u)
+        db.session.commit()
+        for u in users[1:]:
+            users[0].follow(u)
+            u.follow(users[0])
+            db.session.add_all([Post(body=f'post {i} from {u.username}',
+                                     author=u) for i in range(2)])
+        db.session.commit()
+        self.client = self.app.test_client()
+        self.client.post('/auth/login', data={
+            'username': 'user0', 'password': 'cat', 'submit': 'Sign In'})
+        credentials = b64encode(b'user0:cat').decode()
+        token = self.client.post('/api/tokens', headers={
+            'Authorization': f'Basic {credentials}'}).get_json()['token']
+        self.api_headers = {'Authorization': f'Bearer {token}'}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_api_cursors(self):
+        data = self.client.get('/api/users?per_page=4&total=1',
+                               headers=self.api_headers).get_json()
+        self.assertEqual(data['_meta'], {'per_page': 4, 'total_items': 11})
+        ids = [user['id'] for user in data['items']]
+        while data['_links']['next']:
+            data = self.client.get(data['_links']['next'],
+                                   headers=self.api_headers).get_json()
+            ids += [user['id'] for user in data['items']]
+        self.assertEqual(ids, list(range(1, 12)))
+        self.assertNotIn('total_items', data['_meta'])
+        data = self.client.get(data['_links']['prev'],
+                               headers=self.api_headers).get_json()
+        self.assertEqual([user['id'] for user in data['items']], [5, 6, 7, 8])
+        response = self.client.get('/api/users?cursor=oops',
+                                   headers=self.api_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_budgets(self):
+        for (method, url), budget in self.BUDGETS.items():
+            with self.subTest(method=method, url=url):
+                headers = self.api_headers if url.startswith('/api/') else None
+                data = {'post': 'hello', 'submit': 'Submit'} \
+                    if method == 'POST' else None
+                with query_budget(budget):
+                    response = self.client.open(url, method=method, data=data,
+                                                headers=headers)
+                self.assertLess(response.status_code, 400)
+
+    def test_failed_statement_timing(self):
+        with query_budget(1), self.assertRaises(sa.exc.OperationalError):
+            db.session.execute(sa.text('SELECT * FROM missing'))
+        db.session.rollback()
+        with query_budget(1):
+            db.session.execute(sa.text('SELECT 1'))
+        # nothing left behind to pair with a later statement
+        self.assertEqual(db.session.connection().info['query_start'], [])
+
     
 if __name__ == '__main__':
     logger.info("Starting unit tests.")